@@ -0,0 +1,135 @@
+"""
+Non-blocking, structured application logging.
+
+Log calls only merge the message arguments and enqueue the record
+(QueueHandler); a single QueueListener thread formats and writes them.  The queue is bounded and a
+full queue drops the record instead of blocking, so a slow terminal or log
+shipper can never stall MQTT ingest.
+
+Per-message debug lines are sampled: SamplingFilter lets through one record
+in `every` for each (logger, message template) below WARNING, so a fleet at
+1 Hz still shows representative traffic without writing every payload.
+
+    listener = applog.setup(level='INFO', fmt='json')
+    log = logging.getLogger('zion.ingest')
+    log.debug("reading for %s", meter, extra={'meter_number': meter})
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+
+_queue_handler = None
+_listener = None
+
+# Attributes every LogRecord has; anything else came in through `extra=`.
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg, plus any `extra` fields."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Pass 1 in `every` records per (logger, template) below `max_level`."""
+
+    def __init__(self, every=100, max_level=logging.INFO):
+        super().__init__()
+        self.every = max(int(every), 1)
+        self.max_level = max_level
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > self.max_level or self.every == 1:
+            return True
+        key = (record.name, record.msg)
+        with self._lock:
+            n = self._seen.get(key, 0)
+            self._seen[key] = n + 1
+        if n % self.every:
+            return False
+        record.sampled = self.every
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks: a full queue drops the record."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup(level='INFO', fmt='text', sample_every=100, sampled_loggers=(), stream=None, max_queue=10000):
+    """
+    Route all logging through a background listener.  Returns the
+    QueueListener (already started, stopped at exit).
+    """
+    global _queue_handler, _listener
+    handler = logging.StreamHandler(stream or sys.stdout)
+    if fmt == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+
+    log_queue = queue.Queue(maxsize=max_queue)
+    queue_handler = DroppingQueueHandler(log_queue)
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        if isinstance(existing, DroppingQueueHandler):
+            root.removeHandler(existing)
+    root.addHandler(queue_handler)
+    _queue_handler = queue_handler
+    root.setLevel(level)
+
+    for name in sampled_loggers:
+        sampled = logging.getLogger(name)
+        for f in list(sampled.filters):
+            if isinstance(f, SamplingFilter):
+                sampled.removeFilter(f)
+        sampled.addFilter(SamplingFilter(sample_every))
+
+    listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(_stop, listener)
+    # Reconfiguring replaces the pipeline; the old listener drains and stops.
+    if _listener is not None:
+        _stop(_listener)
+    _listener = listener
+    return listener
+
+
+def _stop(listener):
+    # QueueListener.stop() fails if it was already stopped.
+    if listener._thread is not None:
+        listener.stop()
+
+
+def dropped():
+    """Records discarded because the log queue was full."""
+    return _queue_handler.dropped if _queue_handler is not None else 0
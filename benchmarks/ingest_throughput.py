@@ -0,0 +1,164 @@
+"""
+Ingest throughput benchmark for zion.mqtt_on_message.
+
+Runs entirely offline against a throwaway SQLite database: N simulated meters
+publish the same JSON payload as publishSensorData() in templates/arduino
+through an in-process broker stand-in (or straight into the callback), and
+the real ingest path (ledger, ingest writer, rollups) handles them.
+
+With --per-message N each device buffers N readings into one JSON array.
+
+Reports readings/sec, p50/p99 latency from callback to committed batch, and
+database growth.  Exits non-zero if --min-rate is not met or readings were
+dropped, so it can gate CI.
+
+    python benchmarks/ingest_throughput.py --meters 200 --messages 50000
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(__file__))
+
+
+def arduino_payload(meter_number, voltage, current_ma, power_mw):
+    # Byte-for-byte the format built by publishSensorData().
+    return ('{"meter_number":"%s","voltage":%.2f,"current":%.2f,"power_consumed":%.2f}'
+            % (meter_number, voltage, current_ma, power_mw / 1000.0))
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def db_size(path):
+    return sum(os.path.getsize(p) for p in (path, path + '-wal') if os.path.exists(p))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the MQTT ingest callback offline.')
+    parser.add_argument('--meters', type=int, default=100)
+    parser.add_argument('--messages', type=int, default=20000, help='total readings to publish')
+    parser.add_argument('--via', choices=('broker', 'direct'), default='broker',
+                        help='deliver through the loopback broker thread or call the callback directly')
+    parser.add_argument('--per-message', type=int, default=1,
+                        help='readings buffered into each payload (batched array format)')
+    parser.add_argument('--verbose', action='store_true',
+                        help="log through the app's logger at DEBUG (per-message lines are sampled)")
+    parser.add_argument('--min-rate', type=float, default=0.0, help='fail if readings/sec is below this')
+    parser.add_argument('--keep', action='store_true', help='keep the temporary database')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='ingest-bench-')
+    db_path = os.path.join(workdir, 'bench.db')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + db_path
+    os.environ['LEDGER_JOURNAL'] = os.path.join(workdir, 'ledger.journal')
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import zion
+    from loopback import LoopbackBroker
+    if args.verbose:
+        zion.app.config['LOG_LEVEL'] = 'DEBUG'
+        zion.configure_logging()
+
+    meters = [f"B{i:012d}" for i in range(args.meters)]
+    with zion.app.app_context():
+        zion.db.create_all()
+        zion.db.session.add_all(
+            zion.User(username=f"bench{i}", password='x', meter_number=m, current_power=1e6)
+            for i, m in enumerate(meters)
+        )
+        zion.db.session.commit()
+    zion.ledger.start()
+    zion.ingest_writer.start()
+    if zion.ingest_pool is not None:
+        zion.ingest_pool.start()
+    size_before = db_size(db_path)
+
+    # Time each reading from the callback to the end of its batch commit.
+    latencies = []
+    write_batch = zion.ingest_writer._write
+
+    def timed_write(batch):
+        write_batch(batch)
+        now = datetime.utcnow()
+        latencies.extend((now - row['reading_time']).total_seconds() for row in batch)
+    zion.ingest_writer._write = timed_write
+
+    broker = LoopbackBroker()
+    if args.via == 'broker':
+        subscriber = broker.client(zion.mqtt_on_message, subscribe=('power/monitor', 'relay/control'))
+        broker.start()
+    else:
+        subscriber = broker.client()  # only used as the callback's `client` argument
+    zion.flask_mqtt_client = broker.client()
+
+    n = args.per_message
+    payloads = []
+    for i in range(0, args.messages, n):
+        meter = meters[(i // n) % len(meters)]
+        readings = [arduino_payload(meter, 220 + random.random() * 10,
+                                    random.random() * 500, random.random() * 50)
+                    for _ in range(min(n, args.messages - i))]
+        # A device buffering readings sends them as one JSON array.
+        payloads.append(readings[0] if n == 1 else '[' + ','.join(readings) + ']')
+
+    sink = None if args.verbose else io.StringIO()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(sink) if sink else contextlib.nullcontext():
+        if args.via == 'broker':
+            for payload in payloads:
+                broker.publish('power/monitor', payload)
+            broker.stop()
+        else:
+            from loopback import LoopbackMessage
+            for payload in payloads:
+                zion.mqtt_on_message(subscriber, None, LoopbackMessage('power/monitor', payload))
+        if zion.ingest_pool is not None:
+            zion.ingest_pool.stop(timeout=60)
+        handled = time.perf_counter() - started
+        zion.ingest_writer.stop(timeout=60)
+        zion.ledger.stop()
+    elapsed = time.perf_counter() - started
+    size_after = db_size(db_path)
+
+    with zion.app.app_context():
+        stored = zion.SensorReading.query.count()
+
+    rate = args.messages / elapsed
+    print(f"meters            {args.meters}")
+    print(f"readings          {args.messages} in {len(payloads)} payloads via {args.via}")
+    print(f"callback rate     {args.messages / handled:,.0f} readings/sec")
+    print(f"end-to-end rate   {rate:,.0f} readings/sec (until last commit)")
+    print(f"commit latency    p50 {percentile(latencies, 0.50) * 1000:.1f} ms, "
+          f"p99 {percentile(latencies, 0.99) * 1000:.1f} ms")
+    print(f"rows stored       {stored} (dropped {zion.ingest_writer.dropped})")
+    if zion.ingest_pool is not None:
+        print(f"shard max depth   {[s['max_depth'] for s in zion.ingest_pool.stats()]}")
+    print(f"power/update sent {broker.published('power/update')}")
+    print(f"db growth         {(size_after - size_before) / 1024:,.0f} KiB "
+          f"({(size_after - size_before) / max(stored, 1):.0f} bytes/reading)")
+
+    if args.keep:
+        print(f"database kept at  {db_path}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if zion.ingest_writer.dropped or stored < args.messages or rate < args.min_rate:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+In-process stand-in for the MQTT broker.
+
+Delivers messages to subscribed callbacks on a single dispatcher thread, the
+same way paho's network loop calls on_message, so ingest can be exercised
+without Mosquitto or a network.  Topic filters support `+` and `#`.
+"""
+import queue
+import threading
+import time
+
+_STOP = object()
+
+
+class LoopbackMessage:
+    """Duck-types paho.mqtt.client.MQTTMessage for on_message callbacks."""
+    __slots__ = ('topic', 'payload', 'qos', 'retain', 'timestamp')
+
+    def __init__(self, topic, payload, qos=0, retain=False):
+        self.topic = topic
+        self.payload = payload if isinstance(payload, bytes) else str(payload).encode()
+        self.qos = qos
+        self.retain = retain
+        self.timestamp = time.monotonic()
+
+
+class _PublishInfo:
+    rc = 0
+    mid = 0
+
+    def wait_for_publish(self, timeout=None):
+        return True
+
+    def is_published(self):
+        return True
+
+
+def topic_matches(topic_filter, topic):
+    f_parts = topic_filter.split('/')
+    t_parts = topic.split('/')
+    for i, part in enumerate(f_parts):
+        if part == '#':
+            return True
+        if i >= len(t_parts) or (part != '+' and part != t_parts[i]):
+            return False
+    return len(f_parts) == len(t_parts)
+
+
+class LoopbackClient:
+    """The subset of paho.mqtt.client.Client the app uses."""
+
+    def __init__(self, broker, userdata=None):
+        self.broker = broker
+        self.userdata = userdata
+        self.on_message = None
+        self.subscriptions = []
+
+    def subscribe(self, topic, qos=0):
+        self.subscriptions.append(topic)
+        return (0, 0)
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.broker.publish(topic, payload, qos, retain)
+        return _PublishInfo()
+
+
+class LoopbackBroker:
+    def __init__(self, max_queue=0):
+        self.clients = []
+        self.delivered = 0
+        self.errors = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._published = {}  # topic -> count, for reporting
+
+    def client(self, on_message=None, subscribe=(), userdata=None):
+        c = LoopbackClient(self, userdata)
+        c.on_message = on_message
+        for topic in subscribe:
+            c.subscribe(topic)
+        self.clients.append(c)
+        return c
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self._published[topic] = self._published.get(topic, 0) + 1
+        self._queue.put(LoopbackMessage(topic, payload if payload is not None else b'', qos, retain))
+
+    def published(self, topic):
+        return self._published.get(topic, 0)
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='loopback-broker', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            msg = self._queue.get()
+            if msg is _STOP:
+                return
+            for c in self.clients:
+                if c.on_message is None:
+                    continue
+                if any(topic_matches(f, msg.topic) for f in c.subscriptions):
+                    try:
+                        c.on_message(c, c.userdata, msg)
+                        self.delivered += 1
+                    except Exception:
+                        self.errors += 1
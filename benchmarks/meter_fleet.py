@@ -0,0 +1,319 @@
+"""
+Virtual meter fleet simulator for load testing.
+
+Spawns thousands of virtual meters that behave like the ESP32 sketch in
+templates/arduino: every meter publishes a reading once per --interval
+seconds on power/monitor (same JSON as publishSensorData) and a heartbeat on
+esp32/status every 5 s.  Meters follow daily load profiles with noise, obey
+relay/control on/off commands, and cut their load when a power/update says
+their balance is exhausted (and restore it after a top-up).
+
+All meters are driven from one scheduler heap, so 50k meters cost one
+thread, not 50k.  Readings go either to the MQTT broker or to
+POST /api/update_consumption (whose response stands in for power/update).
+
+    # create the meters once (before starting the app so the ledger sees them)
+    python benchmarks/meter_fleet.py --meters 20000 --provision sqlite:///cashpower.db
+    python benchmarks/meter_fleet.py --meters 20000 --mqtt 127.0.0.1:1883 --duration 300
+    python benchmarks/meter_fleet.py --meters 2000 --http http://127.0.0.1:5000 --workers 16
+"""
+import argparse
+import heapq
+import json
+import math
+import queue
+import random
+import sys
+import threading
+import time
+
+HEARTBEAT_INTERVAL = 5.0
+HEARTBEAT_PAYLOAD = '{"status":"online"}'
+
+# Relative load by hour of day (0..23); multiplied by each meter's peak watts.
+PROFILES = {
+    'residential': [0.15, 0.12, 0.1, 0.1, 0.12, 0.25, 0.55, 0.7, 0.45, 0.3, 0.25, 0.25,
+                    0.3, 0.3, 0.25, 0.3, 0.45, 0.75, 1.0, 0.95, 0.8, 0.6, 0.4, 0.25],
+    'commercial': [0.1, 0.1, 0.1, 0.1, 0.1, 0.15, 0.3, 0.6, 0.9, 1.0, 1.0, 1.0,
+                   0.9, 1.0, 1.0, 0.95, 0.9, 0.7, 0.4, 0.2, 0.15, 0.1, 0.1, 0.1],
+    'flat': [0.5] * 24,
+}
+PROFILE_WEIGHTS = (('residential', 0.75), ('commercial', 0.2), ('flat', 0.05))
+
+HEARTBEAT = 0
+READING = 1
+
+
+class VirtualMeter:
+    __slots__ = ('meter_number', 'profile', 'peak_mw', 'voltage', 'relay_on',
+                 'remaining', 'energy_mwh', 'readings', 'relay_offs')
+
+    def __init__(self, meter_number, profile, peak_mw):
+        self.meter_number = meter_number
+        self.profile = profile
+        self.peak_mw = peak_mw
+        self.voltage = random.uniform(4.9, 5.1)  # INA219 bus voltage on the demo board
+        self.relay_on = True
+        self.remaining = None  # unknown until the server tells us
+        self.energy_mwh = 0.0
+        self.readings = 0
+        self.relay_offs = 0
+
+    def sample(self, now, interval):
+        """Return (voltage, current_mA, power_mW) for this tick."""
+        if not self.relay_on:
+            return self.voltage, 0.0, 0.0
+        hour = time.localtime(now).tm_hour
+        load = PROFILES[self.profile][hour] * random.lognormvariate(0, 0.25)
+        power_mw = self.peak_mw * load
+        current_ma = power_mw / self.voltage
+        if abs(current_ma) < 1.0:  # same noise filter as the sketch
+            current_ma = 0.0
+        self.energy_mwh += power_mw * interval / 3600.0
+        return self.voltage + random.uniform(-0.02, 0.02), current_ma, power_mw
+
+    def payload(self, now, interval):
+        voltage, current_ma, power_mw = self.sample(now, interval)
+        self.readings += 1
+        return ('{"meter_number":"%s","voltage":%.2f,"current":%.2f,"power_consumed":%.2f}'
+                % (self.meter_number, voltage, current_ma, power_mw / 1000.0))
+
+    def on_power_update(self, remaining):
+        # Sketch: relay OFF when remaining <= 0, ON otherwise.
+        self.remaining = remaining
+        on = remaining > 0
+        if self.relay_on and not on:
+            self.relay_offs += 1
+        self.relay_on = on
+
+    def on_relay_control(self, command):
+        # Sketch: commands only act while there is power left.
+        if self.remaining is not None and self.remaining <= 0:
+            return
+        if command == 'on':
+            self.relay_on = True
+        elif command == 'off':
+            self.relay_on = False
+
+
+def build_fleet(count, prefix, peak_mw, seed):
+    rng = random.Random(seed)
+    names, weights = zip(*PROFILE_WEIGHTS)
+    fleet = {}
+    for i in range(count):
+        meter_number = f"{prefix}{i:0{12 - len(prefix) + 1}d}"
+        profile = rng.choices(names, weights)[0]
+        fleet[meter_number] = VirtualMeter(meter_number, profile, peak_mw * rng.uniform(0.3, 1.5))
+    return fleet
+
+
+####################################
+# Transports
+####################################
+class MqttTransport:
+    def __init__(self, host, port, fleet, heartbeats=True):
+        import paho.mqtt.client as mqtt
+        self.fleet = fleet
+        self.heartbeats = heartbeats
+        self.updates = 0
+        self.errors = 0
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2,
+                                  client_id=f"meter-fleet-{random.randrange(1 << 30)}")
+        self.client.max_queued_messages_set(0)
+        self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message
+        self.client.connect(host, port, 60)
+        self.client.loop_start()
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties=None):
+        client.subscribe([('power/update', 0), ('relay/control', 0)])
+
+    def _on_message(self, client, userdata, msg):
+        try:
+            data = json.loads(msg.payload)
+            meter = self.fleet.get(data.get('meter_number'))
+            if meter is None:
+                return
+            if msg.topic == 'power/update':
+                meter.on_power_update(float(data.get('remaining_power', 0)))
+                self.updates += 1
+            elif msg.topic == 'relay/control':
+                meter.on_relay_control(data.get('command'))
+        except (ValueError, TypeError):
+            self.errors += 1
+
+    def send_reading(self, meter, payload):
+        if self.client.publish('power/monitor', payload).rc != 0:
+            self.errors += 1
+
+    def send_heartbeat(self, meter):
+        if self.heartbeats:
+            self.client.publish('esp32/status', HEARTBEAT_PAYLOAD)
+
+    def backlog(self):
+        return 0
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+class HttpTransport:
+    """POSTs readings from a worker pool; the reply's remaining_power acts as power/update."""
+
+    def __init__(self, base_url, workers, max_backlog=10000):
+        import requests
+        self.url = base_url.rstrip('/') + '/api/update_consumption'
+        self.updates = 0
+        self.errors = 0
+        self._jobs = queue.Queue(maxsize=max_backlog)
+        self._requests = requests
+        self._threads = [threading.Thread(target=self._worker, daemon=True) for _ in range(workers)]
+        for t in self._threads:
+            t.start()
+
+    def _worker(self):
+        session = self._requests.Session()
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            meter, payload = job
+            try:
+                r = session.post(self.url, data=payload, timeout=10,
+                                 headers={'Content-Type': 'application/json'})
+                if r.status_code == 200:
+                    meter.on_power_update(float(r.json().get('remaining_power', 0)))
+                    self.updates += 1
+                else:
+                    self.errors += 1
+            except Exception:
+                self.errors += 1
+
+    def send_reading(self, meter, payload):
+        try:
+            self._jobs.put_nowait((meter, payload))
+        except queue.Full:
+            self.errors += 1  # server can't keep up; count as shed load
+
+    def send_heartbeat(self, meter):
+        pass  # no HTTP equivalent of esp32/status
+
+    def backlog(self):
+        return self._jobs.qsize()
+
+    def close(self):
+        for _ in self._threads:
+            self._jobs.put(None)
+        for t in self._threads:
+            t.join(timeout=10)
+
+
+####################################
+# Scheduler
+####################################
+def run(fleet, transport, interval, duration, report_every=5.0):
+    meters = list(fleet.values())
+    start = time.time()
+    heap = []
+    # Spread first readings over one interval so the fleet doesn't publish in lockstep.
+    for i, meter in enumerate(meters):
+        offset = random.random() * interval
+        heap.append((start + offset, i, READING))
+        heap.append((start + offset + random.random() * HEARTBEAT_INTERVAL, i, HEARTBEAT))
+    heapq.heapify(heap)
+
+    sent = 0
+    last_sent = 0
+    max_lag = 0.0
+    next_report = start + report_every
+    deadline = start + duration if duration else math.inf
+    try:
+        while heap:
+            due, i, kind = heap[0]
+            now = time.time()
+            if now >= deadline:
+                break
+            if due > now:
+                time.sleep(min(due - now, 0.05))
+                continue
+            heapq.heapreplace(heap, (due + (interval if kind == READING else HEARTBEAT_INTERVAL), i, kind))
+            max_lag = max(max_lag, now - due)
+            meter = meters[i]
+            if kind == READING:
+                transport.send_reading(meter, meter.payload(now, interval))
+                sent += 1
+            else:
+                transport.send_heartbeat(meter)
+
+            if now >= next_report:
+                off = sum(1 for m in meters if not m.relay_on)
+                print(f"[{now - start:7.1f}s] {(sent - last_sent) / report_every:9.0f} readings/s  "
+                      f"lag {max_lag * 1000:7.1f} ms  updates {transport.updates}  "
+                      f"relays off {off}  errors {transport.errors}  backlog {transport.backlog()}")
+                sys.stdout.flush()
+                last_sent = sent
+                max_lag = 0.0
+                next_report += report_every
+    except KeyboardInterrupt:
+        pass
+    finally:
+        transport.close()
+    elapsed = time.time() - start
+    print(f"sent {sent} readings from {len(meters)} meters in {elapsed:.1f}s "
+          f"({sent / max(elapsed, 1e-9):.0f}/s), {transport.errors} errors")
+
+
+def provision(database_url, fleet, balance):
+    """Create users for the virtual meters that don't exist yet."""
+    from datetime import datetime
+    from sqlalchemy import create_engine, text
+    created = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f')
+    engine = create_engine(database_url)
+    with engine.begin() as conn:
+        existing = {row[0] for row in conn.execute(text(
+            "SELECT meter_number FROM users WHERE meter_number IS NOT NULL"))}
+        rows = [{'username': f"sim-{m}", 'meter_number': m, 'balance': balance, 'created': created}
+                for m in fleet if m not in existing]
+        if rows:
+            conn.execute(text(
+                "INSERT INTO users (username, password, meter_number, current_power, role, date_created) "
+                "VALUES (:username, 'simulated', :meter_number, :balance, 'user', :created)"), rows)
+    print(f"Provisioned {len(rows)} new meters ({len(fleet) - len(rows)} already existed).")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate a fleet of smart meters.')
+    parser.add_argument('--meters', type=int, default=1000)
+    parser.add_argument('--prefix', default='S', help='meter number prefix (numbers are 13 chars)')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between readings per meter')
+    parser.add_argument('--peak-mw', type=float, default=400.0, help='typical peak load in mW')
+    parser.add_argument('--duration', type=float, default=0, help='seconds to run (0 = until Ctrl-C)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--mqtt', metavar='HOST:PORT', help='publish to this MQTT broker')
+    parser.add_argument('--http', metavar='URL', help='POST to /api/update_consumption on this server')
+    parser.add_argument('--workers', type=int, default=8, help='HTTP worker threads')
+    parser.add_argument('--no-heartbeat', action='store_true')
+    parser.add_argument('--provision', metavar='DATABASE_URL',
+                        help='create users for the virtual meters in this database and exit')
+    parser.add_argument('--balance', type=float, default=50.0, help='starting balance for provisioned meters')
+    args = parser.parse_args()
+
+    fleet = build_fleet(args.meters, args.prefix, args.peak_mw, args.seed)
+    if args.provision:
+        provision(args.provision, fleet, args.balance)
+        return
+    if bool(args.mqtt) == bool(args.http):
+        parser.error('choose exactly one of --mqtt or --http')
+
+    if args.mqtt:
+        host, _, port = args.mqtt.partition(':')
+        transport = MqttTransport(host, int(port or 1883), fleet, heartbeats=not args.no_heartbeat)
+    else:
+        transport = HttpTransport(args.http, args.workers)
+    print(f"Simulating {len(fleet)} meters every {args.interval}s via {'MQTT' if args.mqtt else 'HTTP'}")
+    run(fleet, transport, args.interval, args.duration)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+JSON vs binary telemetry: decode cost and bytes on the wire.
+
+Compares the ESP32 JSON payload (one reading, and a buffered array) with the
+power/monitor/bin struct format from ingest.py, timing the same work
+mqtt_on_message does before touching the ledger: bytes -> reading rows.
+
+    python benchmarks/payload_formats.py --iterations 20000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from ingest import decode_binary_readings, encode_binary_readings, parse_readings  # noqa: E402
+
+METER = 'K000200030005'
+
+
+def json_payload(readings):
+    items = ['{"meter_number":"%s","voltage":%.2f,"current":%.2f,"power_consumed":%.2f,"ts":%d}'
+             % (METER, v, c, p, ts) for ts, v, c, p in readings]
+    return (items[0] if len(items) == 1 else '[' + ','.join(items) + ']').encode()
+
+
+def decode_json(payload, received_at):
+    return parse_readings(json.loads(payload.decode()), received_at)
+
+
+def timeit(fn, payload, iterations):
+    received_at = datetime.utcnow()
+    fn(payload, received_at)  # warm up
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn(payload, received_at)
+    return (time.perf_counter() - started) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    now = int(time.time())
+    print(f"{'readings':>8}  {'format':<7}{'bytes':>8}{'bytes/rdg':>11}{'us/payload':>12}{'us/rdg':>9}")
+    for count in (1, 10, 60):
+        readings = [(now - i, random.uniform(220, 240), random.uniform(0, 500), random.uniform(0, 0.5))
+                    for i in range(count)]
+        payloads = {
+            'json': (json_payload(readings), decode_json),
+            'binary': (encode_binary_readings(METER, readings), decode_binary_readings),
+        }
+        for name, (payload, decode) in payloads.items():
+            assert len(decode(payload, None)) == count
+            per_payload = timeit(decode, payload, max(args.iterations // count, 200))
+            print(f"{count:>8}  {name:<7}{len(payload):>8}{len(payload) / count:>11.1f}"
+                  f"{per_payload * 1e6:>12.1f}{per_payload * 1e6 / count:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
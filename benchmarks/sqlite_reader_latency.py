@@ -0,0 +1,165 @@
+"""
+Reader latency while sensor ingest runs flat out.
+
+Builds a throwaway copy of the sensor_readings/users schema, then runs one
+writer thread committing batches of readings as fast as it can while reader
+threads repeat the dashboard lookups (latest reading + balance for a meter).
+Runs once with SQLite defaults and once with sqlite_profile, and prints
+reader p50/p99/max latency, reader throughput and writer rows/sec.
+
+    python benchmarks/sqlite_reader_latency.py --seconds 10 --readers 8
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, event, text
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import sqlite_profile  # noqa: E402
+
+SCHEMA = (
+    "CREATE TABLE users (id INTEGER PRIMARY KEY, meter_number VARCHAR(50) UNIQUE, current_power FLOAT)",
+    "CREATE TABLE sensor_readings (id INTEGER PRIMARY KEY, meter_number VARCHAR(50), voltage FLOAT, "
+    "current FLOAT, power FLOAT, reading_time DATETIME)",
+    "CREATE INDEX ix_sensor_readings_meter_id ON sensor_readings (meter_number, id DESC)",
+)
+
+LATEST_SQL = text(
+    "SELECT voltage, current, power, reading_time FROM sensor_readings "
+    "WHERE meter_number = :m ORDER BY id DESC LIMIT 1"
+)
+BALANCE_SQL = text("SELECT current_power FROM users WHERE meter_number = :m")
+INSERT_SQL = text(
+    "INSERT INTO sensor_readings (meter_number, voltage, current, power, reading_time) "
+    "VALUES (:meter_number, :voltage, :current, :power, :reading_time)"
+)
+
+
+def make_engine(path, profiled):
+    uri = 'sqlite:///' + path
+    if not profiled:
+        return create_engine(uri)
+    engine = create_engine(uri, **sqlite_profile.engine_options(uri))
+    event.listen(engine, 'connect', sqlite_profile.set_pragmas)
+    return engine
+
+
+def setup(path, meters, seed_rows):
+    engine = create_engine('sqlite:///' + path)
+    with engine.begin() as conn:
+        for ddl in SCHEMA:
+            conn.exec_driver_sql(ddl)
+        conn.execute(text("INSERT INTO users (meter_number, current_power) VALUES (:m, 100.0)"),
+                     [{'m': m} for m in meters])
+        conn.execute(INSERT_SQL, [reading(random.choice(meters)) for _ in range(seed_rows)])
+    engine.dispose()
+
+
+def reading(meter_number):
+    return {
+        'meter_number': meter_number,
+        'voltage': 220 + random.random() * 20,
+        'current': random.random() * 5,
+        'power': random.random() * 0.01,
+        'reading_time': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f'),
+    }
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(profiled, args, meters):
+    workdir = tempfile.mkdtemp(prefix='sqlite-bench-')
+    path = os.path.join(workdir, 'bench.db')
+    try:
+        setup(path, meters, args.seed_rows)
+        engine = make_engine(path, profiled)
+        stop = threading.Event()
+        latencies = []
+        errors = []
+        written = [0]
+        lock = threading.Lock()
+
+        def writer():
+            while not stop.is_set():
+                batch = [reading(random.choice(meters)) for _ in range(args.batch)]
+                try:
+                    with engine.begin() as conn:
+                        conn.execute(INSERT_SQL, batch)
+                        conn.execute(text(
+                            "UPDATE users SET current_power = MAX(current_power - 0.001, 0) "
+                            "WHERE meter_number = :m"), {'m': batch[0]['meter_number']})
+                    written[0] += len(batch)
+                except Exception as e:
+                    errors.append(repr(e))
+
+        def reader():
+            local = []
+            while not stop.is_set():
+                m = random.choice(meters)
+                started = time.perf_counter()
+                try:
+                    with engine.connect() as conn:
+                        conn.execute(LATEST_SQL, {'m': m}).first()
+                        conn.execute(BALANCE_SQL, {'m': m}).scalar()
+                except Exception as e:
+                    errors.append(repr(e))
+                    continue
+                local.append(time.perf_counter() - started)
+            with lock:
+                latencies.extend(local)
+
+        threads = [threading.Thread(target=writer)]
+        threads += [threading.Thread(target=reader) for _ in range(args.readers)]
+        for t in threads:
+            t.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for t in threads:
+            t.join()
+        engine.dispose()
+
+        return {
+            'reads': len(latencies),
+            'reads_per_sec': len(latencies) / args.seconds,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'max_ms': max(latencies, default=0.0) * 1000,
+            'rows_per_sec': written[0] / args.seconds,
+            'errors': len(errors),
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--meters', type=int, default=200)
+    parser.add_argument('--batch', type=int, default=500)
+    parser.add_argument('--seed-rows', type=int, default=50000)
+    args = parser.parse_args()
+
+    meters = [f"K{i:012d}" for i in range(args.meters)]
+    print(f"{args.readers} readers, 1 writer (batch {args.batch}), {args.seconds:.0f}s per profile")
+    print(f"{'profile':<10}{'reads/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'rows/s':>12}{'errors':>8}")
+    for name, profiled in (('default', False), ('tuned', True)):
+        r = run(profiled, args, meters)
+        print(f"{name:<10}{r['reads_per_sec']:>10.0f}{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}"
+              f"{r['max_ms']:>10.2f}{r['rows_per_sec']:>12.0f}{r['errors']:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""
+Small in-process caches for hot read paths.
+"""
+import bisect
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+# Detached copy of a sensor_readings row; templates read the same attributes.
+Reading = namedtuple('Reading', 'meter_number voltage current power reading_time')
+
+# Who owns a meter; enough for lookups that used to hydrate a full User.
+MeterOwner = namedtuple('MeterOwner', 'user_id username role')
+
+
+class LatestReadingCache:
+    """
+    Newest reading per meter, filled by the ingest path.
+
+    Bounded to `max_size` meters with least-recently-used eviction.  A miss
+    falls back to `loader(meter_number)` (the database) and caches the row.
+    """
+
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, reading):
+        with self._lock:
+            current = self._items.get(reading.meter_number)
+            # Late-arriving readings must not replace a newer one.
+            if (current is not None and current.reading_time and reading.reading_time
+                    and current.reading_time > reading.reading_time):
+                self._items.move_to_end(reading.meter_number)
+                return
+            self._items[reading.meter_number] = reading
+            self._items.move_to_end(reading.meter_number)
+            if len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def get(self, meter_number, loader=None):
+        with self._lock:
+            reading = self._items.get(meter_number)
+            if reading is not None:
+                self._items.move_to_end(meter_number)
+                self.hits += 1
+                return reading
+            self.misses += 1
+        if loader is None:
+            return None
+        row = loader(meter_number)
+        if row is None:
+            return None
+        reading = Reading(row.meter_number, row.voltage, row.current, row.power, row.reading_time)
+        self.put(reading)
+        return reading
+
+    def discard(self, meter_number):
+        with self._lock:
+            self._items.pop(meter_number, None)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class MeterDirectory:
+    """
+    meter_number -> MeterOwner, for routes that only need to know who owns a
+    meter.  Misses fall back to `loader(meter_number)` and positive results
+    are cached (LRU, `max_size` meters); unknown meters are not remembered,
+    so a meter registered by another process is found on the next lookup.
+    Call put()/discard() whenever a user's meter, name or role changes.
+    """
+
+    def __init__(self, loader, max_size=100000):
+        self.loader = loader
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, meter_number):
+        if not meter_number:
+            return None
+        with self._lock:
+            owner = self._items.get(meter_number)
+            if owner is not None:
+                self._items.move_to_end(meter_number)
+                self.hits += 1
+                return owner
+            self.misses += 1
+        owner = self.loader(meter_number)
+        if owner is not None:
+            self.put(meter_number, owner)
+        return owner
+
+    def put(self, meter_number, owner):
+        if not meter_number:
+            return
+        with self._lock:
+            self._items[meter_number] = owner
+            self._items.move_to_end(meter_number)
+            if len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def discard(self, *meter_numbers):
+        with self._lock:
+            for meter_number in meter_numbers:
+                self._items.pop(meter_number, None)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class MeterIndex:
+    """
+    Every meter number in sorted order with its MeterOwner, for prefix
+    suggestions (bisect) and existence checks without SQL.
+
+    Filled from `loader()` (an iterable of (meter_number, MeterOwner)) on
+    first use; after that put()/discard() keep it current, so call them
+    whenever a meter is registered, renamed or deleted.  reload() re-reads
+    the database.
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+        self._meters = []
+        self._owners = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if not self._loaded:
+                self._fill()
+
+    def _fill(self):
+        self._owners = {m: owner for m, owner in self.loader() if m}
+        self._meters = sorted(self._owners)
+        self._loaded = True
+
+    def reload(self):
+        with self._lock:
+            self._fill()
+
+    def get(self, meter_number):
+        self._ensure_loaded()
+        return self._owners.get(meter_number)
+
+    def suggest(self, prefix, limit=10):
+        """Up to `limit` (meter_number, MeterOwner) pairs starting with `prefix`, in order."""
+        if not prefix:
+            return []
+        self._ensure_loaded()
+        with self._lock:
+            i = bisect.bisect_left(self._meters, prefix)
+            found = []
+            for meter_number in self._meters[i:i + limit]:
+                if not meter_number.startswith(prefix):
+                    break
+                found.append((meter_number, self._owners[meter_number]))
+            return found
+
+    def put(self, meter_number, owner):
+        if not meter_number:
+            return
+        with self._lock:
+            # Not loaded yet: the load will read it from the database
+            if not self._loaded:
+                return
+            if meter_number not in self._owners:
+                bisect.insort(self._meters, meter_number)
+            self._owners[meter_number] = owner
+
+    def discard(self, *meter_numbers):
+        with self._lock:
+            if not self._loaded:
+                return
+            for meter_number in meter_numbers:
+                if self._owners.pop(meter_number, None) is not None:
+                    del self._meters[bisect.bisect_left(self._meters, meter_number)]
+
+    def __len__(self):
+        return len(self._meters)
+
+
+class ChangeLog:
+    """
+    Monotonic change versions for a set of keys, so pollers can ask "what
+    changed since version N" instead of reloading everything.
+
+    touch(key) stamps `key` with the next version.  Only the newest version
+    per key is kept, oldest first, bounded to `max_size` keys; evicting one
+    raises the floor, and since() answers None (take a full snapshot) for
+    versions below the floor or not issued by this process.  Versions start
+    at the process start time in ms, so a client holding a version from a
+    previous run falls below the floor.
+
+    Versions are per process and mean nothing to another one; a client
+    alternating between processes would miss or repeat changes.  The app
+    runs as a single process (the ledger enforces it, see ledger.py).
+    """
+
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.version = self.floor = int(time.time() * 1000)
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def touch(self, *keys):
+        with self._lock:
+            for key in keys:
+                self.version += 1
+                self._items[key] = self.version
+                self._items.move_to_end(key)
+                if len(self._items) > self.max_size:
+                    _, self.floor = self._items.popitem(last=False)
+            return self.version
+
+    def since(self, version):
+        """(current version, keys changed after `version`), or (current, None) if too old."""
+        with self._lock:
+            if version < self.floor or version > self.version:
+                return self.version, None
+            changed = []
+            for key in reversed(self._items):
+                if self._items[key] <= version:
+                    break
+                changed.append(key)
+            return self.version, changed
+
+    def __len__(self):
+        return len(self._items)
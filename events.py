@@ -0,0 +1,97 @@
+"""
+Server-Sent Events fan-out for live dashboards.
+
+The ingest path publishes each change once; EventBroker serializes it once
+and hands it to every subscriber of that topic.  Each subscriber keeps only
+the newest message per key (e.g. per meter), so a slow browser receives the
+current state instead of a growing backlog.
+
+Each open stream holds a server thread for its whole life (it waits in
+Subscription.drain), so serve the app from a threaded server: the dev
+server with threaded=True, or gunicorn's gthread worker with enough threads
+(see gunicorn.conf.py).  A sync worker would be taken by a single tab.
+"""
+import json
+import threading
+from collections import OrderedDict
+
+
+class Subscription:
+    """Coalescing mailbox for one open SSE connection."""
+
+    def __init__(self, topic):
+        self.topic = topic
+        self._pending = OrderedDict()  # key -> encoded SSE message
+        self._cond = threading.Condition()
+
+    def offer(self, key, message):
+        with self._cond:
+            self._pending.pop(key, None)
+            self._pending[key] = message
+            self._cond.notify()
+
+    def drain(self, timeout):
+        """Wait up to `timeout` seconds and return the queued messages."""
+        with self._cond:
+            if not self._pending:
+                self._cond.wait(timeout)
+            messages = list(self._pending.values())
+            self._pending.clear()
+            return messages
+
+
+class EventBroker:
+    def __init__(self, keepalive=15.0):
+        self.keepalive = keepalive
+        self._topics = {}  # topic -> set of Subscription
+        self._lock = threading.Lock()
+
+    def subscribe(self, topic):
+        sub = Subscription(topic)
+        with self._lock:
+            self._topics.setdefault(topic, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._topics.get(sub.topic)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._topics[sub.topic]
+
+    def subscriber_count(self, topic=None):
+        with self._lock:
+            if topic is not None:
+                return len(self._topics.get(topic, ()))
+            return sum(len(subs) for subs in self._topics.values())
+
+    def publish(self, topic, data, event='message', key=None):
+        """Send `data` (JSON-serializable) to everyone listening on `topic`."""
+        with self._lock:
+            subs = self._topics.get(topic)
+            if not subs:
+                return 0
+            subs = list(subs)
+        message = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        key = (event, key)
+        for sub in subs:
+            sub.offer(key, message)
+        return len(subs)
+
+    def stream(self, topic, initial=None):
+        """Generator of SSE text for a Flask streaming response."""
+        sub = self.subscribe(topic)
+        try:
+            # Tell EventSource to retry quickly if the connection drops.
+            yield "retry: 3000\n\n"
+            if initial is not None:
+                yield f"event: message\ndata: {json.dumps(initial)}\n\n"
+            while True:
+                messages = sub.drain(self.keepalive)
+                if messages:
+                    yield ''.join(messages)
+                else:
+                    yield ": keepalive\n\n"
+        finally:
+            self.unsubscribe(sub)
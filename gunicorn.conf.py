@@ -0,0 +1,26 @@
+# gunicorn -c gunicorn.conf.py zion:app
+#
+# The balance ledger (ledger.py) is owned by exactly one process, so the app
+# runs as a single worker.  The worker starts the ledger, the ingest writer
+# and the MQTT subscriber as soon as it boots; if another process already
+# holds the ledger it fails to boot and gunicorn exits.
+import os
+
+bind = '0.0.0.0:5000'
+workers = 1
+# Every open SSE stream (/api/stream/...) holds a thread for as long as the
+# dashboard is open, so the one worker serves requests from a thread pool
+# sized for the expected number of open dashboards plus ordinary requests.
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 200))
+
+
+def on_starting(server):
+    if server.cfg.workers != 1:
+        raise SystemExit(f"zion runs as a single worker (the balance ledger is per process), "
+                         f"not {server.cfg.workers}")
+
+
+def post_worker_init(worker):
+    import zion
+    zion.start_services()
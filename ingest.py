@@ -0,0 +1,304 @@
+"""
+Group-commit writer for sensor ingest.
+
+MQTT callbacks hand readings to an IngestWriter, which queues them and
+inserts them into sensor_readings in batches, one executemany INSERT per
+transaction.  A batch is flushed as soon as it holds `batch_size` rows or
+`flush_interval` seconds after its first row arrived, whichever comes
+first.  Balances are not touched here; see ledger.py.
+
+`hooks` are called as hook(conn, batch) inside the same transaction as the
+insert, e.g. to maintain rollups (rollups.py).
+
+Devices may buffer readings and send several per message; parse_readings()
+turns any accepted payload shape into reading rows, and submit_many() queues
+them as one unit so they land in the same executemany.
+
+Devices can also publish a compact binary form on power/monitor/bin
+(decode_binary_readings), little-endian:
+
+    header  B version (1), B count, 16s meter_number (ASCII, NUL padded)
+    record  I ts (epoch seconds, 0 = receive time), f voltage, f current,
+            f power_consumed                                  x count
+
+i.e. 18 + 16 * count bytes, versus ~85 bytes of JSON per reading.
+"""
+import atexit
+import logging
+import queue
+import struct
+import threading
+import time
+from datetime import datetime, timezone
+
+log = logging.getLogger(__name__)
+
+_STOP = object()
+
+# Readings stamped further in the future than this are clamped to receive time.
+MAX_CLOCK_SKEW = 60.0
+
+
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct('<BB16s')
+BINARY_RECORD = struct.Struct('<Ifff')
+
+
+class PayloadError(ValueError):
+    pass
+
+
+def _reading_time(value, received_at):
+    """Parse a per-reading `ts` (epoch seconds or ISO 8601) into naive UTC."""
+    if value is None:
+        return received_at
+    try:
+        if isinstance(value, (int, float)):
+            ts = datetime.fromtimestamp(value, timezone.utc).replace(tzinfo=None)
+        else:
+            ts = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+            if ts.tzinfo is not None:
+                ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    except (ValueError, OverflowError, OSError):
+        raise PayloadError(f"Invalid reading timestamp {value!r}")
+    if (ts - received_at).total_seconds() > MAX_CLOCK_SKEW:
+        return received_at
+    return ts
+
+
+def _number(value, name):
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise PayloadError(f"{name} must be a number")
+
+
+def parse_readings(data, received_at=None, max_readings=3600):
+    """
+    Normalize a power/monitor payload into reading rows.
+
+    Accepts a single reading object (the ESP32 format), a list of reading
+    objects, or {"meter_number": ..., "readings": [...]} where the entries
+    share the outer meter_number.  Each reading may carry `ts`; readings
+    without one are stamped with `received_at`.
+    """
+    received_at = received_at or datetime.utcnow()
+    if isinstance(data, dict) and isinstance(data.get('readings'), list):
+        shared = data.get('meter_number')
+        items = [dict(r, meter_number=r.get('meter_number', shared)) if isinstance(r, dict) else r
+                 for r in data['readings']]
+    elif isinstance(data, list):
+        items = data
+    elif isinstance(data, dict):
+        items = [data]
+    else:
+        raise PayloadError("Payload must be a reading object or a list of readings")
+    if len(items) > max_readings:
+        raise PayloadError(f"At most {max_readings} readings per payload")
+
+    rows = []
+    for item in items:
+        if not isinstance(item, dict):
+            raise PayloadError("Each reading must be an object")
+        rows.append({
+            'meter_number': item.get('meter_number'),
+            'voltage': _number(item.get('voltage'), 'voltage'),
+            'current': _number(item.get('current'), 'current'),
+            'power': _number(item.get('power_consumed', 0.0), 'power_consumed') or 0.0,
+            'reading_time': _reading_time(item.get('ts'), received_at),
+        })
+    return rows
+
+
+def decode_binary_readings(payload, received_at=None):
+    """Decode a power/monitor/bin payload into reading rows without copying it."""
+    received_at = received_at or datetime.utcnow()
+    view = memoryview(payload)
+    if len(view) < BINARY_HEADER.size:
+        raise PayloadError("Binary payload shorter than its header")
+    version, count, meter = BINARY_HEADER.unpack_from(view)
+    if version != BINARY_VERSION:
+        raise PayloadError(f"Unsupported binary payload version {version}")
+    end = BINARY_HEADER.size + count * BINARY_RECORD.size
+    if len(view) != end:
+        raise PayloadError(f"Binary payload length {len(view)} does not match {count} records")
+    meter_number = meter.rstrip(b'\0').decode('ascii', 'replace')
+
+    rows = []
+    for ts, voltage, current, power in BINARY_RECORD.iter_unpack(view[BINARY_HEADER.size:end]):
+        rows.append({
+            'meter_number': meter_number,
+            'voltage': voltage,
+            'current': current,
+            'power': power,
+            'reading_time': _reading_time(ts, received_at) if ts else received_at,
+        })
+    return rows
+
+
+def encode_binary_readings(meter_number, readings):
+    """Build a power/monitor/bin payload from (ts, voltage, current, power_consumed) tuples."""
+    readings = list(readings)
+    if len(readings) > 255:
+        raise ValueError("At most 255 readings per binary payload")
+    out = bytearray(BINARY_HEADER.size + len(readings) * BINARY_RECORD.size)
+    BINARY_HEADER.pack_into(out, 0, BINARY_VERSION, len(readings), meter_number.encode('ascii'))
+    offset = BINARY_HEADER.size
+    for ts, voltage, current, power in readings:
+        BINARY_RECORD.pack_into(out, offset, int(ts or 0), voltage or 0.0, current or 0.0, power or 0.0)
+        offset += BINARY_RECORD.size
+    return bytes(out)
+
+
+class IngestWriter:
+    """Bounded queue + background thread that batches sensor readings."""
+
+    def __init__(self, app, db, readings_table, batch_size=500,
+                 flush_interval=0.05, max_queue=10000, put_timeout=0.5, hooks=(), on_write=None,
+                 retries=5, retry_delay=0.1):
+        self.app = app
+        self.db = db
+        self.readings_table = readings_table
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.hooks = list(hooks)
+        self.on_write = on_write  # on_write(rows, seconds) after each committed batch
+        self.retries = retries          # extra attempts for a failed batch, with doubling delay
+        self.retry_delay = retry_delay
+        self.dropped = 0
+        self.failed = 0                 # readings lost after every retry failed
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    ####################################
+    # Producer side
+    ####################################
+    def submit(self, meter_number, voltage, current, power, reading_time=None):
+        """Queue one reading. Returns False if the queue stayed full."""
+        if self._thread is None:
+            self.start()
+        row = {
+            'meter_number': meter_number,
+            'voltage': voltage,
+            'current': current,
+            'power': power,
+            'reading_time': reading_time or datetime.utcnow(),
+        }
+        try:
+            self._queue.put(row, timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            log.warning("Ingest queue full, dropped reading for meter %s.", meter_number)
+            return False
+
+    def submit_many(self, rows):
+        """Queue reading rows (as from parse_readings) to be written together."""
+        if not rows:
+            return True
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put(list(rows), timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            self.dropped += len(rows)
+            log.warning("Ingest queue full, dropped %d readings.", len(rows))
+            return False
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    ####################################
+    # Lifecycle
+    ####################################
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='ingest-writer', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self, timeout=5.0):
+        """Flush whatever is queued and stop the writer thread."""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    ####################################
+    # Writer thread
+    ####################################
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = item if isinstance(item, list) else [item]
+            stopping = False
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                if isinstance(item, list):
+                    batch.extend(item)
+                else:
+                    batch.append(item)
+            self._write(batch)
+            if stopping:
+                # Drain anything that raced in behind the stop marker.
+                rest = []
+                while True:
+                    try:
+                        rest.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                rest = [row for r in rest if r is not _STOP
+                        for row in (r if isinstance(r, list) else [r])]
+                if rest:
+                    self._write(rest)
+                return
+
+    def write(self, batch):
+        """Insert `batch` (and run hooks) in one transaction, in the calling thread."""
+        started = time.perf_counter()
+        with self.app.app_context():
+            with self.db.engine.begin() as conn:
+                conn.execute(self.readings_table.insert(), batch)
+                for hook in self.hooks:
+                    hook(conn, batch)
+        if self.on_write is not None:
+            self.on_write(len(batch), time.perf_counter() - started)
+
+    def _write(self, batch):
+        # The ledger has already debited these readings, so a failed insert
+        # (locked database, full disk) is retried rather than dropped.
+        delay = self.retry_delay
+        for attempt in range(self.retries + 1):
+            try:
+                self.write(batch)
+                return
+            except Exception as e:
+                if attempt == self.retries:
+                    self.failed += len(batch)
+                    log.error("Giving up on batch of %d readings after %d attempts: %s",
+                              len(batch), attempt + 1, e)
+                    return
+                log.warning("Error writing batch of %d readings (attempt %d), retrying in %.1fs: %s",
+                            len(batch), attempt + 1, delay, e)
+                time.sleep(delay)
+                delay = min(delay * 2, 5.0)
@@ -0,0 +1,516 @@
+"""
+In-memory meter balance ledger with write-behind persistence.
+
+The ledger is the authoritative copy of every meter's remaining power while
+the app is running.  Balances live in flat `array('d')` slots indexed by a
+meter_number -> slot dict, so a debit or credit is a dict lookup and two
+float writes; no ORM objects are involved.
+
+Changes reach the `users` table write-behind: a flusher thread applies the
+accumulated per-meter deltas every `flush_interval` seconds and again at
+shutdown.  The thread is started (and the exit flush registered) by
+whichever call loads the ledger first, so every entry point persists
+balances, not only `python zion.py`.  Every change is first appended to a journal file so nothing is
+lost if the process dies between flushes:
+
+    <generation>\t<meter_number>\t<delta>\n
+
+Each flush rotates the journal to `<journal>.<generation>` and commits the
+deltas together with that generation number in `ledger_checkpoint`.  On
+startup, journal lines newer than the committed checkpoint are replayed.
+Admin overwrites are journaled as `=<balance>` and removed meters as `x`,
+so deltas of a deleted or renamed meter are not replayed onto a later
+owner of the same meter number.
+
+Meters missing from memory are looked up in `users` once and the miss is
+remembered for `miss_ttl` seconds, so readings for unregistered meters do
+not query the database each time.  Registering the meter through the
+ledger (add_meter) forgets the miss at once.
+
+Purchases bypass the write-behind path: commit_credit() applies them with a
+single UPDATE ... RETURNING in the caller's transaction, so the credit is
+durable together with its Transaction row, and then re-bases the in-memory
+balance on the returned value.  The journal is flushed to
+the OS on every write and fsync'd by the flusher thread, so a power loss
+can cost at most one flush interval.
+
+Single process only: every process would hold its own diverging copy of
+the balances and replay (and delete) the others' journals.  load() takes an
+exclusive lock on `<journal>.lock` and raises LedgerLocked if another
+process holds it.  The serving process calls start() at startup, so a second
+one fails to boot instead of failing its first balance request; run one app
+process (gunicorn.conf.py pins one worker, and only the serving child of the
+debug reloader touches the ledger).
+"""
+import atexit
+import glob
+import logging
+import os
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, single process is up to the operator
+    fcntl = None
+
+from sqlalchemy import text
+
+log = logging.getLogger(__name__)
+
+_CHECKPOINT_DDL = text(
+    "CREATE TABLE IF NOT EXISTS ledger_checkpoint ("
+    "name VARCHAR(255) PRIMARY KEY, "
+    "generation INTEGER NOT NULL)"
+)
+
+_CHECKPOINT_SQL = text(
+    "INSERT INTO ledger_checkpoint (name, generation) VALUES (:name, :generation) "
+    "ON CONFLICT(name) DO UPDATE SET generation = excluded.generation"
+)
+
+_APPLY_DELTA_SQL = text(
+    "UPDATE users SET current_power = MAX(COALESCE(current_power, 0) + :delta, 0) "
+    "WHERE meter_number = :meter_number"
+)
+
+
+_METER_SQL = text("SELECT current_power FROM users WHERE meter_number = :meter_number")
+
+_SET_SQL = text("UPDATE users SET current_power = :balance WHERE meter_number = :meter_number")
+
+_MOVE_SQL = text(
+    "UPDATE users SET current_power = MAX(COALESCE(current_power, 0) + :delta, 0) "
+    "WHERE id = :user_id RETURNING current_power"
+)
+
+_CREDIT_SQL = text(
+    "UPDATE users SET current_power = MAX(COALESCE(current_power, 0) + :delta, 0) "
+    "WHERE meter_number = :meter_number RETURNING current_power"
+)
+
+
+class LedgerLocked(RuntimeError):
+    """Another process already owns the ledger journal."""
+
+
+class BalanceLedger:
+    """Authoritative per-meter balances, persisted write-behind."""
+
+    def __init__(self, app, db, journal_path, flush_interval=2.0, miss_ttl=30.0, miss_cache_size=100000):
+        self.app = app
+        self.db = db
+        self.journal_path = journal_path
+        self.flush_interval = flush_interval
+        self.miss_ttl = miss_ttl
+        self.miss_cache_size = miss_cache_size
+        self.checkpoint_name = os.path.basename(journal_path)
+
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._index = {}            # meter_number -> slot
+        self._meters = []           # slot -> meter_number (None if free)
+        self._balance = array('d')  # slot -> current balance
+        self._pending = array('d')  # slot -> delta not yet in the database
+        self._dirty = set()         # slots with a non-zero pending delta
+        self._free = []
+        self._missing = OrderedDict()  # meter_number -> time the miss expires
+
+        self._generation = 0
+        self._journal = None
+        self._lock_file = None
+        self._loaded = False
+        self._thread = None
+        self._stopping = threading.Event()
+
+    ####################################
+    # Reads
+    ####################################
+    def get(self, meter_number, default=None):
+        self._ensure_loaded()
+        slot = self._slot(meter_number)
+        if slot is None:
+            return default
+        return self._balance[slot]
+
+    def has(self, meter_number):
+        self._ensure_loaded()
+        return self._slot(meter_number) is not None
+
+    def _slot(self, meter_number):
+        # A miss falls back to the users row, so meters registered by another
+        # process (app.py shares the database) are picked up on first use.
+        slot = self._index.get(meter_number)
+        if slot is not None or not meter_number:
+            return slot
+        now = time.monotonic()
+        with self._lock:
+            expires = self._missing.get(meter_number)
+            if expires is not None and expires > now:
+                return None
+        with self.app.app_context():
+            with self.db.engine.connect() as conn:
+                row = conn.execute(_METER_SQL, {'meter_number': meter_number}).first()
+        with self._lock:
+            if row is None:
+                if meter_number not in self._index:
+                    self._missing[meter_number] = now + self.miss_ttl
+                    self._missing.move_to_end(meter_number)
+                    if len(self._missing) > self.miss_cache_size:
+                        self._missing.popitem(last=False)
+                return self._index.get(meter_number)
+            slot = self._index.get(meter_number)
+            if slot is None:
+                slot = self._add(meter_number)
+                self._balance[slot] = row[0] or 0.0
+            return slot
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self._index)
+
+    def total(self):
+        """Sum of all balances (free slots hold 0)."""
+        self._ensure_loaded()
+        return sum(self._balance)
+
+    ####################################
+    # Writes
+    ####################################
+    def debit(self, meter_number, power):
+        """Consume power. Returns the new balance, or None for an unknown meter."""
+        self._ensure_loaded()
+        if self._slot(meter_number) is None:
+            return None
+        with self._lock:
+            slot = self._index.get(meter_number)
+            if slot is None:
+                return None
+            balance = self._balance[slot]
+            # Same rule as before: only a positive balance drains, never below 0.
+            if balance > 0 and power:
+                applied = min(power, balance)
+                self._apply(slot, meter_number, -applied)
+            return self._balance[slot]
+
+    def credit(self, meter_number, watts):
+        """Add purchased power. Returns the new balance, or None for an unknown meter."""
+        self._ensure_loaded()
+        if self._slot(meter_number) is None:
+            return None
+        with self._lock:
+            slot = self._index.get(meter_number)
+            if slot is None:
+                return None
+            if watts:
+                self._apply(slot, meter_number, watts)
+            return self._balance[slot]
+
+    def commit_credit(self, session, meter_number, watts):
+        """
+        Credit `watts` in the database and commit `session` (which should hold
+        the matching Transaction).  Returns the new balance, or None for an
+        unknown meter.
+        """
+        self._ensure_loaded()
+        # Hold off the flusher so no pending delta lands between our UPDATE and
+        # sync(); otherwise it would be counted twice or not at all.
+        with self._flush_lock:
+            try:
+                balance = session.execute(
+                    _CREDIT_SQL, {'meter_number': meter_number, 'delta': watts or 0.0}
+                ).scalar()
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+            if balance is None:
+                return None
+            return self.sync(meter_number, balance)
+
+    def commit_set(self, session, meter_number, balance):
+        """
+        Overwrite a balance in the database, commit `session` and overwrite
+        the in-memory balance (admin edits).  Unflushed deltas are discarded.
+        """
+        self._ensure_loaded()
+        # As in commit_credit: a flush that already took its deltas must not
+        # apply them on top of the overwrite after our commit.
+        with self._flush_lock:
+            try:
+                session.execute(_SET_SQL, {'meter_number': meter_number, 'balance': balance or 0.0})
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+            self.set(meter_number, balance)
+
+    def commit_rename(self, session, user_id, old_meter, new_meter):
+        """
+        Commit `session`, which moves user `user_id` from `old_meter` to
+        `new_meter` (either may be None), and carry the old meter's unflushed
+        deltas over to the renamed row.  Returns the committed balance.
+        """
+        self._ensure_loaded()
+        # Both locks until the rename is committed: no flush may write the old
+        # meter's deltas and no debit may land on it in the meantime.
+        with self._flush_lock, self._lock:
+            slot = self._index.get(old_meter) if old_meter else None
+            pending = self._pending[slot] if slot is not None else 0.0
+            try:
+                session.flush()
+                balance = session.execute(_MOVE_SQL, {'user_id': user_id, 'delta': pending}).scalar()
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+            if old_meter:
+                self.remove_meter(old_meter)
+            if new_meter:
+                self.set(new_meter, balance)
+            return balance
+
+    def sync(self, meter_number, db_balance):
+        """Re-base a meter on its committed database balance plus unflushed deltas."""
+        self._ensure_loaded()
+        with self._lock:
+            slot = self._index.get(meter_number)
+            if slot is None:
+                slot = self._add(meter_number)
+            self._balance[slot] = (db_balance or 0.0) + self._pending[slot]
+            return self._balance[slot]
+
+    def set(self, meter_number, balance):
+        """
+        Overwrite the in-memory balance of a meter whose database row already
+        holds `balance` (new meters).  Unflushed deltas are discarded; use
+        commit_set() when the database value changes too.
+        """
+        self._ensure_loaded()
+        with self._lock:
+            slot = self._index.get(meter_number)
+            if slot is None:
+                slot = self._add(meter_number)
+            self._journal.write(f"{self._generation}\t{meter_number}\t={balance or 0.0!r}\n")
+            self._journal.flush()
+            self._balance[slot] = balance or 0.0
+            self._pending[slot] = 0.0
+            self._dirty.discard(slot)
+
+    def add_meter(self, meter_number, balance=0.0):
+        if not meter_number:
+            return
+        self.set(meter_number, balance)
+
+    def remove_meter(self, meter_number):
+        self._ensure_loaded()
+        with self._lock:
+            slot = self._index.pop(meter_number, None)
+            if slot is None:
+                return
+            self._journal.write(f"{self._generation}\t{meter_number}\tx\n")
+            self._journal.flush()
+            self._meters[slot] = None
+            self._balance[slot] = 0.0
+            self._pending[slot] = 0.0
+            self._dirty.discard(slot)
+            self._free.append(slot)
+
+    def _add(self, meter_number):
+        if self._free:
+            slot = self._free.pop()
+            self._meters[slot] = meter_number
+        else:
+            slot = len(self._meters)
+            self._meters.append(meter_number)
+            self._balance.append(0.0)
+            self._pending.append(0.0)
+        self._index[meter_number] = slot
+        self._missing.pop(meter_number, None)
+        return slot
+
+    def _apply(self, slot, meter_number, delta):
+        # Journal first, then mutate; caller holds self._lock.
+        self._journal.write(f"{self._generation}\t{meter_number}\t{delta!r}\n")
+        self._journal.flush()
+        self._balance[slot] += delta
+        self._pending[slot] += delta
+        self._dirty.add(slot)
+
+    ####################################
+    # Loading and recovery
+    ####################################
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+
+    def load(self):
+        """Read balances from the database and replay any unflushed journal."""
+        with self._lock:
+            if self._loaded:
+                return
+            self._acquire_journal_lock()
+            with self.app.app_context():
+                with self.db.engine.begin() as conn:
+                    conn.execute(_CHECKPOINT_DDL)
+                    row = conn.execute(
+                        text("SELECT generation FROM ledger_checkpoint WHERE name = :name"),
+                        {'name': self.checkpoint_name}
+                    ).first()
+                    rows = conn.execute(text(
+                        "SELECT meter_number, current_power FROM users "
+                        "WHERE meter_number IS NOT NULL"
+                    )).all()
+            committed = row[0] if row else 0
+
+            stored = {}
+            for meter_number, balance in rows:
+                slot = self._add(meter_number)
+                self._balance[slot] = stored[meter_number] = balance or 0.0
+
+            journals = self._journal_files()
+            newest = committed
+            replayed = 0
+            for path in journals:
+                with open(path) as f:
+                    for line in f:
+                        parts = line.rstrip('\n').split('\t')
+                        if len(parts) != 3:
+                            continue  # torn write at crash time
+                        generation, meter_number, value = int(parts[0]), parts[1], parts[2]
+                        newest = max(newest, generation)
+                        if generation <= committed:
+                            continue
+                        slot = self._index.get(meter_number)
+                        if slot is None:
+                            continue
+                        if value == 'x':
+                            # Removed: what came before belonged to the previous owner.
+                            self._balance[slot] = stored[meter_number]
+                            self._pending[slot] = 0.0
+                            self._dirty.discard(slot)
+                        elif value.startswith('='):
+                            # Absolute overwrite already committed by the caller.
+                            self._balance[slot] = float(value[1:])
+                            self._pending[slot] = 0.0
+                            self._dirty.discard(slot)
+                        else:
+                            self._balance[slot] += float(value)
+                            self._pending[slot] += float(value)
+                            self._dirty.add(slot)
+                        replayed += 1
+
+            self._generation = newest + 1
+            self._journal = open(self.journal_path, 'a')
+            self._loaded = True
+
+        if replayed:
+            log.info("Ledger replayed %d journaled balance changes.", replayed)
+            # Persisting the replay also removes the rotated journals it came from.
+            self.flush()
+        else:
+            for path in journals:
+                if path != self.journal_path:
+                    os.remove(path)
+        self._start_flusher()
+
+    def _acquire_journal_lock(self):
+        if fcntl is None or self._lock_file is not None:
+            return
+        lock_file = open(self.journal_path + '.lock', 'a')
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            raise LedgerLocked(
+                f"{self.journal_path} is in use by another process; "
+                "the balance ledger supports a single app process")
+        # Held (with the file open) for the life of the process.
+        self._lock_file = lock_file
+
+    def _journal_files(self):
+        rotated = glob.glob(glob.escape(self.journal_path) + '.*')
+        rotated.sort(key=lambda p: int(p.rsplit('.', 1)[1]) if p.rsplit('.', 1)[1].isdigit() else -1)
+        files = [p for p in rotated if p.rsplit('.', 1)[1].isdigit()]
+        if os.path.exists(self.journal_path):
+            files.append(self.journal_path)
+        return files
+
+    ####################################
+    # Write-behind persistence
+    ####################################
+    def flush(self):
+        """Write pending deltas to the users table. Returns the number of meters written."""
+        self._ensure_loaded()
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return 0
+                generation = self._generation
+                deltas = []
+                for slot in self._dirty:
+                    deltas.append({'meter_number': self._meters[slot], 'delta': self._pending[slot]})
+                    self._pending[slot] = 0.0
+                self._dirty = set()
+                # Rotate: later changes go to a fresh journal under the next generation.
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+                self._journal.close()
+                rotated = f"{self.journal_path}.{generation}"
+                os.replace(self.journal_path, rotated)
+                self._generation += 1
+                self._journal = open(self.journal_path, 'a')
+
+            try:
+                with self.app.app_context():
+                    with self.db.engine.begin() as conn:
+                        conn.execute(_APPLY_DELTA_SQL, deltas)
+                        conn.execute(_CHECKPOINT_SQL, {'name': self.checkpoint_name, 'generation': generation})
+            except Exception as e:
+                log.error("Error persisting ledger balances: %s", e)
+                # Put the deltas back; the rotated journal stays on disk and is
+                # covered by the next successful checkpoint.
+                with self._lock:
+                    for d in deltas:
+                        slot = self._index.get(d['meter_number'])
+                        if slot is not None:
+                            self._pending[slot] += d['delta']
+                            self._dirty.add(slot)
+                return 0
+
+            for path in self._journal_files():
+                if path != self.journal_path and int(path.rsplit('.', 1)[1]) <= generation:
+                    os.remove(path)
+            return len(deltas)
+
+    def start(self):
+        """Load balances now rather than on first use (loading starts the flusher)."""
+        self._ensure_loaded()
+        self._start_flusher()
+
+    def _start_flusher(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='ledger-flusher', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(self.flush_interval + 5)
+        if self._loaded:
+            self.flush()
+
+    def _run(self):
+        while not self._stopping.wait(self.flush_interval):
+            try:
+                with self._lock:
+                    self._journal.flush()
+                    os.fsync(self._journal.fileno())
+                self.flush()
+            except Exception as e:
+                log.exception("Ledger flusher error")
@@ -0,0 +1,32 @@
+"""add meter lookup indexes
+
+Revision ID: 3f1c2a9b7d10
+Revises:
+Create Date: 2026-10-16 09:12:44.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9b7d10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases created with `flask initdb` already have these, hence if_not_exists.
+    op.create_index('ix_sensor_readings_meter_time', 'sensor_readings',
+                    ['meter_number', sa.text('reading_time DESC')], if_not_exists=True)
+    op.create_index('ix_sensor_readings_meter_id', 'sensor_readings',
+                    ['meter_number', sa.text('id DESC')], if_not_exists=True)
+    op.create_index('ix_transactions_meter_date', 'transactions',
+                    ['meter_number', sa.text('date_purchased DESC')], if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_transactions_meter_date', table_name='transactions', if_exists=True)
+    op.drop_index('ix_sensor_readings_meter_id', table_name='sensor_readings', if_exists=True)
+    op.drop_index('ix_sensor_readings_meter_time', table_name='sensor_readings', if_exists=True)
@@ -0,0 +1,29 @@
+"""add user keyset indexes
+
+Revision ID: 5b9e2f7c1a04
+Revises: c4e7a1d93b52
+Create Date: 2026-10-17 00:21:37.904112
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b9e2f7c1a04'
+down_revision = 'c4e7a1d93b52'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Expression indexes: must match USER_SORT_KEYS in zion.py exactly.
+    op.create_index('ix_users_balance_id', 'users',
+                    [sa.text('coalesce(current_power, 0.0)'), 'id'], if_not_exists=True)
+    op.create_index('ix_users_district_id', 'users',
+                    [sa.text("coalesce(district, '')"), 'id'], if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_users_district_id', table_name='users', if_exists=True)
+    op.drop_index('ix_users_balance_id', table_name='users', if_exists=True)
@@ -0,0 +1,38 @@
+"""add sensor rollups
+
+Revision ID: 8a2d4e6f1b37
+Revises: 3f1c2a9b7d10
+Create Date: 2026-10-16 10:41:07.552913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a2d4e6f1b37'
+down_revision = '3f1c2a9b7d10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'sensor_rollups',
+        sa.Column('meter_number', sa.String(length=50), nullable=False),
+        sa.Column('bucket', sa.String(length=10), nullable=False),
+        sa.Column('bucket_start', sa.DateTime(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.Column('power_sum', sa.Float(), nullable=False),
+        sa.Column('power_min', sa.Float(), nullable=True),
+        sa.Column('power_max', sa.Float(), nullable=True),
+        sa.Column('voltage_sum', sa.Float(), nullable=False),
+        sa.Column('current_sum', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('meter_number', 'bucket', 'bucket_start'),
+        if_not_exists=True
+    )
+    # Existing history is folded in with `flask rollup-backfill`.
+
+
+def downgrade():
+    op.drop_table('sensor_rollups', if_exists=True)
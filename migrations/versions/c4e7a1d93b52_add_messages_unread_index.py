@@ -0,0 +1,25 @@
+"""add messages unread index
+
+Revision ID: c4e7a1d93b52
+Revises: 8a2d4e6f1b37
+Create Date: 2026-10-16 23:58:10.514327
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e7a1d93b52'
+down_revision = '8a2d4e6f1b37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_messages_receiver_unread_sender', 'messages',
+                    ['receiver_id', 'is_read', 'sender_id'], if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_messages_receiver_unread_sender', table_name='messages', if_exists=True)
@@ -0,0 +1,41 @@
+"""add users_fts trigram search index
+
+Revision ID: e3a8c6f0d215
+Revises: 5b9e2f7c1a04
+Create Date: 2026-10-17 00:48:02.117930
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3a8c6f0d215'
+down_revision = '5b9e2f7c1a04'
+branch_labels = None
+depends_on = None
+
+COLUMNS = 'username, meter_number, phone, province, district, sector'
+NEW = ', '.join('new.' + c for c in COLUMNS.split(', '))
+OLD = ', '.join('old.' + c for c in COLUMNS.split(', '))
+
+
+def upgrade():
+    # Same definitions as user_search.CREATE_STATEMENTS (used by `flask initdb`).
+    op.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5({COLUMNS}, "
+               f"content='users', content_rowid='id', tokenize='trigram')")
+    op.execute(f"CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN "
+               f"INSERT INTO users_fts(rowid, {COLUMNS}) VALUES (new.id, {NEW}); END")
+    op.execute(f"CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN "
+               f"INSERT INTO users_fts(users_fts, rowid, {COLUMNS}) VALUES ('delete', old.id, {OLD}); END")
+    op.execute(f"CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE OF {COLUMNS} ON users BEGIN "
+               f"INSERT INTO users_fts(users_fts, rowid, {COLUMNS}) VALUES ('delete', old.id, {OLD}); "
+               f"INSERT INTO users_fts(rowid, {COLUMNS}) VALUES (new.id, {NEW}); END")
+    # Index the users that already exist
+    op.execute("INSERT INTO users_fts(users_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    op.execute("DROP TRIGGER IF EXISTS users_fts_au")
+    op.execute("DROP TRIGGER IF EXISTS users_fts_ad")
+    op.execute("DROP TRIGGER IF EXISTS users_fts_ai")
+    op.execute("DROP TABLE IF EXISTS users_fts")
@@ -8,6 +8,8 @@ import paho.mqtt.client as mqtt
 from flasgger import Swagger, swag_from
 from flask import send_file
 from flask_cors import CORS
+import sqlite_profile
+from report_builder import ReportBuilder
 
 app = Flask(__name__)
 CORS(app, supports_credentials=True)
@@ -53,7 +55,12 @@ mqtt_port = 1884
 basedir = os.path.abspath(os.path.dirname(__file__))
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'energy_system.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = sqlite_profile.engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+# Meter reports are memoized per meter for this many seconds (purchases,
+# readings and user edits invalidate them)
+app.config['REPORT_CACHE_TTL'] = 5.0
 db = SQLAlchemy(app)
+sqlite_profile.install(app, db)
 
 ####################################
 # Database Models
@@ -97,6 +104,9 @@ class SensorReading(db.Model):
     power = db.Column(db.Float, default=0.0)
     reading_time = db.Column(db.DateTime, default=datetime.utcnow)
 
+# /api/port_report and /port_report
+reports = ReportBuilder(db, User, Transaction, SensorReading, ttl=app.config['REPORT_CACHE_TTL'])
+
 ####################################
 @app.cli.command('initdb')
 def initdb():
@@ -327,6 +337,7 @@ def admin_api_users():
 def admin_api_users_update(user_id):
     user = User.query.get_or_404(user_id)
     data = request.json or {}
+    old_meter = user.meter_number
     user.username = data.get('username', user.username)
     user.meter_number = data.get('meter_number', user.meter_number)
     user.province = data.get('province', user.province)
@@ -337,6 +348,7 @@ def admin_api_users_update(user_id):
     except (ValueError, TypeError):
         pass
     db.session.commit()
+    reports.invalidate(old_meter, user.meter_number)
     return jsonify({"success": True})
 
 @app.route('/admin/api/users/<int:user_id>/delete', methods=['DELETE'])
@@ -353,6 +365,7 @@ def admin_api_users_delete(user_id):
     user = User.query.get_or_404(user_id)
     db.session.delete(user)
     db.session.commit()
+    reports.invalidate(user.meter_number)
     return jsonify({"success": True})
 
 @app.route('/admin/other_users', endpoint='other_admin_users')
@@ -413,6 +426,7 @@ def admin_buy_electricity():
             )
             db.session.add(new_transaction)
             db.session.commit()
+            reports.invalidate(meter_number)
             flash(f"Successfully purchased {purchased_watts:.2f} W for {user.username}.", "success")
         else:
             flash("User (meter) not found!", "error")
@@ -489,6 +503,7 @@ def user_buy_electricity():
             purchase_power=purchased_watts     # ✅
         ))
         db.session.commit()
+        reports.invalidate(user.meter_number)
 
         if request.is_json:
             return jsonify({"success": True, "message": f"You purchased {purchased_watts:.2f} W for yourself.","power": purchased_watts})
@@ -520,6 +535,7 @@ def user_buy_electricity():
             purchase_power=purchased_watts     # ✅
         ))
         db.session.commit()
+        reports.invalidate(other_meter)
 
         if request.is_json:
             return jsonify({"success": True, "message": f"You purchased {purchased_watts:.2f} W for {other_user.username}.","power": purchased_watts})
@@ -564,33 +580,17 @@ def admin_users_page():
     'responses': {200: {'description': 'Power report (JSON)'},404: {'description': 'Meter not found'}}
 })
 def api_port_report_json(meter_number):
-    user = User.query.filter_by(meter_number=meter_number).first()
-    if not user:
+    report = reports.build(meter_number)
+    if report is None:
         return jsonify({'error': 'Meter not found'}), 404
 
-    latest_transaction = (Transaction.query
-                          .filter_by(user_id=user.id)
-                          .order_by(Transaction.date_purchased.desc())
-                          .first())
-
-    latest_reading = (SensorReading.query
-                      .filter_by(meter_number=meter_number)
-                      .order_by(SensorReading.reading_time.desc())
-                      .first())
-
-    purchased_power = latest_transaction.purchase_power if latest_transaction else 0.0
-    purchased_date = latest_transaction.date_purchased.strftime("%Y-%m-%d %H:%M:%S") if latest_transaction else "N/A"
-    current_power = user.current_power or 0.0
-    consumed_power = max(purchased_power - current_power, 0.0)
-    latest_date = latest_reading.reading_time.strftime("%Y-%m-%d %H:%M:%S") if latest_reading else "N/A"
-
     return jsonify({
         'meter_number': meter_number,
-        'latest_purchased_power': round(purchased_power, 2),
-        'current_power': round(current_power, 2),
-        'consumed_power': round(consumed_power, 2),
-        'purchased_date': purchased_date,
-        'latest_date': latest_date
+        'latest_purchased_power': round(report['purchased_power'], 2),
+        'current_power': round(report['current_power'], 2),
+        'consumed_power': round(max(report['consumed_power'], 0.0), 2),
+        'purchased_date': report['purchased_date'],
+        'latest_date': report['latest_date']
     })
 
 ####################################
@@ -604,34 +604,18 @@ def api_port_report_json(meter_number):
     'responses': {200: {'description': 'Power report HTML page'},404: {'description': 'Meter not found'}}
 })
 def api_port_report_html(meter_number):
-    user = User.query.filter_by(meter_number=meter_number).first()
-    if not user:
+    report = reports.build(meter_number)
+    if report is None:
         return "Meter not found", 404
 
-    latest_transaction = (Transaction.query
-                          .filter_by(user_id=user.id)
-                          .order_by(Transaction.date_purchased.desc())
-                          .first())
-
-    latest_reading = (SensorReading.query
-                      .filter_by(meter_number=meter_number)
-                      .order_by(SensorReading.reading_time.desc())
-                      .first())
-
-    purchased_power = latest_transaction.purchase_power if latest_transaction else 0.0
-    purchased_date = latest_transaction.date_purchased.strftime("%Y-%m-%d %H:%M:%S") if latest_transaction else "N/A"
-    current_power = user.current_power or 0.0
-    consumed_power = max(purchased_power - current_power, 0.0)
-    latest_date = latest_reading.reading_time.strftime("%Y-%m-%d %H:%M:%S") if latest_reading else "N/A"
-
     return render_template(
         'report.html',
         meter_number=meter_number,
-        purchased_power=purchased_power,
-        current_power=current_power,
-        consumed_power=consumed_power,
-        purchased_date=purchased_date,
-        latest_date=latest_date
+        purchased_power=report['purchased_power'],
+        current_power=report['current_power'],
+        consumed_power=max(report['consumed_power'], 0.0),
+        purchased_date=report['purchased_date'],
+        latest_date=report['latest_date']
     )
 
 ####################################
@@ -708,6 +692,7 @@ def api_update_consumption():
         )
         db.session.add(sr)
         db.session.commit()
+        reports.invalidate(meter_number)
         print(f"API Update - Updated user {meter_number}: remaining power = {user.current_power}")
         return jsonify({'status': 'OK', 'remaining_power': "{:.2f}".format(user.current_power)})
     else:
@@ -788,6 +773,7 @@ def mqtt_on_message(client, userdata, msg):
             )
             db.session.add(sr)
             db.session.commit()
+            reports.invalidate(meter_number)
     except Exception as e:
         print("Error processing MQTT message:", e)
 
@@ -0,0 +1,130 @@
+"""
+Per-meter power report shared by the JSON and HTML report routes.
+
+One statement fetches the owner's balance, the latest purchase and the time
+of the latest reading (correlated subqueries, each answered from the
+meter/time indexes where they exist), instead of three queries per request.
+
+Results are memoized per meter for `ttl` seconds (LRU, `max_size` meters).
+Call invalidate() when a purchase is recorded or the meter's owner changes,
+and record_reading() (or invalidate()) when readings are ingested.  Pass
+`balance(meter_number)` to read the balance from somewhere live, such as the
+in-memory ledger, instead of users.current_power.
+
+    reports = ReportBuilder(db, User, Transaction, SensorReading)
+    report = reports.build('K000200030005')   # dict, or None if unknown
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import bindparam, select
+from sqlalchemy.orm import aliased
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class ReportBuilder:
+    """Meter reports from one statement, memoized per meter."""
+
+    def __init__(self, db, user, transaction, reading, ttl=5.0, max_size=10000, balance=None):
+        self.db = db
+        self.ttl = ttl
+        self.max_size = max_size
+        self.balance = balance
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+        purchase = aliased(transaction)
+        latest_purchase = (select(purchase.id)
+                           .where(purchase.meter_number == user.meter_number)
+                           .order_by(purchase.date_purchased.desc())
+                           .limit(1)
+                           .correlate(user)
+                           .scalar_subquery())
+        latest_reading_at = (select(reading.reading_time)
+                             .where(reading.meter_number == user.meter_number)
+                             .order_by(reading.reading_time.desc())
+                             .limit(1)
+                             .correlate(user)
+                             .scalar_subquery())
+        self._statement = (select(user.current_power,
+                                  transaction.purchase_power,
+                                  transaction.date_purchased,
+                                  latest_reading_at)
+                           .select_from(user)
+                           .outerjoin(transaction, transaction.id == latest_purchase)
+                           .where(user.meter_number == bindparam('meter_number'))
+                           .limit(1))
+
+    def _facts(self, meter_number):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._items.get(meter_number)
+            if entry is not None and entry[0] > now:
+                self._items.move_to_end(meter_number)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        row = self.db.session.execute(self._statement, {'meter_number': meter_number}).first()
+        if row is None:
+            # Unknown meters are not remembered; one may be registered any time
+            return None
+        facts = tuple(row)
+        with self._lock:
+            self._items[meter_number] = (now + self.ttl, facts)
+            self._items.move_to_end(meter_number)
+            if len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+        return facts
+
+    def build(self, meter_number):
+        """
+        Report for `meter_number`, or None if no user has that meter:
+        meter_number, purchased_power, purchased_date, current_power,
+        consumed_power (since the latest purchase) and latest_date.
+        Dates are formatted, "N/A" when missing; numbers are not rounded.
+        """
+        facts = self._facts(meter_number)
+        if facts is None:
+            return None
+        stored_power, purchased_power, purchased_at, latest_reading_at = facts
+        if self.balance is not None:
+            current_power = self.balance(meter_number)
+        else:
+            current_power = stored_power
+        current_power = current_power or 0.0
+        if purchased_power is None:
+            purchased_power, purchased_at = 0.0, None
+        return {
+            'meter_number': meter_number,
+            'purchased_power': purchased_power,
+            'purchased_date': purchased_at.strftime(DATE_FORMAT) if purchased_at else "N/A",
+            'current_power': current_power,
+            'consumed_power': purchased_power - current_power,
+            'latest_date': latest_reading_at.strftime(DATE_FORMAT) if latest_reading_at else "N/A",
+        }
+
+    def record_reading(self, meter_number, reading_time):
+        """A reading was ingested: move the memoized latest reading time forward."""
+        with self._lock:
+            entry = self._items.get(meter_number)
+            if entry is None:
+                return
+            expires, facts = entry
+            if reading_time and (facts[3] is None or reading_time > facts[3]):
+                self._items[meter_number] = (expires, facts[:3] + (reading_time,))
+
+    def invalidate(self, *meter_numbers):
+        with self._lock:
+            for meter_number in meter_numbers:
+                self._items.pop(meter_number, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
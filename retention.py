@@ -0,0 +1,114 @@
+"""
+Retention / downsampling for sensor data.
+
+Raw sensor_readings are only kept for a short window; older history lives on
+in sensor_rollups (rollups.py), which are themselves pruned per bucket.  All
+cutoffs are aligned to midnight UTC so a rollup bucket is never built from a
+partially deleted day.  Rows are deleted in small batches (one transaction
+each) so the ingest writer is never locked out for long, and freed pages are
+handed back with PRAGMA incremental_vacuum.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from rollups import rebuild
+
+_FMT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def day_cutoff(days, now=None):
+    """Midnight UTC `days` days ago, or None if `days` is None (keep forever)."""
+    if days is None:
+        return None
+    now = now or datetime.utcnow()
+    return (now - timedelta(days=days)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def delete_in_batches(engine, table, where, params, batch_size=5000, key='rowid'):
+    """Run DELETE ... LIMIT batch_size repeatedly; returns rows deleted."""
+    stmt = text(
+        f"DELETE FROM {table} WHERE {key} IN "
+        f"(SELECT {key} FROM {table} WHERE {where} LIMIT :batch_size)"
+    )
+    total = 0
+    while True:
+        with engine.begin() as conn:
+            deleted = conn.execute(stmt, dict(params, batch_size=batch_size)).rowcount
+        total += deleted
+        if deleted < batch_size:
+            return total
+
+
+def ensure_incremental_vacuum(engine):
+    """
+    Switch the database to auto_vacuum=INCREMENTAL.
+
+    The mode of an existing database only changes after a full VACUUM, so that
+    is done once here (it rewrites the file and needs exclusive access).
+    """
+    with engine.connect() as conn:
+        mode = conn.exec_driver_sql("PRAGMA auto_vacuum").scalar()
+    if mode == 2:
+        return False
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.exec_driver_sql("VACUUM")
+    return True
+
+
+def incremental_vacuum(engine, pages=None):
+    """Return up to `pages` free pages (all by default) to the OS; returns the free page count before."""
+    pragma = "PRAGMA incremental_vacuum" if pages is None else f"PRAGMA incremental_vacuum({int(pages)})"
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        freed = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+        # sqlite3's execute() only steps the pragma once (one page);
+        # executescript() runs it to completion.
+        conn.connection.driver_connection.executescript(pragma + ";")
+    return freed
+
+
+def rebuild_days(engine, cutoff):
+    """
+    Rebuild the rollups of every day before `cutoff` that still has raw
+    readings, one transaction per day so a long backlog never holds the
+    write lock for more than a day's worth of readings.  Returns the days.
+    """
+    with engine.connect() as conn:
+        days = conn.execute(text(
+            "SELECT substr(reading_time, 1, 10) AS day, MIN(id), MAX(id) FROM sensor_readings "
+            "WHERE reading_time < :cutoff GROUP BY day ORDER BY day"
+        ), {'cutoff': cutoff.strftime(_FMT)}).all()
+    for day, first_id, last_id in days:
+        start = datetime.strptime(day, '%Y-%m-%d')
+        with engine.begin() as conn:
+            rebuild(conn, start=start, end=start + timedelta(days=1), id_range=(first_id, last_id))
+    return len(days)
+
+
+def apply_retention(engine, raw_days=7, rollup_days=None, batch_size=5000, now=None):
+    """
+    Prune raw readings older than `raw_days` and rollups older than
+    `rollup_days[bucket]` (None = keep forever).  Returns deleted row counts.
+    """
+    rollup_days = rollup_days or {}
+    counts = {}
+
+    raw_cutoff = day_cutoff(raw_days, now)
+    if raw_cutoff is not None:
+        # Make sure the rollups cover what is about to be dropped.  The ingest
+        # hook normally keeps them current; this catches rows written before
+        # rollups existed or while the hook was failing.
+        rebuild_days(engine, raw_cutoff)
+        counts['raw'] = delete_in_batches(
+            engine, 'sensor_readings', "reading_time < :cutoff",
+            {'cutoff': raw_cutoff.strftime(_FMT)}, batch_size, key='id')
+
+    for bucket, days in rollup_days.items():
+        cutoff = day_cutoff(days, now)
+        if cutoff is None:
+            continue
+        counts[bucket] = delete_in_batches(
+            engine, 'sensor_rollups', "bucket = :bucket AND bucket_start < :cutoff",
+            {'bucket': bucket, 'cutoff': cutoff.strftime(_FMT)}, batch_size)
+    return counts
@@ -0,0 +1,159 @@
+"""
+Pre-aggregated sensor reading rollups.
+
+For every meter, sensor_rollups holds one row per minute, hour and day
+bucket with the reading count, sum/min/max of power and the voltage and
+current sums (averages are sum / count).  The ingest writer folds each
+batch into these rows inside the same transaction as the raw insert, so
+charts can be drawn from O(buckets) rows instead of O(readings).
+
+The ingest upsert runs on SQLite and PostgreSQL (both have INSERT ... ON
+CONFLICT DO UPDATE).  rebuild(), and so `flask rollup-backfill` and
+`flask prune-readings`, uses SQLite date functions and is SQLite only.
+"""
+from datetime import datetime
+
+from sqlalchemy import func, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+BUCKETS = ('minute', 'hour', 'day')
+
+# Dialects with an ON CONFLICT upsert: (insert construct, two-argument min, max)
+_UPSERTS = {
+    'sqlite': (sqlite.insert, func.min, func.max),
+    'postgresql': (postgresql.insert, func.least, func.greatest),
+}
+
+# strftime patterns matching how SQLAlchemy stores DateTime values in SQLite
+_SQL_FORMATS = {
+    'minute': '%Y-%m-%d %H:%M:00.000000',
+    'hour': '%Y-%m-%d %H:00:00.000000',
+    'day': '%Y-%m-%d 00:00:00.000000',
+}
+
+
+def bucket_start(ts, bucket):
+    if bucket == 'minute':
+        return ts.replace(second=0, microsecond=0)
+    if bucket == 'hour':
+        return ts.replace(minute=0, second=0, microsecond=0)
+    if bucket == 'day':
+        return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Unknown bucket {bucket!r}")
+
+
+def aggregate(readings, buckets=BUCKETS):
+    """Fold reading dicts (as queued by IngestWriter) into rollup rows."""
+    rows = {}
+    for r in readings:
+        meter_number = r['meter_number']
+        if meter_number is None:
+            continue
+        power = r['power'] or 0.0
+        voltage = r['voltage'] or 0.0
+        current = r['current'] or 0.0
+        ts = r['reading_time'] or datetime.utcnow()
+        for bucket in buckets:
+            key = (meter_number, bucket, bucket_start(ts, bucket))
+            row = rows.get(key)
+            if row is None:
+                rows[key] = {
+                    'meter_number': meter_number,
+                    'bucket': bucket,
+                    'bucket_start': key[2],
+                    'count': 1,
+                    'power_sum': power,
+                    'power_min': power,
+                    'power_max': power,
+                    'voltage_sum': voltage,
+                    'current_sum': current,
+                }
+            else:
+                row['count'] += 1
+                row['power_sum'] += power
+                row['power_min'] = min(row['power_min'], power)
+                row['power_max'] = max(row['power_max'], power)
+                row['voltage_sum'] += voltage
+                row['current_sum'] += current
+    return list(rows.values())
+
+
+class RollupWriter:
+    """Ingest hook: merges each written batch into sensor_rollups."""
+
+    def __init__(self, rollups_table):
+        self.table = rollups_table
+        self._upserts = {}
+
+    def upsert(self, dialect_name):
+        """The merge statement for `dialect_name` (built once per dialect)."""
+        stmt = self._upserts.get(dialect_name)
+        if stmt is not None:
+            return stmt
+        if dialect_name not in _UPSERTS:
+            raise NotImplementedError(f"sensor rollups need SQLite or PostgreSQL, not {dialect_name}")
+        insert, least, greatest = _UPSERTS[dialect_name]
+        stmt = insert(self.table)
+        excluded = stmt.excluded
+        c = self.table.c
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[c.meter_number, c.bucket, c.bucket_start],
+            set_={
+                'count': c.count + excluded.count,
+                'power_sum': c.power_sum + excluded.power_sum,
+                'power_min': least(c.power_min, excluded.power_min),
+                'power_max': greatest(c.power_max, excluded.power_max),
+                'voltage_sum': c.voltage_sum + excluded.voltage_sum,
+                'current_sum': c.current_sum + excluded.current_sum,
+            }
+        )
+        self._upserts[dialect_name] = stmt
+        return stmt
+
+    def __call__(self, conn, readings):
+        rows = aggregate(readings)
+        if rows:
+            conn.execute(self.upsert(conn.dialect.name), rows)
+
+
+def rebuild(conn, start=None, end=None, buckets=BUCKETS, id_range=None):
+    """
+    Recompute rollups from raw sensor_readings for [start, end).
+
+    Existing rows for the same buckets are replaced, so this is safe to run
+    repeatedly.  `start` and `end` should be aligned to day boundaries so no
+    bucket is only partly covered.  `id_range` (first, last reading id, both
+    included) narrows the scan to a primary key range; it must cover every
+    reading in [start, end).  SQLite only.
+    """
+    if conn.dialect.name != 'sqlite':
+        raise NotImplementedError("rollups.rebuild() uses SQLite date functions")
+    where = ["meter_number IS NOT NULL"]
+    params = {}
+    if id_range is not None:
+        where.append("id BETWEEN :first_id AND :last_id")
+        params['first_id'], params['last_id'] = id_range
+    if start is not None:
+        where.append("reading_time >= :start")
+        params['start'] = start.strftime('%Y-%m-%d %H:%M:%S.%f')
+    if end is not None:
+        where.append("reading_time < :end")
+        params['end'] = end.strftime('%Y-%m-%d %H:%M:%S.%f')
+    total = 0
+    for bucket in buckets:
+        result = conn.execute(text(
+            "INSERT INTO sensor_rollups "
+            "(meter_number, bucket, bucket_start, count, power_sum, power_min, power_max, "
+            "voltage_sum, current_sum) "
+            "SELECT meter_number, :bucket, strftime(:fmt, reading_time), COUNT(*), "
+            "TOTAL(power), MIN(COALESCE(power, 0)), MAX(COALESCE(power, 0)), "
+            "TOTAL(voltage), TOTAL(current) "
+            "FROM sensor_readings WHERE " + " AND ".join(where) + " "
+            "GROUP BY meter_number, strftime(:fmt, reading_time) "
+            "ON CONFLICT(meter_number, bucket, bucket_start) DO UPDATE SET "
+            "count = excluded.count, power_sum = excluded.power_sum, "
+            "power_min = excluded.power_min, power_max = excluded.power_max, "
+            "voltage_sum = excluded.voltage_sum, current_sum = excluded.current_sum"
+        ), dict(params, bucket=bucket, fmt=_SQL_FORMATS[bucket]))
+        total += result.rowcount
+    return total
@@ -0,0 +1,66 @@
+"""
+Production SQLite profile shared by the app variants.
+
+SQLite's defaults (rollback journal, synchronous=FULL, 2 MB cache) make every
+MQTT ingest commit block the Flask readers.  This profile switches the
+database to WAL so readers never wait for the writer, relaxes fsyncs to WAL
+checkpoints, gives each connection a bigger page cache plus a memory map,
+and waits on lock contention instead of failing with "database is locked".
+
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = sqlite_profile.engine_options(uri)
+    db = SQLAlchemy(app)
+    sqlite_profile.install(app, db)
+"""
+from sqlalchemy import event
+
+# Applied in order on every new DBAPI connection.
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('busy_timeout', 5000),        # ms
+    ('cache_size', -65536),        # negative = KiB, so 64 MiB per connection
+    ('mmap_size', 268435456),      # 256 MiB
+    ('temp_store', 'MEMORY'),
+)
+
+# Threaded Flask handlers plus the ingest writer, ledger flusher and CLI jobs
+# each hold a connection briefly; WAL lets them read concurrently, so keep a
+# modest pool around instead of reconnecting (and re-running PRAGMAs).
+POOL_OPTIONS = {
+    'pool_size': 10,
+    'max_overflow': 20,
+    'pool_timeout': 10,
+    'pool_recycle': 3600,
+}
+
+
+def engine_options(database_uri, pool=True):
+    """SQLALCHEMY_ENGINE_OPTIONS for `database_uri` (empty for non-SQLite URIs)."""
+    if not database_uri.startswith('sqlite'):
+        return {}
+    options = {'connect_args': {'check_same_thread': False, 'timeout': 5}}
+    # In-memory databases use a single static connection; pool sizing doesn't apply.
+    if pool and ':memory:' not in database_uri and database_uri.rstrip('/') != 'sqlite:':
+        options.update(POOL_OPTIONS)
+    return options
+
+
+def set_pragmas(dbapi_connection, connection_record=None, pragmas=PRAGMAS):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas:
+            cursor.execute(f"PRAGMA {name} = {value}")
+    finally:
+        cursor.close()
+
+
+def install(app, db, pragmas=PRAGMAS):
+    """Run `pragmas` on every connection the app's engine opens."""
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _on_connect(dbapi_connection, connection_record):
+        set_pragmas(dbapi_connection, connection_record, pragmas)
@@ -45,16 +45,28 @@ function updateCurrentPower() {
       if (data.error) {
         console.error(data.error);
       } else {
-        const currentPower = data.current_power;
-        document.getElementById('currentPowerDisplay').innerText = `${currentPower} W`;
-        checkPowerCondition(currentPower);
+        showCurrentPower(data.current_power);
       }
     })
     .catch(err => { console.error("Error fetching current power:", err); });
 }
 
-setInterval(updateCurrentPower, 1000);
-updateCurrentPower();
+function showCurrentPower(currentPower) {
+  document.getElementById('currentPowerDisplay').innerText = `${currentPower} W`;
+  checkPowerCondition(currentPower);
+}
+
+// Live updates are pushed by the server; fall back to polling without EventSource.
+if (window.EventSource) {
+  window.meterStream = window.meterStream || new EventSource(`/api/stream/meter/${meterNumber}`);
+  window.meterStream.addEventListener('message', (event) => {
+    const data = JSON.parse(event.data);
+    showCurrentPower(data.current_power);
+  });
+} else {
+  setInterval(updateCurrentPower, 1000);
+  updateCurrentPower();
+}
 
 // ---------------------
 // Refresh Button for Sensor Reading
@@ -94,32 +106,62 @@ buyForSelect.addEventListener('change', (e) => {
 // ---------------------
 // Live Feedback for Other's Meter Number Existence
 // ---------------------
+// Suggestions come from /api/meters/suggest (an in-memory index, no SQL);
+// an exact match is listed first.
 const meterFeedback = document.getElementById('meterFeedback');
+const otherMeterSuggestions = document.getElementById('otherMeterSuggestions');
+let meterSuggestTimer = null;
+let meterSuggestRequest = 0;
+
+function setMeterFeedback(text, ok) {
+  meterFeedback.innerText = text;
+  meterFeedback.classList.toggle('text-green-600', ok);
+  meterFeedback.classList.toggle('text-red-600', !ok);
+}
+
+function suggestOtherMeters() {
+  const meterVal = otherMeterInput.value.trim();
+  if (meterVal.length === 0) {
+    meterFeedback.innerText = '';
+    if (otherMeterSuggestions) otherMeterSuggestions.replaceChildren();
+    return;
+  }
+  const current = ++meterSuggestRequest;
+  fetch(`/api/meters/suggest?prefix=${encodeURIComponent(meterVal)}`)
+    .then(response => {
+      if (response.status === 401) throw new Error('Please log in first.');
+      return response.json();
+    })
+    .then(data => {
+      if (current !== meterSuggestRequest) return;
+      if (otherMeterSuggestions) {
+        otherMeterSuggestions.replaceChildren(...data.meters.map(meter => {
+          const option = document.createElement('option');
+          option.value = meter.meter_number;
+          // Owners are only sent to admins
+          if (meter.username) option.label = meter.username;
+          return option;
+        }));
+      }
+      if (data.exists) {
+        const owner = data.meters[0].username;
+        setMeterFeedback(owner ? `Meter exists for user: ${owner}` : 'Meter found.', true);
+      } else if (data.meters.length) {
+        meterFeedback.innerText = '';
+      } else {
+        setMeterFeedback('No user found for that meter number.', false);
+      }
+    })
+    .catch(err => {
+      if (current !== meterSuggestRequest) return;
+      setMeterFeedback(err.message === 'Please log in first.' ? err.message : 'Error checking meter.', false);
+    });
+}
+
 if (otherMeterInput) {
   otherMeterInput.addEventListener('input', () => {
-    const meterVal = otherMeterInput.value.trim();
-    if (meterVal.length === 0) {
-      meterFeedback.innerText = '';
-      return;
-    }
-    fetch(`/admin/check_meter?meter=${encodeURIComponent(meterVal)}`)
-      .then(response => response.json())
-      .then(data => {
-        if (data.exists) {
-          meterFeedback.innerText = `Meter exists for user: ${data.username}`;
-          meterFeedback.classList.remove('text-red-600');
-          meterFeedback.classList.add('text-green-600');
-        } else {
-          meterFeedback.innerText = 'No user found for that meter number.';
-          meterFeedback.classList.remove('text-green-600');
-          meterFeedback.classList.add('text-red-600');
-        }
-      })
-      .catch(err => {
-        meterFeedback.innerText = 'Error checking meter.';
-        meterFeedback.classList.remove('text-green-600');
-        meterFeedback.classList.add('text-red-600');
-      });
+    clearTimeout(meterSuggestTimer);
+    meterSuggestTimer = setTimeout(suggestOtherMeters, 150);
   });
 }
 
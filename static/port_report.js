@@ -20,6 +20,45 @@ function updatePortReport() {
       });
   }
   
-  setInterval(updatePortReport, 2000);
   updatePortReport();
-  
\ No newline at end of file
+
+  // Keep the current/consumed figures live from the meter's event stream.
+  // A balance that goes up means a purchase (or an admin edit), which changes
+  // the purchased figures too, so the whole report is refetched.  Apps
+  // without the stream (report.py, app.py) or without EventSource poll.
+  let reportPolling = null;
+  function pollPortReport() {
+    if (!reportPolling) reportPolling = setInterval(updatePortReport, 2000);
+  }
+
+  if (window.EventSource) {
+    const reportStream = new EventSource(`/api/stream/meter/${meterNumber}`);
+    let lastCurrent = null;
+    let streamOpened = false;
+    reportStream.onopen = () => { streamOpened = true; };
+    reportStream.onmessage = (event) => {
+      const data = JSON.parse(event.data);
+      const current = parseFloat(data.current_power);
+      if (lastCurrent !== null && current > lastCurrent) {
+        lastCurrent = current;
+        updatePortReport();
+        return;
+      }
+      lastCurrent = current;
+      const purchased = parseFloat(document.getElementById('reportLatestPurchasedPower').innerText) || 0;
+      document.getElementById('reportCurrentPower').innerText = current.toFixed(2) + " W";
+      document.getElementById('reportConsumedPower').innerText = (purchased - current).toFixed(2) + " W";
+      if (data.reading_time) {
+        document.getElementById('reportLatestDate').innerText = data.reading_time;
+      }
+    };
+    reportStream.onerror = () => {
+      // Never connected (no such endpoint) or gave up reconnecting: poll instead
+      if (!streamOpened || reportStream.readyState === EventSource.CLOSED) {
+        reportStream.close();
+        pollPortReport();
+      }
+    };
+  } else {
+    pollPortReport();
+  }
@@ -0,0 +1,222 @@
+// Keyset-paged, virtually scrolled admin user table.
+//
+// Pages come from /admin/api/users?limit=&sort=&order= and are fetched in
+// order, only when the table is scrolled towards them.  Only the rows in view
+// (plus a margin) are in the DOM; two spacer rows keep the scrollbar sized
+// for the full count from /admin/api/users/count.  refresh() applies the
+// delta feed (?since=) to the rows already loaded, and recounts only when
+// its `members` version shows users were added or removed.
+//
+//   const pages = createUserPages({
+//     scroller: document.getElementById('usersScroller'),
+//     tbody: document.getElementById('usersTableBody'),
+//     columns: 5, rowHeight: 64,
+//     renderRow: user => `<tr>...</tr>`,     // HTML string or a <tr> element
+//     onCount: data => { ... }               // {count, meters, total_power}
+//   });
+//   pages.reset({sort: 'balance', order: 'desc', search: ''});
+
+function createUserPages(options) {
+  const scroller = options.scroller;
+  const tbody = options.tbody;
+  const columns = options.columns;
+  const rowHeight = options.rowHeight || 64;
+  const pageSize = options.pageSize || 200;
+  const overscan = options.overscan || 10;
+  const renderRow = options.renderRow;
+  const onCount = options.onCount || (() => {});
+
+  let rows = [];            // loaded rows, in server order
+  let byId = new Map();     // id -> index in rows
+  let byMeter = new Map();  // meter_number -> id
+  let members = null;       // membership version of the last count
+  let next = null;          // cursor for the next page
+  let done = false;
+  let loading = null;
+  let total = 0;
+  let version = 0;
+  let generation = 0;       // bumped by reset(); stale responses are ignored
+  let frozen = false;
+  // An empty sort means the server default: id, or relevance when searching
+  let view = {sort: '', order: 'asc', search: ''};
+
+  function query(params) {
+    return Object.entries(params)
+      .filter(([k, v]) => v !== '')
+      .map(([k, v]) => `${encodeURIComponent(k)}=${encodeURIComponent(v)}`)
+      .join('&');
+  }
+
+  function index() {
+    byId = new Map();
+    byMeter = new Map();
+    rows.forEach((user, i) => {
+      byId.set(user.id, i);
+      if (user.meter_number) byMeter.set(user.meter_number, user.id);
+    });
+  }
+
+  function loadPage() {
+    if (done) return Promise.resolve();
+    if (loading) return loading;
+    const current = generation;
+    const params = {limit: pageSize, sort: view.sort, order: view.order, search: view.search};
+    if (next) Object.assign(params, next);
+    loading = fetch(`/admin/api/users?${query(params)}`)
+      .then(response => response.json())
+      .then(data => {
+        if (current !== generation) return;
+        // Changes after the first page's version are picked up by refresh()
+        if (!rows.length) version = data.version;
+        data.users.forEach(user => {
+          byId.set(user.id, rows.length);
+          if (user.meter_number) byMeter.set(user.meter_number, user.id);
+          rows.push(user);
+        });
+        next = data.next;
+        done = !data.next;
+      })
+      .finally(() => {
+        if (current === generation) loading = null;
+      });
+    return loading;
+  }
+
+  function loadCount() {
+    const current = generation;
+    return fetch(`/admin/api/users/count?${query({search: view.search})}`)
+      .then(response => response.json())
+      .then(data => {
+        if (current !== generation) return;
+        total = data.count;
+        members = data.members;
+        onCount(data);
+        render();
+      });
+  }
+
+  function toElement(row) {
+    if (typeof row !== 'string') return row;
+    const template = document.createElement('template');
+    template.innerHTML = row.trim();
+    return template.content.firstElementChild;
+  }
+
+  function spacer(height) {
+    const tr = document.createElement('tr');
+    tr.setAttribute('aria-hidden', 'true');
+    const td = document.createElement('td');
+    td.colSpan = columns;
+    td.style.cssText = `height:${height}px;padding:0;border:0`;
+    tr.appendChild(td);
+    return tr;
+  }
+
+  function render() {
+    if (frozen) return;
+    const count = Math.max(total, rows.length);
+    const first = Math.max(0, Math.floor(scroller.scrollTop / rowHeight) - overscan);
+    const last = Math.min(count, Math.ceil((scroller.scrollTop + scroller.clientHeight) / rowHeight) + overscan);
+    if (last > rows.length && !done) {
+      // Keyset pages can only be walked in order: fetch until the view is covered
+      loadPage().then(render).catch(err => console.error('Error loading users:', err));
+    }
+    const start = Math.min(first, rows.length);
+    const end = Math.min(last, rows.length);
+    const visible = rows.slice(start, end).map(user => {
+      const tr = toElement(renderRow(user));
+      tr.style.height = `${rowHeight}px`;
+      return tr;
+    });
+    tbody.replaceChildren(spacer(start * rowHeight), ...visible, spacer((count - end) * rowHeight));
+  }
+
+  function reset(newView) {
+    view = Object.assign({}, view, newView || {});
+    generation++;
+    rows = [];
+    byId = new Map();
+    byMeter = new Map();
+    next = null;
+    done = false;
+    loading = null;
+    total = 0;
+    scroller.scrollTop = 0;
+    return Promise.all([loadCount(), loadPage().then(render)]);
+  }
+
+  function update(user) {
+    const i = byId.get(user.id);
+    if (i !== undefined) {
+      const old = rows[i];
+      if (old.meter_number && old.meter_number !== user.meter_number) byMeter.delete(old.meter_number);
+      rows[i] = user;
+    } else if (done) {
+      // Past the last page: a new user; it takes its sorted place on the next reset
+      byId.set(user.id, rows.length);
+      rows.push(user);
+      total++;
+    } else {
+      return;
+    }
+    if (user.meter_number) byMeter.set(user.meter_number, user.id);
+  }
+
+  function remove(id) {
+    if (!byId.has(id)) return;
+    rows.splice(byId.get(id), 1);
+    total = Math.max(0, total - 1);
+    index();
+  }
+
+  // Apply changes since the last version to the loaded rows.  Sort positions
+  // are not recomputed; a reset() re-sorts.
+  function refresh() {
+    const current = generation;
+    const params = {since: version, snapshot: 0, search: view.search};
+    return fetch(`/admin/api/users?${query(params)}`)
+      .then(response => response.json())
+      .then(data => {
+        if (current !== generation) return;
+        if (data.full) return reset();
+        data.users.forEach(update);
+        data.removed.forEach(remove);
+        version = data.version;
+        // Balance changes leave the count alone; only additions and removals recount
+        if (data.members !== members) loadCount();
+        if (data.users.length || data.removed.length) render();
+      });
+  }
+
+  // Pushed balance for a meter (SSE); returns the row if it is loaded
+  function setBalance(meterNumber, currentPower) {
+    const id = byMeter.get(meterNumber);
+    if (id === undefined) return null;
+    const user = rows[byId.get(id)];
+    user.current_power = currentPower;
+    return user;
+  }
+
+  let scheduled = false;
+  scroller.addEventListener('scroll', () => {
+    if (scheduled) return;
+    scheduled = true;
+    requestAnimationFrame(() => {
+      scheduled = false;
+      render();
+    });
+  });
+
+  return {
+    reset,
+    refresh,
+    render,
+    setBalance,
+    loadCount,
+    freeze(value) {
+      frozen = value;
+      if (!frozen) render();
+    },
+    get view() { return Object.assign({}, view); }
+  };
+}
@@ -0,0 +1,43 @@
+"""
+Shared fixtures: zion runs against a throwaway SQLite database and ledger
+journal, created before the app module is imported.
+"""
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+_workdir = tempfile.mkdtemp(prefix='zion-tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_workdir, 'test.db')
+os.environ['LEDGER_JOURNAL'] = os.path.join(_workdir, 'ledger.journal')
+
+import zion  # noqa: E402
+
+
+def pytest_sessionfinish(session, exitstatus):
+    # Final flush now, while the journal directory still exists
+    zion.ledger.stop()
+    atexit.unregister(zion.ledger.stop)
+    shutil.rmtree(_workdir, ignore_errors=True)
+
+
+@pytest.fixture
+def app():
+    """zion.app on empty tables (in-process caches are keyed by unique meters)."""
+    with zion.app.app_context():
+        zion.db.drop_all()
+        zion.db.create_all()
+    yield zion.app
+    with zion.app.app_context():
+        zion.db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,21 @@
+"""Test data helpers."""
+import itertools
+
+import zion
+
+_meters = itertools.count(1)
+
+
+def new_meter():
+    """A meter number no other test has used (the app's caches outlive a test)."""
+    return f"T{next(_meters):012d}"
+
+
+def add_user(username=None, meter_number=None, current_power=10.0, **fields):
+    meter_number = meter_number or new_meter()
+    user = zion.User(username=username or f"user-{meter_number}", password='x',
+                     meter_number=meter_number, role=fields.pop('role', 'user'),
+                     current_power=current_power, **fields)
+    zion.db.session.add(user)
+    zion.db.session.commit()
+    return user
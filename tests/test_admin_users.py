@@ -0,0 +1,105 @@
+"""/admin/api/users: keyset pages and the `since` change feed."""
+import pytest
+
+import zion
+from tests.helpers import add_user
+
+DISTRICTS = ['Gasabo', 'Kicukiro', None, 'Nyarugenge']
+
+
+@pytest.fixture
+def users(app):
+    with app.app_context():
+        # Repeated balances and districts, so pages break inside runs of equal keys
+        return [add_user(current_power=float(i % 4), district=DISTRICTS[i % 4]).id
+                for i in range(23)]
+
+
+def walk(client, sort, order, limit=5):
+    ids, params = [], {}
+    while True:
+        response = client.get('/admin/api/users',
+                              query_string={'limit': limit, 'sort': sort, 'order': order, **params})
+        assert response.status_code == 200
+        page = response.get_json()
+        assert len(page['users']) <= limit
+        ids.extend(u['id'] for u in page['users'])
+        if page['next'] is None:
+            return ids
+        params = page['next']
+
+
+@pytest.mark.parametrize('sort', ['id', 'balance', 'district'])
+@pytest.mark.parametrize('order', ['asc', 'desc'])
+def test_pages_cover_the_sorted_list_once(app, client, users, sort, order):
+    with app.app_context():
+        key = {
+            'id': lambda u: (u.id,),
+            'balance': lambda u: (u.current_power or 0.0, u.id),
+            'district': lambda u: (u.district or '', u.id),
+        }[sort]
+        expected = [u.id for u in sorted(zion.User.query.all(), key=key, reverse=order == 'desc')]
+    assert walk(client, sort, order) == expected
+
+
+def test_bad_sort(client, users):
+    response = client.get('/admin/api/users', query_string={'limit': 5, 'sort': 'username'})
+    assert response.status_code == 400
+    response = client.get('/admin/api/users',
+                          query_string={'limit': 5, 'sort': 'balance', 'after_id': 1, 'after_value': 'x'})
+    assert response.status_code == 400
+
+
+def test_since_returns_updated_and_removed_users(app, client, users):
+    version = int(client.get('/admin/api/users').headers['X-Users-Version'])
+
+    client.post(f'/admin/api/users/{users[0]}/update', json={'district': 'Rubavu'})
+    client.delete(f'/admin/api/users/{users[1]}/delete')
+
+    delta = client.get('/admin/api/users', query_string={'since': version}).get_json()
+    assert delta['full'] is False
+    assert [(u['id'], u['district']) for u in delta['users']] == [(users[0], 'Rubavu')]
+    assert delta['removed'] == [users[1]]
+    assert delta['version'] > version
+
+    again = client.get('/admin/api/users', query_string={'since': delta['version']}).get_json()
+    assert again['users'] == [] and again['removed'] == []
+
+
+def test_balance_changes_are_in_the_feed(app, client, users):
+    version = zion.user_changes.version
+    with app.app_context():
+        meter = zion.db.session.get(zion.User, users[2]).meter_number
+    client.post('/api/readings/bulk', data=f'{{"meter_number": "{meter}", "power_consumed": 1}}',
+                content_type='application/x-ndjson')
+    delta = client.get('/admin/api/users', query_string={'since': version}).get_json()
+    assert [u['id'] for u in delta['users']] == [users[2]]
+
+
+@pytest.mark.parametrize('since', [0, 10 ** 15])
+def test_unknown_versions_get_a_full_snapshot(client, users, since):
+    delta = client.get('/admin/api/users', query_string={'since': since}).get_json()
+    assert delta['full'] is True
+    assert sorted(u['id'] for u in delta['users']) == sorted(users)
+
+    bare = client.get('/admin/api/users', query_string={'since': since, 'snapshot': 0}).get_json()
+    assert bare['full'] is True and bare['users'] == []
+
+
+def test_members_version_moves_only_when_users_come_and_go(app, client, users):
+    count = client.get('/admin/api/users/count').get_json()
+    assert count['count'] == len(users)
+    version, members = count['version'], count['members']
+
+    with app.app_context():
+        meter = zion.db.session.get(zion.User, users[1]).meter_number
+    client.post('/api/readings/bulk', data=f'{{"meter_number": "{meter}", "power_consumed": 1}}',
+                content_type='application/x-ndjson')
+    delta = client.get('/admin/api/users', query_string={'since': version, 'snapshot': 0}).get_json()
+    assert delta['users'] and delta['members'] == members
+
+    client.delete(f'/admin/api/users/{users[2]}/delete')
+    delta = client.get('/admin/api/users', query_string={'since': delta['version']}).get_json()
+    assert delta['members'] != members
+    count = client.get('/admin/api/users/count').get_json()
+    assert (count['count'], count['members']) == (len(users) - 1, delta['members'])
@@ -0,0 +1,62 @@
+"""Queued, sampled logging pipeline (applog) and when zion installs it."""
+import io
+import json
+import logging
+import queue
+
+import pytest
+
+import applog
+
+
+@pytest.fixture
+def root_logger():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield root
+    for handler in list(root.handlers):
+        if handler not in handlers:
+            root.removeHandler(handler)
+    root.setLevel(level)
+
+
+def test_importing_zion_leaves_logging_alone():
+    import zion  # noqa: F401
+    assert not any(isinstance(h, applog.DroppingQueueHandler) for h in logging.getLogger().handlers)
+
+
+def test_json_records_go_through_the_listener(root_logger):
+    stream = io.StringIO()
+    listener = applog.setup(level='INFO', fmt='json', stream=stream)
+    logging.getLogger('zion.test').info("stored %d readings", 3, extra={'meter_number': 'M1'})
+    listener.stop()
+    entry = json.loads(stream.getvalue())
+    assert (entry['level'], entry['logger'], entry['msg']) == ('INFO', 'zion.test', 'stored 3 readings')
+    assert entry['meter_number'] == 'M1'
+
+
+def test_setup_again_replaces_the_pipeline(root_logger):
+    first = applog.setup(stream=io.StringIO())
+    second = applog.setup(stream=io.StringIO())
+    assert first._thread is None and second._thread is not None
+    assert sum(isinstance(h, applog.DroppingQueueHandler) for h in root_logger.handlers) == 1
+    second.stop()
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = applog.DroppingQueueHandler(queue.Queue(maxsize=1))
+    record = logging.LogRecord('zion', logging.INFO, '', 0, 'x', (), None)
+    handler.emit(record)
+    handler.emit(record)
+    assert handler.dropped == 1
+
+
+def test_sampling_keeps_one_in_n_per_template():
+    sampler = applog.SamplingFilter(every=3)
+
+    def record(msg, level=logging.DEBUG):
+        return logging.LogRecord('zion.ingest', level, '', 0, msg, (), None)
+
+    assert [sampler.filter(record("reading %s")) for _ in range(4)] == [True, False, False, True]
+    assert sampler.filter(record("other %s"))
+    assert sampler.filter(record("reading %s", logging.WARNING))
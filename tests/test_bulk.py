@@ -0,0 +1,125 @@
+"""/api/readings/bulk: per-line statuses, multi-reading lines and storage."""
+import gzip
+import json
+
+import zion
+from tests.helpers import add_user, new_meter
+
+
+def post_lines(client, lines, **kwargs):
+    body = '\n'.join(line if isinstance(line, str) else json.dumps(line) for line in lines)
+    return client.post('/api/readings/bulk', data=kwargs.pop('data', body.encode()),
+                       content_type='application/x-ndjson', **kwargs)
+
+
+def stored_readings(meter_number):
+    return zion.SensorReading.query.filter_by(meter_number=meter_number).count()
+
+
+def test_every_reading_of_a_multi_reading_line_is_stored(app, client):
+    with app.app_context():
+        meter = add_user(current_power=10.0).meter_number
+    response = post_lines(client, [
+        {'meter_number': meter, 'readings': [{'power_consumed': 1}, {'power_consumed': 2}]},
+        {'meter_number': meter, 'power_consumed': 0.5},
+    ])
+    assert response.get_json() == {'accepted': 3, 'rejected': 0, 'status': [
+        {'line': 1, 'status': 'ok'}, {'line': 2, 'status': 'ok'}]}
+    with app.app_context():
+        assert stored_readings(meter) == 3
+        assert zion.ledger.get(meter) == 6.5
+
+
+def test_rejected_lines(app, client):
+    with app.app_context():
+        meter = add_user().meter_number
+    unknown = new_meter()
+    response = post_lines(client, [
+        {'meter_number': meter, 'readings': []},
+        '{not json',
+        '[1, 2]',
+        {'meter_number': unknown, 'power_consumed': 1},
+        # One unknown meter rejects the whole line
+        {'meter_number': meter, 'readings': [{'power_consumed': 1},
+                                             {'meter_number': unknown, 'power_consumed': 1}]},
+        '',
+        {'meter_number': meter, 'power_consumed': 1},
+    ])
+    result = response.get_json()
+    assert result['accepted'] == 1
+    assert result['rejected'] == 5
+    statuses = {entry['line']: entry['status'] for entry in result['status']}
+    # The blank line 6 has no entry, and line 7 keeps its number
+    assert sorted(statuses) == [1, 2, 3, 4, 5, 7]
+    assert statuses[1] == 'invalid: no readings'
+    assert statuses[2].startswith('invalid: ')
+    assert statuses[3] == 'invalid: line must be a reading object'
+    assert [statuses[4], statuses[5], statuses[7]] == ['unknown_meter', 'unknown_meter', 'ok']
+    with app.app_context():
+        assert stored_readings(meter) == 1
+        assert stored_readings(unknown) == 0
+        assert zion.ledger.get(meter) == 9.0
+
+
+def test_gzip_body(app, client):
+    with app.app_context():
+        meter = add_user().meter_number
+    body = gzip.compress(json.dumps({'meter_number': meter, 'power_consumed': 2}).encode())
+    response = post_lines(client, [], data=body, headers={'Content-Encoding': 'gzip'})
+    assert response.get_json()['accepted'] == 1
+    with app.app_context():
+        assert stored_readings(meter) == 1
+
+
+def test_unreadable_gzip_body(client):
+    response = post_lines(client, [], data=b'not gzip', headers={'Content-Encoding': 'gzip'})
+    assert response.status_code == 400
+
+
+def test_reading_limit(app, client, monkeypatch):
+    with app.app_context():
+        meter = add_user().meter_number
+    monkeypatch.setitem(app.config, 'MAX_BULK_READINGS', 2)
+    response = post_lines(client, [
+        {'meter_number': meter, 'readings': [{'power_consumed': 1}] * 3},
+    ])
+    assert response.status_code == 413
+    with app.app_context():
+        assert stored_readings(meter) == 0
+
+
+def test_long_lines_are_rejected_without_reading_them_whole(app, client, monkeypatch):
+    with app.app_context():
+        meter = add_user().meter_number
+    monkeypatch.setitem(app.config, 'MAX_BULK_LINE_BYTES', 64)
+    ok = {'meter_number': meter, 'power_consumed': 1}
+    response = post_lines(client, [ok, {'meter_number': meter, 'padding': 'x' * 500}, ok])
+    result = response.get_json()
+    assert result['status'] == [
+        {'line': 1, 'status': 'ok'},
+        {'line': 2, 'status': 'invalid: line longer than 64 bytes'},
+        {'line': 3, 'status': 'ok'},
+    ]
+    assert result['accepted'] == 2
+
+
+def test_decompressed_size_limit(app, client, monkeypatch):
+    with app.app_context():
+        meter = add_user().meter_number
+    monkeypatch.setitem(app.config, 'MAX_BULK_BODY_BYTES', 1000)
+    line = json.dumps({'meter_number': meter, 'power_consumed': 1}) + '\n'
+    # Compresses to a few hundred bytes, decompresses well past the limit
+    body = gzip.compress((line * 1000).encode())
+    response = post_lines(client, [], data=body, headers={'Content-Encoding': 'gzip'})
+    assert response.status_code == 413
+    with app.app_context():
+        assert stored_readings(meter) == 0
+
+
+def test_lines_that_are_not_utf8(app, client):
+    with app.app_context():
+        meter = add_user().meter_number
+    body = b'{"meter_number": "\xff"}\n' + json.dumps({'meter_number': meter}).encode()
+    result = post_lines(client, [], data=body).get_json()
+    assert result['status'][0]['status'].startswith('invalid: ')
+    assert result['status'][1] == {'line': 2, 'status': 'ok'}
@@ -0,0 +1,55 @@
+"""SSE fan-out: per-key coalescing in Subscription and EventBroker streams."""
+import threading
+import time
+
+from events import EventBroker, Subscription
+
+
+def test_newest_message_per_key_wins_in_first_seen_order():
+    sub = Subscription('meter:M1')
+    sub.offer('a', 'a1')
+    sub.offer('b', 'b1')
+    sub.offer('a', 'a2')
+    # A re-offered key moves behind the others: it is the newest change
+    assert sub.drain(0) == ['b1', 'a2']
+    assert sub.drain(0) == []
+
+
+def test_drain_wakes_up_on_offer():
+    sub = Subscription('t')
+    threading.Timer(0.05, sub.offer, ('k', 'm')).start()
+    started = time.monotonic()
+    assert sub.drain(5) == ['m']
+    assert time.monotonic() - started < 1
+
+
+def test_publish_coalesces_per_event_and_key():
+    broker = EventBroker()
+    sub = broker.subscribe('admin:users')
+    broker.publish('admin:users', {'current_power': 3}, event='balance', key='M1')
+    broker.publish('admin:users', {'id': 7}, event='user', key='M1')
+    broker.publish('admin:users', {'current_power': 2}, event='balance', key='M1')
+    assert sub.drain(0) == ['event: user\ndata: {"id": 7}\n\n',
+                            'event: balance\ndata: {"current_power": 2}\n\n']
+
+
+def test_publish_only_reaches_the_topic():
+    broker = EventBroker()
+    one, other = broker.subscribe('meter:M1'), broker.subscribe('meter:M2')
+    assert broker.publish('meter:M1', 1, key='M1') == 1
+    assert broker.publish('meter:M3', 1) == 0
+    assert len(one.drain(0)) == 1 and other.drain(0) == []
+
+
+def test_stream_sends_initial_state_keepalives_and_unsubscribes():
+    broker = EventBroker(keepalive=0.01)
+    stream = broker.stream('meter:M1', initial={'current_power': 5})
+    assert next(stream) == "retry: 3000\n\n"
+    assert next(stream) == 'event: message\ndata: {"current_power": 5}\n\n'
+    assert broker.subscriber_count('meter:M1') == 1
+    assert next(stream) == ": keepalive\n\n"
+    broker.publish('meter:M1', {'current_power': 4}, key='M1')
+    broker.publish('meter:M1', {'current_power': 3}, key='M1')
+    assert next(stream) == 'event: message\ndata: {"current_power": 3}\n\n'
+    stream.close()
+    assert broker.subscriber_count() == 0
@@ -0,0 +1,115 @@
+"""Payload parsing (JSON shapes and the binary format) and the batch writer."""
+from datetime import datetime, timedelta
+
+import pytest
+
+from ingest import (BINARY_HEADER, BINARY_RECORD, IngestWriter, PayloadError,
+                    decode_binary_readings, encode_binary_readings, parse_readings)
+
+RECEIVED = datetime(2026, 1, 1, 12, 0, 0)
+
+
+def test_single_reading_object():
+    [row] = parse_readings({'meter_number': 'M1', 'voltage': '230.5', 'current': 1,
+                            'power_consumed': 2.5}, RECEIVED)
+    assert row == {'meter_number': 'M1', 'voltage': 230.5, 'current': 1.0, 'power': 2.5,
+                   'reading_time': RECEIVED}
+
+
+def test_list_of_readings():
+    rows = parse_readings([{'meter_number': 'M1', 'power_consumed': 1},
+                           {'meter_number': 'M2', 'power_consumed': 2}], RECEIVED)
+    assert [(r['meter_number'], r['power']) for r in rows] == [('M1', 1.0), ('M2', 2.0)]
+
+
+def test_readings_share_the_outer_meter_number():
+    rows = parse_readings({'meter_number': 'M1', 'readings': [
+        {'power_consumed': 1, 'ts': 1767268800},
+        {'power_consumed': 2, 'ts': '2026-01-01T11:59:30Z'},
+        {'meter_number': 'M2', 'power_consumed': 3},
+    ]}, RECEIVED)
+    assert [r['meter_number'] for r in rows] == ['M1', 'M1', 'M2']
+    assert rows[0]['reading_time'] == datetime(2026, 1, 1, 12, 0, 0)
+    assert rows[1]['reading_time'] == datetime(2026, 1, 1, 11, 59, 30)
+    assert rows[2]['reading_time'] == RECEIVED
+
+
+def test_empty_readings_list_gives_no_rows():
+    assert parse_readings({'meter_number': 'M1', 'readings': []}, RECEIVED) == []
+
+
+def test_missing_power_counts_as_zero():
+    [row] = parse_readings({'meter_number': 'M1'}, RECEIVED)
+    assert row['power'] == 0.0 and row['voltage'] is None
+
+
+def test_future_timestamps_are_clamped_to_receive_time():
+    future = (RECEIVED + timedelta(hours=1)).isoformat()
+    [row] = parse_readings({'meter_number': 'M1', 'ts': future}, RECEIVED)
+    assert row['reading_time'] == RECEIVED
+
+
+@pytest.mark.parametrize('payload, message', [
+    ('text', 'reading object'),
+    ([1, 2], 'must be an object'),
+    ({'meter_number': 'M1', 'voltage': 'high'}, 'voltage must be a number'),
+    ({'meter_number': 'M1', 'ts': 'yesterday'}, 'Invalid reading timestamp'),
+])
+def test_invalid_payloads(payload, message):
+    with pytest.raises(PayloadError, match=message):
+        parse_readings(payload, RECEIVED)
+
+
+def test_reading_limit():
+    with pytest.raises(PayloadError, match='At most 2'):
+        parse_readings([{'meter_number': 'M1'}] * 3, RECEIVED, max_readings=2)
+
+
+def test_binary_round_trip():
+    payload = encode_binary_readings('K000200030005', [
+        (1767268800, 230.0, 1.5, 0.25),
+        (0, 229.5, 1.0, 0.5),
+    ])
+    assert len(payload) == BINARY_HEADER.size + 2 * BINARY_RECORD.size
+    rows = decode_binary_readings(payload, RECEIVED)
+    assert [r['meter_number'] for r in rows] == ['K000200030005'] * 2
+    assert rows[0]['reading_time'] == datetime(2026, 1, 1, 12, 0, 0)
+    assert rows[1]['reading_time'] == RECEIVED  # ts 0 means receive time
+    assert (rows[0]['voltage'], rows[0]['current'], rows[0]['power']) == (230.0, 1.5, 0.25)
+
+
+@pytest.mark.parametrize('payload, message', [
+    (b'\x01', 'shorter than its header'),
+    (b'\x02' + bytes(BINARY_HEADER.size - 1), 'Unsupported binary payload version'),
+    (encode_binary_readings('M1', [(0, 1, 1, 1)])[:-1], 'does not match'),
+])
+def test_invalid_binary_payloads(payload, message):
+    with pytest.raises(PayloadError, match=message):
+        decode_binary_readings(payload, RECEIVED)
+
+
+class FlakyWriter(IngestWriter):
+    def __init__(self, failures, **kwargs):
+        super().__init__(None, None, None, retry_delay=0.001, **kwargs)
+        self.failures = failures
+        self.written = []
+
+    def write(self, batch):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError('database is locked')
+        self.written.append(batch)
+
+
+def test_failed_batches_are_retried():
+    writer = FlakyWriter(failures=2)
+    writer._write([{'meter_number': 'M1'}])
+    assert writer.written == [[{'meter_number': 'M1'}]]
+    assert writer.failed == 0
+
+
+def test_batches_failing_every_retry_are_counted():
+    writer = FlakyWriter(failures=10, retries=2)
+    writer._write([{'meter_number': 'M1'}, {'meter_number': 'M2'}])
+    assert writer.written == []
+    assert writer.failed == 2
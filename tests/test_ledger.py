@@ -0,0 +1,181 @@
+"""BalanceLedger journal replay, checkpoints and admin overwrites."""
+import pytest
+from sqlalchemy import text
+
+import zion
+from ledger import BalanceLedger, LedgerLocked
+from tests.helpers import add_user, new_meter
+
+
+def make_ledger(tmp_path):
+    # A journal name of its own keeps the checkpoint row apart from zion.ledger's,
+    # and a long interval keeps the flusher thread from flushing on its own.
+    return BalanceLedger(zion.app, zion.db, str(tmp_path / f'{tmp_path.name}.journal'),
+                         flush_interval=3600)
+
+
+def crash(ledger):
+    """Stop a ledger the way a killed process would: no final flush."""
+    ledger._stopping.set()
+    if ledger._thread is not None:
+        ledger._thread.join()
+    ledger._journal.close()
+    ledger._lock_file.close()
+    ledger._loaded = False  # the atexit stop() must not flush either
+
+
+def stored(meter_number):
+    return zion.db.session.execute(
+        text("SELECT current_power FROM users WHERE meter_number = :m"), {'m': meter_number}
+    ).scalar()
+
+
+def test_unflushed_debits_are_replayed_after_a_crash(app, tmp_path):
+    with app.app_context():
+        meter = add_user(current_power=10.0).meter_number
+        first = make_ledger(tmp_path)
+        assert first.debit(meter, 3.0) == 7.0
+        assert stored(meter) == 10.0
+        crash(first)
+
+        second = make_ledger(tmp_path)
+        assert second.get(meter) == 7.0
+        # Loading persisted the replay and removed the rotated journals
+        zion.db.session.expire_all()
+        assert stored(meter) == 7.0
+        assert second.flush() == 0
+        crash(second)
+
+        third = make_ledger(tmp_path)
+        assert third.get(meter) == 7.0
+        crash(third)
+
+
+def test_checkpointed_deltas_are_not_replayed_twice(app, tmp_path):
+    with app.app_context():
+        meter = add_user(current_power=10.0).meter_number
+        first = make_ledger(tmp_path)
+        first.debit(meter, 3.0)
+        assert first.flush() == 1
+        first.debit(meter, 1.0)
+        crash(first)
+
+        second = make_ledger(tmp_path)
+        assert second.get(meter) == 6.0
+        zion.db.session.expire_all()
+        assert stored(meter) == 6.0
+        crash(second)
+
+
+def test_admin_overwrite_discards_earlier_deltas_on_replay(app, tmp_path):
+    with app.app_context():
+        meter = add_user(current_power=10.0).meter_number
+        first = make_ledger(tmp_path)
+        first.debit(meter, 2.0)
+        first.commit_set(zion.db.session, meter, 50.0)
+        assert stored(meter) == 50.0
+        first.debit(meter, 1.0)
+        assert first.get(meter) == 49.0
+        crash(first)
+
+        second = make_ledger(tmp_path)
+        assert second.get(meter) == 49.0
+        zion.db.session.expire_all()
+        assert stored(meter) == 49.0
+        crash(second)
+
+
+def test_commit_credit_keeps_unflushed_debits(app, tmp_path):
+    with app.app_context():
+        meter = add_user(current_power=10.0).meter_number
+        ledger = make_ledger(tmp_path)
+        ledger.debit(meter, 4.0)
+        assert ledger.commit_credit(zion.db.session, meter, 5.0) == 11.0
+        assert stored(meter) == 15.0  # the debit is still pending
+        ledger.flush()
+        zion.db.session.expire_all()
+        assert stored(meter) == 11.0
+        crash(ledger)
+
+
+def test_meters_registered_elsewhere_are_loaded_on_first_use(app, tmp_path):
+    with app.app_context():
+        ledger = make_ledger(tmp_path)
+        ledger.start()
+        meter = add_user(current_power=8.0).meter_number
+        assert ledger.get(meter) == 8.0
+        assert ledger.debit(meter, 1.0) == 7.0
+        assert ledger.get('NO-SUCH-METER') is None
+        assert ledger.debit('NO-SUCH-METER', 1.0) is None
+        crash(ledger)
+
+
+def test_misses_are_remembered_until_the_meter_is_registered(app, tmp_path):
+    with app.app_context():
+        ledger = make_ledger(tmp_path)
+        meter = new_meter()
+        assert ledger.get(meter) is None
+        # Registered behind the ledger's back: the miss is still remembered
+        add_user(meter_number=meter, current_power=4.0)
+        assert ledger.debit(meter, 1.0) is None
+        ledger.add_meter(meter, 4.0)
+        assert ledger.debit(meter, 1.0) == 3.0
+        crash(ledger)
+
+
+def test_misses_expire(app, tmp_path):
+    with app.app_context():
+        ledger = make_ledger(tmp_path)
+        ledger.miss_ttl = 0
+        meter = new_meter()
+        assert ledger.get(meter) is None
+        add_user(meter_number=meter, current_power=4.0)
+        assert ledger.get(meter) == 4.0
+        crash(ledger)
+
+
+def test_removed_meters_are_not_replayed_onto_a_new_owner(app, tmp_path):
+    with app.app_context():
+        old = add_user(current_power=10.0)
+        meter = old.meter_number
+        first = make_ledger(tmp_path)
+        first.debit(meter, 3.0)
+        zion.db.session.delete(old)
+        zion.db.session.commit()
+        first.remove_meter(meter)
+        # Re-registered by another process, without the ledger seeing it
+        add_user(meter_number=meter, current_power=20.0)
+        crash(first)
+
+        second = make_ledger(tmp_path)
+        assert second.get(meter) == 20.0
+        crash(second)
+
+
+def test_rename_carries_unflushed_debits(app, tmp_path):
+    with app.app_context():
+        user = add_user(current_power=10.0)
+        old, new = user.meter_number, new_meter()
+        ledger = make_ledger(tmp_path)
+        ledger.debit(old, 4.0)
+        user.meter_number = new
+        assert ledger.commit_rename(zion.db.session, user.id, old, new) == 6.0
+        assert stored(new) == 6.0
+        assert ledger.get(new) == 6.0
+        assert ledger.debit(old, 1.0) is None
+        ledger.debit(new, 1.0)
+        crash(ledger)
+
+        second = make_ledger(tmp_path)
+        assert second.get(new) == 5.0
+        assert second.get(old) is None
+        crash(second)
+
+
+def test_second_process_is_refused(app, tmp_path):
+    with app.app_context():
+        first = make_ledger(tmp_path)
+        first.start()
+        with pytest.raises(LedgerLocked):
+            make_ledger(tmp_path).start()
+        crash(first)
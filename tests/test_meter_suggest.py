@@ -0,0 +1,92 @@
+"""Meter autocomplete: MeterIndex and /api/meters/suggest."""
+import pytest
+
+import zion
+from caches import MeterIndex, MeterOwner
+from tests.helpers import add_user, new_meter
+
+
+def owner(user_id):
+    return MeterOwner(user_id, f"user{user_id}", 'user')
+
+
+def test_suggest_returns_prefix_matches_in_order():
+    index = MeterIndex(lambda: [('B2', owner(3)), ('A10', owner(2)), ('A1', owner(1)), (None, owner(4))])
+    assert [m for m, _ in index.suggest('A')] == ['A1', 'A10']
+    assert index.suggest('A1', limit=1) == [('A1', owner(1))]
+    assert index.suggest('C') == []
+    assert index.suggest('') == []
+    assert len(index) == 3
+
+
+def test_put_and_discard_keep_the_index_sorted():
+    index = MeterIndex(lambda: [('A1', owner(1))])
+    index.get('A1')
+    index.put('A0', owner(2))
+    index.put('A1', owner(3))
+    assert index.suggest('A') == [('A0', owner(2)), ('A1', owner(3))]
+    index.discard('A0', 'missing')
+    assert index.suggest('A') == [('A1', owner(3))]
+
+
+def test_changes_before_the_first_load_come_from_the_loader():
+    rows = [('A1', owner(1))]
+    index = MeterIndex(lambda: rows)
+    index.put('A2', owner(2))
+    index.discard('A1')
+    assert index.suggest('A') == [('A1', owner(1))]
+
+
+@pytest.fixture
+def index(app):
+    with app.app_context():
+        zion.meter_index.reload()
+    return zion.meter_index
+
+
+def log_in(client, user_id, role):
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+        sess['role'] = role
+
+
+def suggest(client, prefix):
+    return client.get('/api/meters/suggest', query_string={'prefix': prefix})
+
+
+def test_endpoint_requires_a_login(client, index):
+    assert suggest(client, 'T').status_code == 401
+
+
+def test_only_admins_see_owners(app, client, index):
+    with app.app_context():
+        user = add_user()
+        meter, user_id, username = user.meter_number, user.id, user.username
+        index.put(meter, MeterOwner(user_id, username, 'user'))
+
+    log_in(client, user_id, 'user')
+    data = suggest(client, meter.lower()).get_json()
+    assert data == {'exists': True, 'meters': [{'meter_number': meter}]}
+
+    log_in(client, user_id, 'admin')
+    data = suggest(client, meter).get_json()
+    assert data['meters'] == [{'meter_number': meter, 'username': username}]
+
+
+def test_index_follows_register_rename_and_delete(app, client, index):
+    meter = new_meter()
+    client.post('/register', data={'username': 'suggested', 'password': 'x', 'phone': '1',
+                                   'meter_number': meter, 'gender': 'F', 'province': 'P',
+                                   'district': 'D', 'sector': 'S'})
+    assert index.get(meter).username == 'suggested'
+    user_id = index.get(meter).user_id
+
+    renamed = new_meter()
+    response = client.post(f'/admin/api/users/{user_id}/update', json={'meter_number': renamed})
+    assert response.get_json() == {'success': True}
+    assert index.get(meter) is None
+    assert [m for m, _ in index.suggest(renamed)] == [renamed]
+
+    client.delete(f'/admin/api/users/{user_id}/delete')
+    assert index.get(renamed) is None
+    assert index.suggest(renamed) == []
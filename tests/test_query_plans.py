@@ -0,0 +1,31 @@
+"""`flask check-query-plans` against a copy of the shipped database, before and after migrating it."""
+import os
+import shutil
+import subprocess
+import sys
+
+from tests.conftest import ROOT
+
+
+def flask(tmp_path, *args):
+    env = dict(os.environ,
+               DATABASE_URL='sqlite:///' + str(tmp_path / 'cashpower.db'),
+               LEDGER_JOURNAL=str(tmp_path / 'ledger.journal'))
+    return subprocess.run([sys.executable, '-m', 'flask', '--app', 'zion', *args],
+                          cwd=ROOT, env=env, capture_output=True, text=True, timeout=120)
+
+
+def test_hot_queries_are_index_backed_after_upgrade(tmp_path):
+    shutil.copy(os.path.join(ROOT, 'cashpower.db'), tmp_path / 'cashpower.db')
+
+    before = flask(tmp_path, 'check-query-plans')
+    assert before.returncode == 1
+    assert "Run 'flask db upgrade'" in before.stdout
+
+    upgrade = flask(tmp_path, 'db', 'upgrade')
+    assert upgrade.returncode == 0, upgrade.stderr
+
+    after = flask(tmp_path, 'check-query-plans')
+    assert after.returncode == 0, after.stdout
+    assert '[FAIL]' not in after.stdout
+    assert 'All hot queries use an index.' in after.stdout
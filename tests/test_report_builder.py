@@ -0,0 +1,136 @@
+"""ReportBuilder against the per-field queries it replaced, and its memo."""
+from datetime import datetime, timedelta
+
+import pytest
+
+import zion
+from report_builder import ReportBuilder
+from tests.helpers import add_user
+
+T0 = datetime(2026, 3, 1, 8, 0, 0)
+
+
+def old_report(meter_number):
+    """The report as the routes built it before ReportBuilder (one query per field)."""
+    latest_transaction = (zion.Transaction.query
+                          .filter_by(meter_number=meter_number)
+                          .order_by(zion.Transaction.date_purchased.desc())
+                          .first())
+    latest_reading = (zion.SensorReading.query
+                      .filter_by(meter_number=meter_number)
+                      .order_by(zion.SensorReading.reading_time.desc())
+                      .first())
+    if latest_transaction and latest_transaction.purchase_power is not None:
+        purchased_power = latest_transaction.purchase_power
+        purchased_date = latest_transaction.date_purchased.strftime("%Y-%m-%d %H:%M:%S")
+    else:
+        purchased_power = 0.0
+        purchased_date = "N/A"
+    current_power = zion.User.query.filter_by(meter_number=meter_number).one().current_power or 0.0
+    return {
+        'meter_number': meter_number,
+        'purchased_power': purchased_power,
+        'purchased_date': purchased_date,
+        'current_power': current_power,
+        'consumed_power': purchased_power - current_power,
+        'latest_date': latest_reading.reading_time.strftime("%Y-%m-%d %H:%M:%S") if latest_reading else "N/A",
+    }
+
+
+def purchase(user, watts, at):
+    zion.db.session.add(zion.Transaction(user_id=user.id, meter_number=user.meter_number,
+                                         purchase_power=watts, purchase_amount=watts,
+                                         date_purchased=at))
+
+
+def reading(meter_number, at, power=1.0):
+    zion.db.session.add(zion.SensorReading(meter_number=meter_number, voltage=230.0, current=1.0,
+                                           power=power, reading_time=at))
+
+
+@pytest.fixture
+def builder():
+    return ReportBuilder(zion.db, zion.User, zion.Transaction, zion.SensorReading)
+
+
+def test_matches_the_per_field_queries(app, builder):
+    with app.app_context():
+        bare = add_user(current_power=5.0)
+        bought = add_user(current_power=12.5)
+        full = add_user(current_power=None)
+        read_only = add_user(current_power=3.0)
+        # Inserted out of date order: the newest purchase is not the newest row
+        purchase(bought, 20.0, T0 + timedelta(days=1))
+        purchase(bought, 50.0, T0)
+        purchase(full, 30.0, T0)
+        purchase(full, 40.0, T0 + timedelta(hours=2))
+        for minutes in (5, 30, 10):
+            reading(full.meter_number, T0 + timedelta(minutes=minutes))
+        reading(read_only.meter_number, T0)
+        zion.db.session.commit()
+
+        for user in (bare, bought, full, read_only):
+            assert builder.build(user.meter_number) == old_report(user.meter_number)
+        assert builder.build(full.meter_number)['purchased_power'] == 40.0
+        assert builder.build(full.meter_number)['latest_date'] == '2026-03-01 08:30:00'
+
+
+def test_unknown_meter(app, builder):
+    with app.app_context():
+        assert builder.build('NO-SUCH-METER') is None
+        assert len(builder) == 0
+
+
+def test_balance_callback(app):
+    with app.app_context():
+        meter = add_user(current_power=5.0).meter_number
+        builder = ReportBuilder(zion.db, zion.User, zion.Transaction, zion.SensorReading,
+                                balance=lambda m: 2.0)
+        assert builder.build(meter)['current_power'] == 2.0
+
+
+def test_memo_until_invalidated(app, builder):
+    with app.app_context():
+        user = add_user()
+        meter = user.meter_number
+        assert builder.build(meter)['purchased_power'] == 0.0
+        purchase(user, 25.0, T0)
+        zion.db.session.commit()
+        assert builder.build(meter)['purchased_power'] == 0.0
+        assert (builder.hits, builder.misses) == (1, 1)
+        builder.invalidate(meter)
+        assert builder.build(meter) == old_report(meter)
+
+
+def test_record_reading_moves_the_latest_date_forward(app, builder):
+    with app.app_context():
+        meter = add_user().meter_number
+        builder.build(meter)
+        builder.record_reading(meter, T0 + timedelta(hours=1))
+        builder.record_reading(meter, T0)
+        assert builder.build(meter)['latest_date'] == '2026-03-01 09:00:00'
+
+
+def test_expiry_and_size(app):
+    with app.app_context():
+        meters = [add_user().meter_number for _ in range(3)]
+        builder = ReportBuilder(zion.db, zion.User, zion.Transaction, zion.SensorReading,
+                                ttl=0, max_size=2)
+        for meter in meters:
+            builder.build(meter)
+        assert len(builder) == 2
+        builder.build(meters[-1])
+        assert builder.hits == 0
+
+
+def test_report_route_follows_purchases(app, client):
+    with app.app_context():
+        meter = add_user(current_power=0.0).meter_number
+    assert client.get(f'/api/port_report/{meter}').get_json()['latest_purchased_power'] == 0.0
+    with app.app_context():
+        user = zion.User.query.filter_by(meter_number=meter).one()
+        purchase(user, 15.0, datetime.utcnow())
+        zion.commit_purchase(meter, 15.0)
+    report = client.get(f'/api/port_report/{meter}').get_json()
+    assert report['latest_purchased_power'] == 15.0
+    assert report['current_power'] == 15.0
@@ -0,0 +1,86 @@
+"""apply_retention: old raw readings are downsampled into rollups, then pruned."""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+import zion
+from retention import apply_retention, rebuild_days
+from tests.helpers import new_meter
+
+NOW = datetime(2026, 3, 20, 12, 30)
+
+
+@pytest.fixture
+def readings(app):
+    meter_number = new_meter()
+    readings = [{
+        'meter_number': meter_number,
+        'voltage': 230.0,
+        'current': 0.5,
+        'power': float(days + hour),
+        'reading_time': NOW - timedelta(days=days, hours=hour, minutes=5 * hour),
+    } for days in range(1, 11) for hour in range(4)]
+    with app.app_context():
+        with zion.db.engine.begin() as conn:
+            conn.execute(zion.SensorReading.__table__.insert(), readings)
+    return readings
+
+
+def day_totals(readings):
+    totals = {}
+    for r in readings:
+        day = r['reading_time'].replace(hour=0, minute=0)
+        count, power = totals.get(day, (0, 0.0))
+        totals[day] = (count + 1, power + r['power'])
+    return totals
+
+
+def test_prune_keeps_history_as_rollups(app, readings):
+    meter_number = readings[0]['meter_number']
+    raw_cutoff = datetime(2026, 3, 13)
+    old = [r for r in readings if r['reading_time'] < raw_cutoff]
+    with app.app_context():
+        counts = apply_retention(zion.db.engine, raw_days=7,
+                                 rollup_days={'minute': 8, 'hour': None, 'day': None},
+                                 batch_size=3, now=NOW)
+
+        assert counts['raw'] == len(old)
+        remaining = zion.SensorReading.query.filter_by(meter_number=meter_number).all()
+        assert len(remaining) == len(readings) - len(old)
+        assert all(r.reading_time >= raw_cutoff for r in remaining)
+
+        rollups = zion.SensorRollup.query.filter_by(meter_number=meter_number)
+        days = {r.bucket_start: (r.count, r.power_sum) for r in rollups.filter_by(bucket='day')}
+        assert days == pytest.approx(day_totals(old))
+        hours = rollups.filter_by(bucket='hour').all()
+        assert sum(r.count for r in hours) == len(old)
+        minutes = rollups.filter_by(bucket='minute').all()
+        assert minutes and min(r.bucket_start for r in minutes) >= datetime(2026, 3, 12)
+        assert counts['minute'] == len(old) - len(minutes)
+
+
+def test_backlog_is_rebuilt_one_day_per_transaction(app, readings):
+    cutoff = datetime(2026, 3, 13)
+    old_days = {r['reading_time'].date() for r in readings if r['reading_time'] < cutoff}
+    commits = []
+
+    def on_commit(conn):
+        commits.append(conn)
+
+    with app.app_context():
+        event.listen(zion.db.engine, 'commit', on_commit)
+        try:
+            assert rebuild_days(zion.db.engine, cutoff) == len(old_days)
+        finally:
+            event.remove(zion.db.engine, 'commit', on_commit)
+        assert len(commits) == len(old_days)
+        day_rows = zion.SensorRollup.query.filter_by(bucket='day').all()
+        assert {r.bucket_start.date() for r in day_rows} == old_days
+
+
+def test_nothing_to_prune(app, readings):
+    with app.app_context():
+        counts = apply_retention(zion.db.engine, raw_days=30, now=NOW)
+        assert counts == {'raw': 0}
+        assert zion.SensorRollup.query.count() == 0
@@ -0,0 +1,116 @@
+"""sensor_rollups: ingest upserts and rebuild() against aggregates of the raw readings."""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+import zion
+import rollups
+from tests.helpers import new_meter
+
+
+def sample_readings(meter_number):
+    start = datetime(2026, 3, 1, 23, 58)
+    readings = []
+    for i in range(40):
+        readings.append({
+            'meter_number': meter_number,
+            'voltage': 220.0 + i % 3,
+            'current': 0.25 * (i % 4),
+            'power': None if i == 7 else 0.5 * (i % 5),
+            'reading_time': start + timedelta(seconds=17 * i),
+        })
+    return readings
+
+
+def truncate(ts, bucket):
+    if bucket == 'minute':
+        return datetime(ts.year, ts.month, ts.day, ts.hour, ts.minute)
+    if bucket == 'hour':
+        return datetime(ts.year, ts.month, ts.day, ts.hour)
+    return datetime(ts.year, ts.month, ts.day)
+
+
+def raw_aggregates(readings):
+    """(meter, bucket, start) -> (count, power sum/min/max, voltage sum, current sum), the long way."""
+    expected = {}
+    for bucket in rollups.BUCKETS:
+        groups = {}
+        for r in readings:
+            groups.setdefault((r['meter_number'], bucket, truncate(r['reading_time'], bucket)), []).append(r)
+        for key, rows in groups.items():
+            power = [r['power'] or 0.0 for r in rows]
+            expected[key] = (len(rows), sum(power), min(power), max(power),
+                             sum(r['voltage'] for r in rows), sum(r['current'] for r in rows))
+    return expected
+
+
+def stored_rollups(meter_number):
+    return {
+        (r.meter_number, r.bucket, r.bucket_start):
+            (r.count, r.power_sum, r.power_min, r.power_max, r.voltage_sum, r.current_sum)
+        for r in zion.SensorRollup.query.filter_by(meter_number=meter_number)
+    }
+
+
+def assert_matches(actual, expected):
+    assert actual.keys() == expected.keys()
+    for key, values in expected.items():
+        assert actual[key] == pytest.approx(values), key
+
+
+@pytest.fixture
+def readings(app):
+    meter_number = new_meter()
+    readings = sample_readings(meter_number)
+    with app.app_context():
+        with zion.db.engine.begin() as conn:
+            conn.execute(zion.SensorReading.__table__.insert(), readings)
+    return readings
+
+
+def test_ingest_batches_add_up_to_the_raw_aggregates(app, readings):
+    writer = rollups.RollupWriter(zion.SensorRollup.__table__)
+    with app.app_context():
+        for batch in (readings[:13], readings[13:14], readings[14:]):
+            with zion.db.engine.begin() as conn:
+                writer(conn, batch)
+        assert_matches(stored_rollups(readings[0]['meter_number']), raw_aggregates(readings))
+
+
+def test_rebuild_replaces_rollups_with_the_raw_aggregates(app, readings):
+    meter_number = readings[0]['meter_number']
+    with app.app_context():
+        with zion.db.engine.begin() as conn:
+            rollups.RollupWriter(zion.SensorRollup.__table__)(conn, readings[:5] * 3)
+            rollups.rebuild(conn)
+        assert_matches(stored_rollups(meter_number), raw_aggregates(readings))
+
+
+def test_consumption_totals_match_raw_readings_at_every_bucket(app, client, readings):
+    meter_number = readings[0]['meter_number']
+    with app.app_context():
+        with zion.db.engine.begin() as conn:
+            rollups.rebuild(conn)
+    expected = raw_aggregates(readings)
+    raw_total = sum(r['power'] or 0.0 for r in readings)
+    for bucket in rollups.BUCKETS:
+        data = client.get(f'/api/consumption/{meter_number}', query_string={
+            'bucket': bucket, 'from': '2026-03-01T00:00:00', 'to': '2026-03-03T00:00:00'}).get_json()
+        assert data['bucket'] == bucket
+        assert data['total_consumed'] == pytest.approx(raw_total)
+        assert len(data['buckets']) == sum(1 for key in expected if key[1] == bucket)
+        assert sum(b['count'] for b in data['buckets']) == len(readings)
+
+
+def test_consumption_rejects_unknown_buckets(client):
+    assert client.get('/api/consumption/X', query_string={'bucket': 'week'}).status_code == 400
+
+
+def test_upsert_by_dialect():
+    writer = rollups.RollupWriter(zion.SensorRollup.__table__)
+    sql = str(writer.upsert('postgresql').compile(dialect=postgresql.dialect()))
+    assert 'ON CONFLICT' in sql and 'least(' in sql and 'greatest(' in sql
+    assert writer.upsert('sqlite') is writer.upsert('sqlite')
+    with pytest.raises(NotImplementedError):
+        writer.upsert('mysql')
@@ -0,0 +1,83 @@
+"""Per-request SQL counting, timing headers and the slow-query log."""
+import logging
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+import zion
+from tests.helpers import add_user
+
+
+@pytest.fixture
+def profiling(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'SQL_PROFILING', True)
+    return app
+
+
+def run_request(app, statements):
+    """Run `statements()` as the body of a request and return the response headers."""
+    with app.test_request_context('/'):
+        zion._start_request_metrics()
+        statements()
+        response = zion._record_request_metrics(app.response_class())
+        zion._end_request_metrics(None)
+    return response.headers
+
+
+def test_statements_are_counted_and_timed(profiling, client):
+    headers = client.get('/admin/api/users/count').headers
+    assert int(headers['X-SQL-Queries']) >= 1
+    assert headers['X-SQL-Time'].endswith('ms')
+    assert headers['Server-Timing'].startswith('db;dur=')
+
+
+def test_no_headers_without_profiling(app, client):
+    assert 'X-SQL-Queries' not in client.get('/admin/api/users/count').headers
+
+
+def test_nested_app_context_statements_count(profiling):
+    def statements():
+        zion.db.session.execute(text("SELECT 1"))
+        # As the ledger does for its own lookups
+        with profiling.app_context():
+            with zion.db.engine.connect() as conn:
+                conn.execute(text("SELECT 2"))
+
+    assert run_request(profiling, statements)['X-SQL-Queries'] == '2'
+
+
+def test_failed_statements_do_not_skew_later_timings(profiling):
+    def statements():
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                zion.db.session.execute(text("SELECT * FROM no_such_table"))
+            zion.db.session.rollback()
+        zion.db.session.execute(text("SELECT 1"))
+
+    headers = run_request(profiling, statements)
+    assert headers['X-SQL-Queries'] == '1'
+    assert float(headers['X-SQL-Time'][:-2]) < 1000
+
+
+def test_background_statements_are_not_charged_to_a_request(profiling):
+    with profiling.app_context():
+        zion.db.session.execute(text("SELECT 1"))
+    assert zion._request_sql.get() is None
+
+
+def test_slow_queries_and_query_heavy_requests_are_logged(profiling, monkeypatch, caplog):
+    monkeypatch.setitem(profiling.config, 'SLOW_QUERY_MS', 0)
+    monkeypatch.setitem(profiling.config, 'SQL_QUERIES_WARN', 1)
+    with profiling.app_context():
+        add_user()
+
+    def statements():
+        zion.db.session.execute(text("SELECT count(*) FROM users"))
+        zion.db.session.execute(text("SELECT 1"))
+
+    with caplog.at_level(logging.WARNING, logger='zion.sql'):
+        run_request(profiling, statements)
+    messages = [r.getMessage() for r in caplog.records if r.name == 'zion.sql']
+    assert any(m.startswith('Slow query') and 'SELECT count(*) FROM users' in m for m in messages)
+    assert any(m.startswith('GET / ran 2 queries') for m in messages)
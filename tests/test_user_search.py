@@ -0,0 +1,105 @@
+"""Staged user search: exact, then prefix, then substring (users_fts) matches."""
+import pytest
+
+import zion
+from tests.helpers import add_user
+import user_search
+from user_search import _selective_piece
+
+
+@pytest.fixture
+def people(app):
+    with app.app_context():
+        users = {
+            'malice': add_user('malice', 'K900000000001', district='Huye'),
+            'alicebob': add_user('alicebob', 'K100000000002'),
+            'alice': add_user('alice', 'K100000000001', district='Musanze'),
+            'bob': add_user('bob', 'K200000000001', phone='0788123456'),
+        }
+        return {name: u.id for name, u in users.items()}
+
+
+def search(term):
+    return zion.search_user_ids(term)
+
+
+def test_exact_then_prefix_then_substring(app, people):
+    with app.app_context():
+        assert search('alice') == [people['alice'], people['alicebob'], people['malice']]
+
+
+def test_meter_prefix_ignores_case(app, people):
+    with app.app_context():
+        assert search('k1000') == [people['alice'], people['alicebob']]
+        assert search('K100000000001')[0] == people['alice']
+
+
+def test_short_terms_only_match_prefixes(app, people):
+    with app.app_context():
+        assert sorted(search('al')) == sorted([people['alice'], people['alicebob']])
+        assert search('ce') == []
+
+
+def test_other_profile_columns(app, people):
+    with app.app_context():
+        assert search('sanz') == [people['alice']]
+        assert search('8123') == [people['bob']]
+
+
+def test_runs_of_repeated_characters(app, people):
+    with app.app_context():
+        # Matched on a selective piece, then checked against the whole term
+        assert sorted(search('00000000001')) == sorted([people['malice'], people['alice'], people['bob']])
+        assert search('9000000000') == [people['malice']]
+
+
+def test_like_wildcards_are_literal(app, people):
+    with app.app_context():
+        assert search('a%e') == []
+        assert search('a_ice') == []
+
+
+def test_index_follows_updates_and_deletes(app, client, people):
+    client.post(f"/admin/api/users/{people['bob']}/update", json={'username': 'roberto'})
+    client.delete(f"/admin/api/users/{people['malice']}/delete")
+    with app.app_context():
+        assert search('bob') == [people['alicebob']]
+        assert search('obert') == [people['bob']]
+        assert search('alice') == [people['alice'], people['alicebob']]
+        new = add_user('carolina').id
+        assert search('rolin') == [new]
+
+
+def test_limit(app, people, monkeypatch):
+    monkeypatch.setitem(app.config, 'ADMIN_SEARCH_LIMIT', 2)
+    with app.app_context():
+        assert search('alice') == [people['alice'], people['alicebob']]
+
+
+@pytest.mark.parametrize('term, piece', [
+    ('alice', 'alice'),
+    ('K000012', '0012'),
+    ('aaaa', 'aa'),
+    ('ab', 'ab'),
+])
+def test_selective_piece(term, piece):
+    assert _selective_piece(term) == piece
+
+
+@pytest.mark.parametrize('term', ['alice', 'al', 'k1000', '00000000001', 'sanz', 'nobody'])
+def test_matching_ids_agrees_with_the_ranked_search(app, people, term):
+    with app.app_context():
+        everything = zion.db.session.execute(user_search.matching_ids(zion.db.session, term)).scalars()
+        assert sorted(everything) == sorted(search(term))
+
+
+def test_counts_and_pages_are_not_capped_at_the_search_limit(app, client, people, monkeypatch):
+    monkeypatch.setitem(app.config, 'ADMIN_SEARCH_LIMIT', 2)
+    with app.app_context():
+        extra = [add_user(f'alice{i:02d}').id for i in range(5)]
+    assert client.get('/admin/api/users/count?search=alice').get_json()['count'] == 8
+    page = client.get('/admin/api/users?search=alice&sort=id&limit=50').get_json()
+    assert sorted(u['id'] for u in page['users']) == sorted(
+        [people['alice'], people['alicebob'], people['malice']] + extra)
+    # Ranked search results stay bounded
+    assert len(client.get('/admin/api/users?search=alice').get_json()) == 2
@@ -0,0 +1,69 @@
+"""ShardedWorkerPool: per-key ordering and non-blocking back-pressure."""
+import random
+import threading
+import time
+
+from workers import ShardedWorkerPool
+
+
+def test_items_of_one_key_are_handled_in_order():
+    handled = {}
+    lock = threading.Lock()
+
+    def handler(item):
+        key, seq = item
+        time.sleep(random.random() / 1000)
+        with lock:
+            handled.setdefault(key, []).append(seq)
+
+    pool = ShardedWorkerPool(handler, shards=4)
+    keys = [f"M{i}" for i in range(10)]
+    for seq in range(50):
+        for key in keys:
+            assert pool.submit(key, (key, seq))
+    pool.stop()
+    assert handled == {key: list(range(50)) for key in keys}
+    assert sum(s['processed'] for s in pool.stats()) == 500
+
+
+def test_keys_stick_to_one_shard():
+    pool = ShardedWorkerPool(lambda item: None, shards=8)
+    assert pool.shard_for('K000200030005') is pool.shard_for('K000200030005')
+    assert pool.shard_for(None) is pool.shards[0]
+
+
+def test_full_shard_drops_without_blocking():
+    release = threading.Event()
+    pool = ShardedWorkerPool(lambda item: release.wait(5), shards=1, max_queue=2)
+    assert pool.submit('M1', 1)
+    # Wait until the worker holds item 1, so exactly two more fit in the queue
+    deadline = time.monotonic() + 5
+    while pool.depth() and time.monotonic() < deadline:
+        time.sleep(0.001)
+    assert pool.submit('M1', 2) and pool.submit('M1', 3)
+
+    started = time.monotonic()
+    assert [pool.submit('M1', n) for n in range(4, 7)] == [False, False, False]
+    assert time.monotonic() - started < 0.1
+    [stats] = pool.stats()
+    assert (stats['dropped'], stats['max_depth']) == (3, 2)
+
+    release.set()
+    pool.stop()
+    assert pool.stats()[0]['processed'] == 3
+
+
+def test_handler_errors_are_counted_and_the_worker_goes_on():
+    seen = []
+
+    def handler(item):
+        if item == 'bad':
+            raise ValueError(item)
+        seen.append(item)
+
+    pool = ShardedWorkerPool(handler, shards=1)
+    for item in ('a', 'bad', 'b'):
+        pool.submit('M1', item)
+    pool.stop()
+    assert seen == ['a', 'b']
+    assert pool.stats()[0]['errors'] == 1
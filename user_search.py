@@ -0,0 +1,157 @@
+"""
+Indexed admin user search.
+
+users_fts is an external-content FTS5 table (trigram tokenizer) over the
+searchable profile columns of users, kept in sync by triggers.  The update
+trigger only fires for those columns, so the ledger writing balances back
+to users.current_power never touches the index.
+
+search_user_ids() ranks and bounds every step with LIMIT, so the cost does
+not grow with the number of users:
+
+  1. exact meter number or username
+  2. meter numbers / usernames starting with the term (range scan on their
+     unique indexes)
+  3. the term anywhere in any indexed column (trigram MATCH, 3+ characters;
+     shorter terms only match by prefix)
+
+Meter numbers are mostly zeros, and the "000" trigram is in every row, so
+the MATCH is on the longest piece of the term without such runs and the
+full term is checked with LIKE on the few rows it returns.
+
+matching_ids() selects every match of the same steps without ranking or
+LIMIT, for filtering and counting (the admin list and its count).
+
+Databases created with `flask initdb` get the table from install(); existing
+ones from the migration.  Other databases than SQLite use LIKE for step 3.
+"""
+from sqlalchemy import DDL, Integer, event, text
+
+FTS_COLUMNS = ('username', 'meter_number', 'phone', 'province', 'district', 'sector')
+
+_COLUMNS = ', '.join(FTS_COLUMNS)
+_NEW = ', '.join('new.' + c for c in FTS_COLUMNS)
+_OLD = ', '.join('old.' + c for c in FTS_COLUMNS)
+
+CREATE_STATEMENTS = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5({_COLUMNS}, "
+    f"content='users', content_rowid='id', tokenize='trigram')",
+    f"CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN "
+    f"INSERT INTO users_fts(rowid, {_COLUMNS}) VALUES (new.id, {_NEW}); END",
+    f"CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN "
+    f"INSERT INTO users_fts(users_fts, rowid, {_COLUMNS}) VALUES ('delete', old.id, {_OLD}); END",
+    f"CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE OF {_COLUMNS} ON users BEGIN "
+    f"INSERT INTO users_fts(users_fts, rowid, {_COLUMNS}) VALUES ('delete', old.id, {_OLD}); "
+    f"INSERT INTO users_fts(rowid, {_COLUMNS}) VALUES (new.id, {_NEW}); END",
+)
+
+# Trigram tokens are 3 characters; shorter terms can't use the index.
+MIN_TRIGRAM_LENGTH = 3
+
+_PREFIX_SQL = {
+    column: text(f"SELECT id FROM users WHERE {column} >= :low AND {column} < :high "
+                 f"ORDER BY {column} LIMIT :limit")
+    for column in ('meter_number', 'username')
+}
+_EXACT_SQL = text("SELECT id FROM users WHERE meter_number = :term OR username = :term LIMIT :limit")
+
+# Step 3 without LIMIT; see _substring_step()
+_MATCH = "SELECT rowid FROM users_fts WHERE users_fts MATCH :match"
+_MATCH_LIKE = (
+    "SELECT rowid FROM users_fts WHERE users_fts MATCH :match AND ("
+    + " OR ".join(f"{c} LIKE :pattern ESCAPE '\\'" for c in FTS_COLUMNS)
+    + ")"
+)
+_LIKE = ("SELECT id FROM users WHERE username LIKE :pattern ESCAPE '\\' "
+         "OR meter_number LIKE :pattern ESCAPE '\\'")
+_STEP_SQL = {sql: text(sql + " LIMIT :limit") for sql in (_MATCH, _MATCH_LIKE, _LIKE)}
+
+# Steps 1 and 2 without LIMIT (an exact username is inside its own range)
+_ALL_PREFIX = ("SELECT id FROM users WHERE meter_number = :term "
+               "UNION SELECT id FROM users WHERE meter_number >= :meter_low AND meter_number < :meter_high "
+               "UNION SELECT id FROM users WHERE username >= :name_low AND username < :name_high")
+
+
+def install(table):
+    """Create users_fts along with `table` (users) on SQLite, drop it with it."""
+    for statement in CREATE_STATEMENTS:
+        event.listen(table, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+    event.listen(table, 'before_drop', DDL("DROP TABLE IF EXISTS users_fts").execute_if(dialect='sqlite'))
+
+
+def _selective_piece(term):
+    # Longest substring without three equal characters in a row.
+    best, start = '', 0
+    for i in range(2, len(term) + 1):
+        if i == len(term) or term[i] == term[i - 1] == term[i - 2]:
+            if i - start > len(best):
+                best = term[start:i]
+            start = i - 1
+    return best
+
+
+def _next_prefix(term):
+    # Smallest string greater than every string starting with `term`.
+    return term[:-1] + chr(ord(term[-1]) + 1)
+
+
+def _substring_step(session, term):
+    # (SQL of step 3, its parameters)
+    pattern = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    if session.get_bind().dialect.name != 'sqlite':
+        return _LIKE, {'pattern': pattern}
+    piece = _selective_piece(term)
+    if len(piece) < MIN_TRIGRAM_LENGTH:
+        piece = term
+    match = '"' + piece.replace('"', '""') + '"'
+    if piece == term:
+        return _MATCH, {'match': match}
+    return _MATCH_LIKE, {'match': match, 'pattern': pattern}
+
+
+def matching_ids(session, term):
+    """
+    Select of the ids of every user matching `term` (any step, unranked,
+    unlimited), for `User.id.in_(...)`.  None for an empty term.
+    """
+    term = term.strip()
+    if not term:
+        return None
+    sql = _ALL_PREFIX
+    params = {'term': term,
+              'meter_low': term.upper(), 'meter_high': _next_prefix(term.upper()),
+              'name_low': term, 'name_high': _next_prefix(term)}
+    if len(term) >= MIN_TRIGRAM_LENGTH:
+        step_sql, step_params = _substring_step(session, term)
+        sql += " UNION " + step_sql
+        params.update(step_params)
+    return text(sql).bindparams(**params).columns(id=Integer)
+
+
+def search_user_ids(session, term, limit=50):
+    """Ids of users matching `term`, best matches first, at most `limit`."""
+    term = term.strip()
+    if not term:
+        return []
+    found = []
+
+    def add(rows):
+        for (user_id,) in rows:
+            if user_id not in found:
+                found.append(user_id)
+
+    add(session.execute(_EXACT_SQL, {'term': term, 'limit': limit}))
+    # Meter numbers are upper case; usernames are matched as typed.
+    for column, prefix in (('meter_number', term.upper()), ('username', term)):
+        if len(found) >= limit:
+            break
+        add(session.execute(_PREFIX_SQL[column], {
+            'low': prefix, 'high': _next_prefix(prefix), 'limit': limit
+        }))
+
+    if len(found) >= limit or len(term) < MIN_TRIGRAM_LENGTH:
+        return found[:limit]
+    step_sql, params = _substring_step(session, term)
+    params['limit'] = limit + len(found)  # room for rows already found above
+    add(session.execute(_STEP_SQL[step_sql], params))
+    return found[:limit]
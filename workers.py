@@ -0,0 +1,126 @@
+"""
+Sharded worker pool for MQTT ingest.
+
+paho delivers every message on its single network thread.  The pool lets
+that thread only parse and route: work is handed to one of N worker threads
+chosen by crc32(key) % N, with the meter number as the key, so all readings
+of a meter are handled in order by the same worker while unrelated meters
+are processed in parallel.
+
+submit() never blocks the caller: paho's network thread must keep reading
+the socket (and answering keepalives), so when a shard's queue is full the
+item is dropped and counted in the shard's `dropped` (ingest_shard_dropped_total).
+
+Threads rather than processes, because the balance ledger and caches they
+update live in this process; the database inserts themselves already happen
+on the IngestWriter thread.
+"""
+import atexit
+import logging
+import queue
+import threading
+import zlib
+
+log = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class Shard:
+    __slots__ = ('index', 'queue', 'thread', 'processed', 'errors', 'dropped', 'max_depth')
+
+    def __init__(self, index, max_queue):
+        self.index = index
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.thread = None
+        self.processed = 0
+        self.errors = 0
+        self.dropped = 0
+        self.max_depth = 0
+
+
+class ShardedWorkerPool:
+    """N FIFO worker threads; items with the same key always go to the same one."""
+
+    def __init__(self, handler, shards=4, max_queue=10000, name='ingest-shard'):
+        if shards < 1:
+            raise ValueError("shards must be >= 1")
+        self.handler = handler
+        self.name = name
+        self.shards = [Shard(i, max_queue) for i in range(shards)]
+        self._started = False
+        self._lock = threading.Lock()
+
+    def shard_for(self, key):
+        if not key:
+            return self.shards[0]
+        return self.shards[zlib.crc32(key.encode()) % len(self.shards)]
+
+    def submit(self, key, item):
+        """Queue `item` on the shard owning `key`. Returns False (and drops it) if the shard is full."""
+        if not self._started:
+            self.start()
+        shard = self.shard_for(key)
+        try:
+            shard.queue.put_nowait(item)
+        except queue.Full:
+            shard.dropped += 1
+            # One line per burst rather than per message
+            if shard.dropped % 1000 == 1:
+                log.warning("Ingest shard %d full, dropping work (%d dropped so far).",
+                            shard.index, shard.dropped)
+            return False
+        depth = shard.queue.qsize()
+        if depth > shard.max_depth:
+            shard.max_depth = depth
+        return True
+
+    def stats(self):
+        return [{
+            'shard': s.index,
+            'depth': s.queue.qsize(),
+            'max_depth': s.max_depth,
+            'processed': s.processed,
+            'errors': s.errors,
+            'dropped': s.dropped
+        } for s in self.shards]
+
+    def depth(self):
+        return sum(s.queue.qsize() for s in self.shards)
+
+    ####################################
+    # Lifecycle
+    ####################################
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            for shard in self.shards:
+                shard.thread = threading.Thread(target=self._run, args=(shard,),
+                                                name=f"{self.name}-{shard.index}", daemon=True)
+                shard.thread.start()
+            self._started = True
+            atexit.register(self.stop)
+
+    def stop(self, timeout=5.0):
+        """Finish queued work and stop the workers."""
+        with self._lock:
+            if not self._started:
+                return
+            self._started = False
+        for shard in self.shards:
+            shard.queue.put(_STOP)
+        for shard in self.shards:
+            shard.thread.join(timeout)
+
+    def _run(self, shard):
+        while True:
+            item = shard.queue.get()
+            if item is _STOP:
+                return
+            try:
+                self.handler(item)
+            except Exception as e:
+                shard.errors += 1
+                log.exception("Ingest shard %d error", shard.index)
+            shard.processed += 1
@@ -1,13 +1,33 @@
+import contextvars
+import gzip
 import json
+import logging
 import os
+import sys
 import threading
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
+import click
 from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
 from flask_sqlalchemy import SQLAlchemy
+from flask_migrate import Migrate
+from sqlalchemy import event
 import paho.mqtt.client as mqtt
 from flasgger import Swagger, swag_from
-from flask import send_file
+from flask import send_file, Response, g, has_request_context
 from flask_cors import CORS
+from ingest import IngestWriter, PayloadError, decode_binary_readings, parse_readings
+from ledger import BalanceLedger, LedgerLocked
+from events import EventBroker
+from caches import ChangeLog, LatestReadingCache, MeterDirectory, MeterIndex, MeterOwner, Reading
+from report_builder import ReportBuilder
+from rollups import BUCKETS, RollupWriter, rebuild as rebuild_rollups
+from workers import ShardedWorkerPool
+import applog
+import metrics
+from retention import apply_retention, ensure_incremental_vacuum, incremental_vacuum
+import sqlite_profile
+import user_search
 
 app = Flask(__name__)
 CORS(app, supports_credentials=True)
@@ -54,9 +74,89 @@ mqtt_port = 1883
 
 # Configure database (SQLite example). For MySQL/Postgres, adjust accordingly.
 basedir = os.path.abspath(os.path.dirname(__file__))
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'cashpower.db')
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+    'DATABASE_URL', 'sqlite:///' + os.path.join(basedir, 'cashpower.db'))
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = sqlite_profile.engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 db = SQLAlchemy(app)
+sqlite_profile.install(app, db)
+migrate = Migrate(app, db)
+
+# Sensor ingest batching: flush after this many rows or this many seconds
+app.config['INGEST_BATCH_SIZE'] = 500
+app.config['INGEST_FLUSH_INTERVAL'] = 0.05
+app.config['INGEST_QUEUE_SIZE'] = 10000
+# A failed batch insert is retried this many times (0.1 s, doubling) before it is counted as failed
+app.config['INGEST_WRITE_RETRIES'] = 5
+# MQTT messages are handled by this many worker threads, partitioned by meter
+# (0 = handle them on the MQTT network thread)
+app.config['INGEST_SHARDS'] = int(os.environ.get('INGEST_SHARDS', 4))
+# Messages waiting per shard; when a shard is full new ones are dropped (and
+# counted) rather than stalling the MQTT network thread
+app.config['INGEST_SHARD_QUEUE_SIZE'] = 10000
+# Upper bound on readings a device may buffer into one payload
+app.config['MAX_READINGS_PER_PAYLOAD'] = 3600
+# Upper bound on lines in one /api/readings/bulk upload
+app.config['MAX_BULK_READINGS'] = 100000
+# Longest line and largest (decompressed) body /api/readings/bulk reads, in bytes
+app.config['MAX_BULK_LINE_BYTES'] = 1024 * 1024
+app.config['MAX_BULK_BODY_BYTES'] = 64 * 1024 * 1024
+
+# In-memory balance ledger: journal location and write-behind interval (seconds)
+app.config['LEDGER_JOURNAL'] = os.environ.get(
+    'LEDGER_JOURNAL', os.path.join(app.instance_path, 'ledger.journal'))
+app.config['LEDGER_FLUSH_INTERVAL'] = 2.0
+# Seconds a meter that is not in `users` stays known-missing (readings for
+# unregistered meters skip the database; registrations here clear it at once)
+app.config['LEDGER_MISS_TTL'] = 30.0
+
+# Newest reading per meter kept in memory (LRU, number of meters)
+app.config['LATEST_READING_CACHE_SIZE'] = 100000
+# meter_number -> owning user lookups kept in memory (LRU, number of meters)
+app.config['METER_DIRECTORY_SIZE'] = 100000
+# Meter reports are memoized per meter for this many seconds (purchases and
+# owner changes invalidate them, ingest moves the latest reading forward)
+app.config['REPORT_CACHE_TTL'] = 5.0
+app.config['REPORT_CACHE_SIZE'] = 10000
+# Most suggestions /api/meters/suggest returns per prefix
+app.config['METER_SUGGEST_LIMIT'] = 10
+app.config['METER_SUGGEST_MAX_LIMIT'] = 50
+# Changed users remembered for /admin/api/users?since= (older pollers get a full snapshot)
+app.config['USER_CHANGELOG_SIZE'] = 100000
+# Page size bounds for /admin/api/users?limit=
+app.config['ADMIN_USERS_PAGE_SIZE'] = 100
+app.config['ADMIN_USERS_MAX_PAGE_SIZE'] = 500
+# Most users an admin search returns (best matches first, see user_search.py)
+app.config['ADMIN_SEARCH_LIMIT'] = 50
+
+# Retention in days for `flask prune-readings` (None = keep forever)
+app.config['RETENTION_RAW_DAYS'] = 7
+app.config['RETENTION_ROLLUP_DAYS'] = {'minute': 90, 'hour': None, 'day': None}
+app.config['RETENTION_BATCH_SIZE'] = 5000
+
+# Logging: level, 'text' or 'json' lines, and 1-in-N sampling of per-message
+# ingest lines (records go through a queue, the ingest threads never block on I/O)
+app.config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', 'INFO')
+app.config['LOG_FORMAT'] = os.environ.get('LOG_FORMAT', 'text')
+app.config['LOG_SAMPLE_EVERY'] = int(os.environ.get('LOG_SAMPLE_EVERY', 100))
+
+# SQL profiling: X-SQL-Queries / X-SQL-Time headers on every response, a
+# warning for statements slower than SLOW_QUERY_MS and for requests running
+# more than SQL_QUERIES_WARN statements (typically an N+1 loop)
+app.config['SQL_PROFILING'] = os.environ.get('SQL_PROFILING', '0') == '1'
+app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 100))
+app.config['SQL_QUERIES_WARN'] = int(os.environ.get('SQL_QUERIES_WARN', 50))
+
+log = logging.getLogger('zion')
+# Per-reading lines; sampled by configure_logging()
+ingest_log = logging.getLogger('zion.ingest')
+
+
+def configure_logging():
+    return applog.setup(level=app.config['LOG_LEVEL'],
+                        fmt=app.config['LOG_FORMAT'],
+                        sample_every=app.config['LOG_SAMPLE_EVERY'],
+                        sampled_loggers=('zion.ingest',))
 
 ####################################
 # Database Models
@@ -76,6 +176,15 @@ class User(db.Model):
     current_power = db.Column(db.Float, default=0.0)
     date_created = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        # Keyset pagination of the admin user list (see USER_SORT_KEYS)
+        db.Index('ix_users_balance_id', db.func.coalesce(current_power, db.literal_column('0.0')), id),
+        db.Index('ix_users_district_id', db.func.coalesce(district, db.literal_column("''")), id),
+    )
+
+# Trigram search index over the profile columns (users_fts)
+user_search.install(User.__table__)
+
 class Transaction(db.Model):
     __tablename__ = 'transactions'
     id = db.Column(db.Integer, primary_key=True)
@@ -86,6 +195,10 @@ class Transaction(db.Model):
     payment_method = db.Column(db.String(20), nullable=True)  # Payment method used (mtn, airtel, visa, mastercard)
     date_purchased = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_transactions_meter_date', meter_number, date_purchased.desc()),
+    )
+
 class SensorReading(db.Model):
     __tablename__ = 'sensor_readings'
     id = db.Column(db.Integer, primary_key=True)
@@ -95,6 +208,25 @@ class SensorReading(db.Model):
     power = db.Column(db.Float)
     reading_time = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # Every "latest reading for meter X" lookup is served by one of these
+    __table_args__ = (
+        db.Index('ix_sensor_readings_meter_time', meter_number, reading_time.desc()),
+        db.Index('ix_sensor_readings_meter_id', meter_number, id.desc()),
+    )
+
+class SensorRollup(db.Model):
+    """Per-meter minute/hour/day aggregates of sensor_readings (see rollups.py)."""
+    __tablename__ = 'sensor_rollups'
+    meter_number = db.Column(db.String(50), primary_key=True)
+    bucket = db.Column(db.String(10), primary_key=True)  # 'minute', 'hour' or 'day'
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    power_sum = db.Column(db.Float, nullable=False, default=0.0)
+    power_min = db.Column(db.Float)
+    power_max = db.Column(db.Float)
+    voltage_sum = db.Column(db.Float, nullable=False, default=0.0)
+    current_sum = db.Column(db.Float, nullable=False, default=0.0)
+
 class Message(db.Model):
     __tablename__ = 'messages'
     id = db.Column(db.Integer, primary_key=True)
@@ -104,6 +236,290 @@ class Message(db.Model):
     is_read = db.Column(db.Boolean, default=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        # Unread counts per sender for an inbox are answered from the index alone
+        db.Index('ix_messages_receiver_unread_sender', receiver_id, is_read, sender_id),
+    )
+
+####################################
+# Meter Balance Ledger
+####################################
+# Authoritative balances live in memory and are written back to users.current_power
+# in the background. Always read/modify balances through the ledger.
+os.makedirs(app.instance_path, exist_ok=True)
+ledger = BalanceLedger(app, db, app.config['LEDGER_JOURNAL'],
+                       flush_interval=app.config['LEDGER_FLUSH_INTERVAL'],
+                       miss_ttl=app.config['LEDGER_MISS_TTL'])
+
+def balance_of(user):
+    return ledger.get(user.meter_number, user.current_power)
+
+app.jinja_env.globals['balance_of'] = balance_of
+
+def user_row(u):
+    """JSON shape used by the admin user table (API and live stream)."""
+    return {
+        "id": u.id,
+        "username": u.username,
+        "meter_number": u.meter_number,
+        "province": u.province,
+        "district": u.district,
+        "sector": u.sector,
+        "current_power": balance_of(u)
+    }
+
+####################################
+# Live Updates (Server-Sent Events)
+####################################
+# One publish per change; every open dashboard for that meter gets it.
+event_broker = EventBroker()
+
+# Change versions behind /admin/api/users?since=.  Keys are user ids (profile
+# edits, registrations, deletions) or meter numbers (balance changes), so the
+# ingest path can record a change without looking up the owning user.
+# Versions live in this process only, like the ledger (single process).
+user_changes = ChangeLog(max_size=app.config['USER_CHANGELOG_SIZE'])
+# Moves only when users are registered or deleted, so the user table knows
+# when to recount instead of counting after every balance change.
+user_membership = ChangeLog(max_size=1)
+
+def touch_membership(user_id):
+    """Record a registration or deletion."""
+    user_changes.touch(user_id)
+    user_membership.touch('users')
+
+def publish_meter_update(meter_number, balance, reading_time=None, changed=True):
+    if balance is None:
+        return
+    payload = {
+        "meter_number": meter_number,
+        "current_power": "{:.2f}".format(balance)
+    }
+    if reading_time is not None:
+        payload["reading_time"] = reading_time.strftime('%Y-%m-%d %H:%M:%S')
+    event_broker.publish('meter:' + meter_number, payload, key=meter_number)
+    if changed:
+        user_changes.touch(meter_number)
+        event_broker.publish('admin:users', {
+            "meter_number": meter_number,
+            "current_power": balance
+        }, event='balance', key=meter_number)
+
+# Newest reading per meter, filled on ingest; misses fall back to the database
+latest_readings = LatestReadingCache(max_size=app.config['LATEST_READING_CACHE_SIZE'])
+
+def load_latest_reading(meter_number):
+    return (SensorReading.query
+            .filter_by(meter_number=meter_number)
+            .order_by(SensorReading.id.desc())
+            .first())
+
+def latest_reading(meter_number):
+    return latest_readings.get(meter_number, load_latest_reading)
+
+# Who owns each meter, so routes don't query users just to check a meter number
+def load_meter_owner(meter_number):
+    row = (db.session.query(User.id, User.username, User.role)
+           .filter(User.meter_number == meter_number)
+           .first())
+    return MeterOwner(*row) if row else None
+
+meter_directory = MeterDirectory(load_meter_owner, max_size=app.config['METER_DIRECTORY_SIZE'])
+
+def meter_owner(meter_number):
+    return meter_directory.get(meter_number)
+
+# All meter numbers, sorted, for autocomplete (loaded on first use)
+def load_meter_index():
+    rows = (db.session.query(User.meter_number, User.id, User.username, User.role)
+            .filter(User.meter_number.isnot(None)))
+    return ((m, MeterOwner(user_id, username, role)) for m, user_id, username, role in rows)
+
+meter_index = MeterIndex(load_meter_index)
+
+# /api/port_report and /report; balances come from the ledger
+reports = ReportBuilder(db, User, Transaction, SensorReading,
+                        ttl=app.config['REPORT_CACHE_TTL'], max_size=app.config['REPORT_CACHE_SIZE'],
+                        balance=lambda meter_number: ledger.get(meter_number))
+
+def commit_purchase(meter_number, purchased_watts):
+    """Commit the pending Transaction and credit the meter; returns the new balance."""
+    balance = ledger.commit_credit(db.session, meter_number, purchased_watts)
+    reports.invalidate(meter_number)
+    return balance
+
+# Sensor readings are inserted in batches by a background writer thread
+ingest_writer = IngestWriter(
+    app, db, SensorReading.__table__,
+    batch_size=app.config['INGEST_BATCH_SIZE'],
+    flush_interval=app.config['INGEST_FLUSH_INTERVAL'],
+    max_queue=app.config['INGEST_QUEUE_SIZE'],
+    retries=app.config['INGEST_WRITE_RETRIES'],
+    hooks=[RollupWriter(SensorRollup.__table__)]
+)
+
+def apply_readings(rows, store_unknown=True, submit=True):
+    """
+    Debit and queue a batch of parsed readings (see ingest.parse_readings).
+
+    Each meter is debited once for the sum of its readings and gets one live
+    update.  With submit=False the caller has already stored the rows.
+    Returns {meter_number: remaining balance, or None if unknown}.
+    """
+    per_meter = {}
+    for row in rows:
+        per_meter.setdefault(row['meter_number'], []).append(row)
+
+    results = {}
+    stored = []
+    for meter_number, meter_rows in per_meter.items():
+        newest = max(meter_rows, key=lambda r: r['reading_time'])
+        previous_power = ledger.get(meter_number)
+        remaining_power = ledger.debit(meter_number, sum(r['power'] for r in meter_rows))
+        results[meter_number] = remaining_power
+        if remaining_power is not None:
+            publish_meter_update(meter_number, remaining_power, newest['reading_time'],
+                                 changed=remaining_power != previous_power)
+        elif not store_unknown:
+            continue
+        stored.extend(meter_rows)
+        latest_readings.put(Reading(meter_number, newest['voltage'], newest['current'],
+                                    newest['power'], newest['reading_time']))
+        reports.record_reading(meter_number, newest['reading_time'])
+
+    # The insert itself is batched with other readings by the ingest writer.
+    if submit:
+        ingest_writer.submit_many(stored)
+    return results
+
+####################################
+# Metrics (/metrics, Prometheus text format)
+####################################
+ingest_messages = metrics.Counter('ingest_messages_total', 'MQTT messages received', ['topic'])
+ingest_readings = metrics.Counter('ingest_readings_total', 'Readings accepted for ingest', ['source'])
+ingest_errors = metrics.Counter('ingest_errors_total', 'Payloads rejected or failed', ['source'])
+ingest_commit_seconds = metrics.Histogram('ingest_commit_seconds', 'Time to insert one batch of readings')
+ingest_batch_rows = metrics.Histogram('ingest_batch_rows', 'Readings per committed batch',
+                                      buckets=(1, 10, 50, 100, 250, 500, 1000, 5000))
+metrics.Gauge('ingest_writer_queue_depth', 'Readings waiting for the batch writer',
+              callback=lambda: ingest_writer.qsize())
+metrics.Counter('ingest_writer_dropped_total', 'Readings dropped because the writer queue was full',
+                callback=lambda: ingest_writer.dropped)
+metrics.Counter('ingest_writer_failed_total', 'Readings lost because their batch failed every retry',
+                callback=lambda: ingest_writer.failed)
+metrics.Gauge('ingest_shard_queue_depth', 'Messages waiting per ingest shard', ['shard'],
+              callback=lambda: {s['shard']: s['depth'] for s in (ingest_pool.stats() if ingest_pool else [])})
+metrics.Counter('ingest_shard_dropped_total', 'Messages dropped because their ingest shard was full', ['shard'],
+                callback=lambda: {s['shard']: s['dropped'] for s in (ingest_pool.stats() if ingest_pool else [])})
+http_request_seconds = metrics.Histogram('http_request_duration_seconds', 'Request latency by route',
+                                         ['method', 'route', 'status'])
+http_request_queries = metrics.Histogram('http_request_db_queries', 'SQL statements executed per request',
+                                         ['route'], buckets=(0, 1, 2, 5, 10, 20, 50, 100, 500))
+http_request_db_seconds = metrics.Histogram('http_request_db_seconds', 'Time spent in SQL per request',
+                                            ['route'])
+metrics.Counter('cache_requests_total', 'In-memory cache lookups', ['cache', 'result'],
+                callback=lambda: {
+                    ('latest_reading', 'hit'): latest_readings.hits,
+                    ('latest_reading', 'miss'): latest_readings.misses,
+                    ('meter_directory', 'hit'): meter_directory.hits,
+                    ('meter_directory', 'miss'): meter_directory.misses,
+                    ('report', 'hit'): reports.hits,
+                    ('report', 'miss'): reports.misses,
+                })
+metrics.Gauge('sse_subscribers', 'Open Server-Sent Events connections',
+              callback=lambda: event_broker.subscriber_count())
+mqtt_connections = metrics.Counter('mqtt_connections_total', 'MQTT subscriber connection attempts', ['result'])
+mqtt_disconnects = metrics.Counter('mqtt_disconnects_total', 'MQTT subscriber disconnects')
+metrics.Counter('log_records_dropped_total', 'Log records discarded because the log queue was full',
+                callback=applog.dropped)
+
+def _observe_ingest_write(rows, seconds):
+    ingest_commit_seconds.observe(seconds)
+    ingest_batch_rows.observe(rows)
+
+ingest_writer.on_write = _observe_ingest_write
+
+sql_log = logging.getLogger('zion.sql')
+
+def _request_route():
+    if not has_request_context():
+        return None
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+# SQL totals of the request running in this thread.  A context variable rather
+# than `g`, so statements run under a nested app.app_context() (the ledger's)
+# are counted too; background threads have none.
+_request_sql = contextvars.ContextVar('request_sql', default=None)
+
+class RequestSqlStats:
+    __slots__ = ('queries', 'seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+with app.app_context():
+    @event.listens_for(db.engine, 'before_cursor_execute')
+    def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+        # Kept on the statement's own context: a failed statement never reaches
+        # after_cursor_execute, and its start time goes away with it.
+        if context is not None:
+            context._query_started = time.perf_counter()
+
+    @event.listens_for(db.engine, 'after_cursor_execute')
+    def _record_query(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, '_query_started', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        stats = _request_sql.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.seconds += elapsed
+        if app.config['SQL_PROFILING'] and elapsed * 1000 >= app.config['SLOW_QUERY_MS']:
+            route = _request_route() if stats is not None else None
+            sql_log.warning("Slow query (%.1f ms) on %s: %s", elapsed * 1000, route or 'background',
+                            ' '.join(statement.split())[:500],
+                            extra={'route': route, 'duration_ms': round(elapsed * 1000, 2),
+                                   'executemany': executemany})
+
+@app.before_request
+def _start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.sql = RequestSqlStats()
+    _request_sql.set(g.sql)
+
+@app.after_request
+def _record_request_metrics(response):
+    if 'request_started' in g:
+        route = _request_route()
+        http_request_seconds.observe(time.perf_counter() - g.request_started,
+                                     method=request.method, route=route, status=response.status_code)
+        sql = g.sql
+        http_request_queries.observe(sql.queries, route=route)
+        http_request_db_seconds.observe(sql.seconds, route=route)
+        if app.config['SQL_PROFILING']:
+            response.headers['X-SQL-Queries'] = str(sql.queries)
+            response.headers['X-SQL-Time'] = "{:.2f}ms".format(sql.seconds * 1000)
+            response.headers['Server-Timing'] = 'db;dur={:.2f};desc="{} queries"'.format(
+                sql.seconds * 1000, sql.queries)
+            if sql.queries > app.config['SQL_QUERIES_WARN']:
+                sql_log.warning("%s %s ran %d queries (%.1f ms in SQL)", request.method, route,
+                                sql.queries, sql.seconds * 1000,
+                                extra={'route': route, 'queries': sql.queries})
+    return response
+
+@app.teardown_request
+def _end_request_metrics(exc):
+    # Statements after the request (streamed responses, the next request on
+    # this thread) are not charged to it.
+    _request_sql.set(None)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint."""
+    return Response(metrics.REGISTRY.render(), mimetype=None, content_type=metrics.CONTENT_TYPE)
+
 ####################################
 # Utility: Database Init Command
 ####################################
@@ -114,6 +530,66 @@ def initdb():
     db.create_all()
     print("Database initialized!")
 
+def hot_queries(meter_number='K000200030005'):
+    """The per-meter lookups that run on every dashboard/report request."""
+    return {
+        'user by meter': User.query.filter_by(meter_number=meter_number).limit(1),
+        'latest reading by id': SensorReading.query.filter_by(meter_number=meter_number)
+            .order_by(SensorReading.id.desc()).limit(1),
+        'latest reading by time': SensorReading.query.filter_by(meter_number=meter_number)
+            .order_by(SensorReading.reading_time.desc()).limit(1),
+        'latest transaction': Transaction.query.filter_by(meter_number=meter_number)
+            .order_by(Transaction.date_purchased.desc()).limit(1),
+    }
+
+@app.cli.command('rollup-backfill')
+@click.option('--days', type=int, default=None,
+              help='Only rebuild the last N days (default: all raw readings).')
+def rollup_backfill(days):
+    """Recompute sensor_rollups from raw sensor_readings."""
+    start = None
+    if days is not None:
+        start = (datetime.utcnow() - timedelta(days=days)).replace(hour=0, minute=0, second=0, microsecond=0)
+    with db.engine.begin() as conn:
+        rows = rebuild_rollups(conn, start=start)
+    print(f"Rebuilt {rows} rollup rows.")
+
+@app.cli.command('prune-readings')
+@click.option('--raw-days', type=int, default=None,
+              help='Override RETENTION_RAW_DAYS for this run.')
+def prune_readings(raw_days):
+    """Apply the retention policy to sensor readings and rollups."""
+    if ensure_incremental_vacuum(db.engine):
+        print("Switched database to incremental auto-vacuum (one-time VACUUM).")
+    counts = apply_retention(
+        db.engine,
+        raw_days=raw_days if raw_days is not None else app.config['RETENTION_RAW_DAYS'],
+        rollup_days=app.config['RETENTION_ROLLUP_DAYS'],
+        batch_size=app.config['RETENTION_BATCH_SIZE']
+    )
+    for name, count in counts.items():
+        print(f"Deleted {count} {name} rows.")
+    pages = incremental_vacuum(db.engine)
+    print(f"Released {pages} free pages.")
+
+@app.cli.command('check-query-plans')
+def check_query_plans():
+    """Fail if a hot route query falls back to a table scan or a sort."""
+    failures = 0
+    for name, query in hot_queries().items():
+        sql = str(query.statement.compile(dialect=db.engine.dialect,
+                                          compile_kwargs={'literal_binds': True}))
+        plan = [row[-1] for row in db.session.execute(db.text('EXPLAIN QUERY PLAN ' + sql))]
+        bad = [step for step in plan
+               if (step.startswith('SCAN') and 'USING' not in step) or 'TEMP B-TREE' in step]
+        status = 'FAIL' if bad else 'ok'
+        print(f"[{status}] {name}: {' | '.join(plan)}")
+        failures += bool(bad)
+    if failures:
+        print(f"{failures} hot queries are not index-backed. Run 'flask db upgrade'.")
+        sys.exit(1)
+    print("All hot queries use an index.")
+
 ####################################
 # Auth / Session Helpers (Simple)
 ####################################
@@ -143,7 +619,12 @@ def is_admin():
 ####################################
 # Create a global MQTT publisher for relay commands.
 flask_mqtt_client = mqtt.Client(client_id="flask_publisher", protocol=mqtt.MQTTv311)
-flask_mqtt_client.connect(mqtt_server, mqtt_port, 60)
+try:
+    flask_mqtt_client.connect(mqtt_server, mqtt_port, 60)
+except OSError as e:
+    # Keep the app (and CLI/benchmarks) usable without a broker; relay
+    # commands are simply not delivered until it is reachable.
+    log.warning("MQTT publisher could not connect to %s:%s: %s", mqtt_server, mqtt_port, e)
 
 ####################################
 # Routes
@@ -264,6 +745,12 @@ def register():
         )
         db.session.add(new_user)
         db.session.commit()
+        ledger.add_meter(meter_number, 0.0)
+        owner = MeterOwner(new_user.id, new_user.username, new_user.role)
+        meter_directory.put(meter_number, owner)
+        meter_index.put(meter_number, owner)
+        touch_membership(new_user.id)
+        event_broker.publish('admin:users', user_row(new_user), event='user', key=new_user.id)
         flash("Registration successful! Please login.", "success")
         return redirect(url_for('login'))
 
@@ -349,64 +836,284 @@ def logout():
     }
 })
 def admin_dashboard():
-    users = User.query.all()
-    return render_template('admin_dashboard.html', users=users)
+    # Rows are loaded page by page by the table itself
+    return render_template('admin_dashboard.html', user_count=User.query.count())
+
+# Sort keys for the paged user list; NULLs are folded so (key, id) is a total
+# order that the ix_users_*_id expression indexes can walk.  The defaults are
+# literals, not parameters, or SQLite won't match the index expressions.
+USER_SORT_KEYS = {
+    'id': None,
+    'balance': db.func.coalesce(User.current_power, db.literal_column('0.0')),
+    'district': db.func.coalesce(User.district, db.literal_column("''")),
+}
+
+def search_user_ids(search_query):
+    return user_search.search_user_ids(db.session, search_query, app.config['ADMIN_SEARCH_LIMIT'])
+
+def filter_user_search(query, search_query):
+    if not search_query:
+        return query
+    # Every match, not just the ADMIN_SEARCH_LIMIT best (pages and counts)
+    return query.filter(User.id.in_(user_search.matching_ids(db.session, search_query)))
+
+def ranked_search(search_query):
+    """Users matching `search_query`, best match first."""
+    ids = search_user_ids(search_query)
+    rank = {user_id: i for i, user_id in enumerate(ids)}
+    return sorted(User.query.filter(User.id.in_(ids)).all(), key=lambda u: rank[u.id])
+
+def users_page(query, sort, descending, after_id, after_value, limit):
+    """
+    One keyset page: rows strictly after the (sort key, id) cursor.  Balance
+    order uses the persisted balance, which trails the ledger by at most
+    LEDGER_FLUSH_INTERVAL.  Returns (users, next cursor or None).
+    """
+    key = USER_SORT_KEYS[sort]
+    columns = (key, User.id) if key is not None else (User.id,)
+    if after_id is not None:
+        if key is None:
+            query = query.filter(User.id < after_id if descending else User.id > after_id)
+        elif descending:
+            # Spelled out rather than as a row value so SQLite seeks the index
+            query = query.filter(key <= after_value, (key < after_value) | (User.id < after_id))
+        else:
+            query = query.filter(key >= after_value, (key > after_value) | (User.id > after_id))
+    query = query.order_by(*(c.desc() if descending else c.asc() for c in columns))
+    users = query.limit(limit + 1).all()
+    if len(users) <= limit:
+        return users, None
+    users = users[:limit]
+    last = users[-1]
+    cursor = {'after_id': last.id}
+    if sort == 'balance':
+        cursor['after_value'] = last.current_power or 0.0
+    elif sort == 'district':
+        cursor['after_value'] = last.district or ''
+    return users, cursor
 
 @app.route('/admin/api/users')
 @swag_from({
     'tags': ['Admin'],
     'summary': 'Get all users or search for users',
+    'description': 'Without `since` or `limit`, returns the list of users. With `limit`, returns '
+                   'one page sorted by `sort`; pass the returned `next` back as query parameters for '
+                   'the following page. With `since`, returns only users changed after that version, '
+                   'or a full snapshot (`full: true`) if the version is too old; with snapshot=0 the '
+                   'snapshot rows are left out and the client should reload its pages. Start with '
+                   'since=0 (or the `version` of a page) and pass back the returned `version`. '
+                   'Versions are issued by the single app process and are not stable across restarts.',
     'parameters': [
         {
             'name': 'search',
             'in': 'query',
             'type': 'string',
             'required': False,
-            'description': 'Search term for username or meter number'
+            'description': 'Search term (username, meter number, phone, location). Without `sort`, '
+                           'results are ranked (exact, then prefix, then substring matches) and '
+                           'limited to ADMIN_SEARCH_LIMIT'
+        },
+        {
+            'name': 'since',
+            'in': 'query',
+            'type': 'integer',
+            'required': False,
+            'description': 'Change version from a previous response'
+        },
+        {
+            'name': 'snapshot',
+            'in': 'query',
+            'type': 'integer',
+            'required': False,
+            'description': 'With since: 0 to omit the rows of a full snapshot'
+        },
+        {
+            'name': 'limit',
+            'in': 'query',
+            'type': 'integer',
+            'required': False,
+            'description': 'Page size (capped at ADMIN_USERS_MAX_PAGE_SIZE)'
+        },
+        {
+            'name': 'sort',
+            'in': 'query',
+            'type': 'string',
+            'enum': ['id', 'balance', 'district'],
+            'required': False,
+            'description': 'Page order (default id, or relevance when searching)'
+        },
+        {
+            'name': 'order',
+            'in': 'query',
+            'type': 'string',
+            'enum': ['asc', 'desc'],
+            'required': False,
+            'description': 'Sort direction (default asc)'
+        },
+        {
+            'name': 'after_id',
+            'in': 'query',
+            'type': 'integer',
+            'required': False,
+            'description': 'Cursor: id of the last row of the previous page'
+        },
+        {
+            'name': 'after_value',
+            'in': 'query',
+            'type': 'string',
+            'required': False,
+            'description': 'Cursor: sort value of the last row of the previous page (balance/district)'
         }
     ],
     'responses': {
         200: {
-            'description': 'List of users',
+            'description': 'List of users, or a delta when `since` is given',
             'schema': {
-                'type': 'array',
-                'items': {
-                    'type': 'object',
-                    'properties': {
-                        'id': {'type': 'integer'},
-                        'username': {'type': 'string'},
-                        'meter_number': {'type': 'string'},
-                        'province': {'type': 'string'},
-                        'district': {'type': 'string'},
-                        'sector': {'type': 'string'},
-                        'current_power': {'type': 'number'}
+                'type': 'object',
+                'properties': {
+                    'version': {'type': 'integer'},
+                    'full': {'type': 'boolean'},
+                    'users': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'id': {'type': 'integer'},
+                                'username': {'type': 'string'},
+                                'meter_number': {'type': 'string'},
+                                'province': {'type': 'string'},
+                                'district': {'type': 'string'},
+                                'sector': {'type': 'string'},
+                                'current_power': {'type': 'number'}
+                            }
+                        }
+                    },
+                    'removed': {'type': 'array', 'items': {'type': 'integer'}},
+                    'members': {'type': 'integer', 'description': 'Changes when users are added or '
+                                                                  'removed (delta only); recount then'},
+                    'next': {
+                        'type': 'object',
+                        'properties': {
+                            'after_id': {'type': 'integer'},
+                            'after_value': {'type': 'string'}
+                        }
                     }
                 }
             }
+        },
+        400: {
+            'description': 'Invalid sort, order or cursor'
         }
     }
 })
 def admin_api_users():
     search_query = request.args.get('search', '').strip()
-    if search_query:
-        users = User.query.filter(
-            (User.username.ilike(f"%{search_query}%")) |
-            (User.meter_number.ilike(f"%{search_query}%"))
-        ).all()
-    else:
-        users = User.query.all()
-    data = []
-    for u in users:
-        data.append({
-            "id": u.id,
-            "username": u.username,
-            "meter_number": u.meter_number,
-            "province": u.province,
-            "district": u.district,
-            "sector": u.sector,
-            "current_power": u.current_power
-        })
-    return jsonify(data)
+    since = request.args.get('since', type=int)
+    # Read the version before the rows: a change racing this request is
+    # then sent again next time rather than missed.
+    version, changed = user_changes.since(since if since is not None else -1)
+
+    if search_query and since is None and 'sort' not in request.args:
+        # Search results come back ranked (and limited) rather than sorted
+        users = [user_row(u) for u in ranked_search(search_query)]
+        if 'limit' in request.args:
+            return jsonify({'version': version, 'users': users, 'next': None})
+        response = jsonify(users)
+        response.headers['X-Users-Version'] = str(version)
+        return response
+
+    query = filter_user_search(User.query, search_query)
+
+    if since is None and 'limit' in request.args:
+        limit = request.args.get('limit', app.config['ADMIN_USERS_PAGE_SIZE'], type=int)
+        limit = max(1, min(limit, app.config['ADMIN_USERS_MAX_PAGE_SIZE']))
+        sort = request.args.get('sort', 'id')
+        order = request.args.get('order', 'asc')
+        after_id = request.args.get('after_id', type=int)
+        after_value = request.args.get('after_value')
+        if sort not in USER_SORT_KEYS or order not in ('asc', 'desc'):
+            return jsonify({'error': 'sort must be id, balance or district; order asc or desc'}), 400
+        if sort == 'balance' and after_id is not None:
+            try:
+                after_value = float(after_value)
+            except (TypeError, ValueError):
+                return jsonify({'error': 'after_value must be a number when sorting by balance'}), 400
+        elif sort == 'district' and after_id is not None:
+            after_value = after_value or ''
+        users, cursor = users_page(query, sort, order == 'desc', after_id, after_value, limit)
+        return jsonify({'version': version, 'users': [user_row(u) for u in users], 'next': cursor})
+
+    if since is None or changed is None:
+        if since is not None and request.args.get('snapshot', 1, type=int) == 0:
+            # Paged clients reload their pages rather than take every row
+            return jsonify({'version': version, 'full': True, 'users': [], 'removed': []})
+        users = query.all()
+        if since is None:
+            response = jsonify([user_row(u) for u in users])
+            response.headers['X-Users-Version'] = str(version)
+            return response
+        return jsonify({'version': version, 'full': True, 'users': [user_row(u) for u in users],
+                        'removed': []})
+
+    user_ids = [k for k in changed if isinstance(k, int)]
+    meter_numbers = [k for k in changed if not isinstance(k, int)]
+    users = []
+    # Stay well below SQLite's bound-parameter limit
+    for i in range(0, max(len(user_ids), len(meter_numbers)), 500):
+        ids, meters = user_ids[i:i + 500], meter_numbers[i:i + 500]
+        users.extend(query.filter(User.id.in_(ids) | User.meter_number.in_(meters)).all())
+    rows = {u.id: user_row(u) for u in users}
+    return jsonify({
+        'version': version,
+        'full': False,
+        'users': list(rows.values()),
+        # Deleted, or no longer matching the search
+        'removed': [i for i in user_ids if i not in rows],
+        'members': user_membership.version
+    })
+
+@app.route('/admin/api/users/count')
+@swag_from({
+    'tags': ['Admin'],
+    'summary': 'Count users',
+    'description': 'Number of users matching `search`, plus fleet-wide meter count and total balance.',
+    'parameters': [
+        {
+            'name': 'search',
+            'in': 'query',
+            'type': 'string',
+            'required': False,
+            'description': 'Search term for username or meter number'
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'User count',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'count': {'type': 'integer'},
+                    'meters': {'type': 'integer'},
+                    'total_power': {'type': 'number'},
+                    'version': {'type': 'integer'},
+                    'members': {'type': 'integer'}
+                }
+            }
+        }
+    }
+})
+def admin_api_users_count():
+    version = user_changes.version
+    members = user_membership.version
+    search_query = request.args.get('search', '').strip()
+    count = filter_user_search(User.query, search_query).count()
+    return jsonify({
+        'count': count,
+        'meters': len(ledger),
+        'total_power': round(ledger.total(), 2),
+        'version': version,
+        'members': members
+    })
 
 @app.route('/admin/api/users/<int:user_id>/update', methods=['POST'])
 @swag_from({
@@ -456,16 +1163,38 @@ def admin_api_users():
 def admin_api_users_update(user_id):
     user = User.query.get_or_404(user_id)
     data = request.json
+    old_meter = user.meter_number
     user.username = data.get('username', user.username)
     user.meter_number = data.get('meter_number', user.meter_number)
     user.province = data.get('province', user.province)
     user.district = data.get('district', user.district)
     user.sector = data.get('sector', user.sector)
+    balance = None
     try:
-        user.current_power = float(data.get('current_power', user.current_power))
-    except ValueError:
+        if 'current_power' in data:
+            balance = float(data['current_power'])
+    except (ValueError, TypeError):
         pass
-    db.session.commit()
+    if balance is not None and not user.meter_number:
+        user.current_power = balance
+    if user.meter_number != old_meter:
+        # Commits the rename together with the old meter's unflushed consumption
+        ledger.commit_rename(db.session, user.id, old_meter, user.meter_number)
+        latest_readings.discard(old_meter)
+    else:
+        db.session.commit()
+    if balance is not None and user.meter_number:
+        # Written under the ledger's flush lock so a concurrent flush can't
+        # apply older deltas on top of it
+        ledger.commit_set(db.session, user.meter_number, balance)
+    meter_directory.discard(old_meter, user.meter_number)
+    meter_index.discard(old_meter)
+    meter_index.put(user.meter_number, MeterOwner(user.id, user.username, user.role))
+    reports.invalidate(old_meter, user.meter_number)
+    user_changes.touch(user.id)
+    event_broker.publish('admin:users', user_row(user), event='user', key=user.id)
+    if user.meter_number:
+        publish_meter_update(user.meter_number, balance_of(user), changed=False)
     return jsonify({"success": True})
 
 @app.route('/admin/api/users/<int:user_id>/delete', methods=['DELETE'])
@@ -500,6 +1229,13 @@ def admin_api_users_delete(user_id):
     user = User.query.get_or_404(user_id)
     db.session.delete(user)
     db.session.commit()
+    ledger.remove_meter(user.meter_number)
+    latest_readings.discard(user.meter_number)
+    meter_directory.discard(user.meter_number)
+    meter_index.discard(user.meter_number)
+    reports.invalidate(user.meter_number)
+    touch_membership(user_id)
+    event_broker.publish('admin:users', {"id": user_id}, event='delete', key=user_id)
     return jsonify({"success": True})
 
 @app.route('/admin/other_users', endpoint='other_admin_users')
@@ -543,7 +1279,7 @@ def admin_view_meter():
     meter_data = None
     if request.method == 'POST':
         meter_number = request.form.get('meter_number')
-        meter_data = SensorReading.query.filter_by(meter_number=meter_number).order_by(SensorReading.id.desc()).first()
+        meter_data = latest_reading(meter_number)
         if not meter_data:
             flash("No data found for that meter.", "error")
     return render_template('admin_view_meter.html', meter_data=meter_data)
@@ -591,8 +1327,7 @@ def admin_buy_electricity():
             flash("Please enter a valid amount.", "error")
             return render_template('admin_buy_electricity.html')
 
-        user = User.query.filter_by(meter_number=meter_number).first()
-        if user:
+        if meter_owner(meter_number):
             # Redirect to payment page with purchase details
             return redirect(url_for('payment_page', 
                                    amount=amount, 
@@ -624,7 +1359,7 @@ def user_dashboard():
     if not user:
         flash("Please log in first.", "error")
         return redirect(url_for('login'))
-    meter_data = SensorReading.query.filter_by(meter_number=user.meter_number).order_by(SensorReading.id.desc()).first()
+    meter_data = latest_reading(user.meter_number)
     return render_template('user_dashboard.html', meter_data=meter_data, user=user)
 
 @app.route('/user/buy-electricity', methods=['POST'])
@@ -699,14 +1434,13 @@ def user_buy_electricity():
         purchased_watts = amount / 500.0
 
         if buy_for == 'self':
-            user.current_power += purchased_watts
             db.session.add(Transaction(
                 user_id=user.id,
                 meter_number=user.meter_number,
                 purchase_amount=amount,
                 purchase_power=purchased_watts
             ))
-            db.session.commit()
+            publish_meter_update(user.meter_number, commit_purchase(user.meter_number, purchased_watts))
             return jsonify({
                 "success": True, 
                 "message": f"You purchased {purchased_watts:.2f} W for yourself.",
@@ -716,19 +1450,18 @@ def user_buy_electricity():
             if not other_meter:
                 return jsonify({"success": False, "message": "Meter number is required"}), 400
 
-            other_user = User.query.filter_by(meter_number=other_meter).first()
+            other_user = meter_owner(other_meter)
             if not other_user:
                 return jsonify({"success": False, "message": "Meter not found"}), 404
 
             purchased_watts = amount / 500.0
-            other_user.current_power += purchased_watts
             db.session.add(Transaction(
-                user_id=other_user.id,
+                user_id=other_user.user_id,
                 meter_number=other_meter,
                 purchase_amount=amount,
                 purchase_power=purchased_watts
             ))
-            db.session.commit()
+            publish_meter_update(other_meter, commit_purchase(other_meter, purchased_watts))
             return jsonify({
                 "success": True, 
                 "message": f"You purchased {purchased_watts:.2f} W for {other_user.username}.",
@@ -754,7 +1487,7 @@ def user_buy_electricity():
             return redirect(url_for('user_dashboard'))
 
         if buy_for == 'other':
-            other_user = User.query.filter_by(meter_number=other_meter).first()
+            other_user = meter_owner(other_meter)
             if not other_user:
                 flash("Meter not found.", "error")
                 return redirect(url_for('user_dashboard'))
@@ -837,7 +1570,6 @@ def process_payment():
 
     # Process the purchase
     if buy_for == 'self':
-        user.current_power += purchased_watts
         db.session.add(Transaction(
             user_id=user.id,
             meter_number=user.meter_number,
@@ -845,43 +1577,41 @@ def process_payment():
             purchase_power=purchased_watts,
             payment_method=payment_method
         ))
-        db.session.commit()
+        publish_meter_update(user.meter_number, commit_purchase(user.meter_number, purchased_watts))
         flash(f"You purchased {purchased_watts:.2f} W for yourself using {payment_method.upper()}.", "success")
         return redirect(url_for('user_dashboard'))
     elif buy_for == 'admin':
         # Admin purchase for a user
-        target_user = User.query.filter_by(meter_number=meter_number).first()
+        target_user = meter_owner(meter_number)
         if not target_user:
             flash("Meter not found.", "error")
             return redirect(url_for('admin_buy_electricity'))
 
-        target_user.current_power += purchased_watts
         db.session.add(Transaction(
-            user_id=target_user.id,
+            user_id=target_user.user_id,
             meter_number=meter_number,
             purchase_amount=amount,
             purchase_power=purchased_watts,
             payment_method=payment_method
         ))
-        db.session.commit()
+        publish_meter_update(meter_number, commit_purchase(meter_number, purchased_watts))
         flash(f"Successfully purchased {purchased_watts:.2f} W for {target_user.username} using {payment_method.upper()}.", "success")
         return redirect(url_for('admin_dashboard'))
     else:
         # User purchase for another user
-        other_user = User.query.filter_by(meter_number=other_meter_number).first()
+        other_user = meter_owner(other_meter_number)
         if not other_user:
             flash("Meter not found.", "error")
             return redirect(url_for('user_dashboard'))
 
-        other_user.current_power += purchased_watts
         db.session.add(Transaction(
-            user_id=other_user.id,
+            user_id=other_user.user_id,
             meter_number=other_meter_number,
             purchase_amount=amount,
             purchase_power=purchased_watts,
             payment_method=payment_method
         ))
-        db.session.commit()
+        publish_meter_update(other_meter_number, commit_purchase(other_meter_number, purchased_watts))
         flash(f"You purchased {purchased_watts:.2f} W for {other_user.username} using {payment_method.upper()}.", "success")
         return redirect(url_for('user_dashboard'))
 
@@ -914,12 +1644,82 @@ def process_payment():
 })
 def check_meter():
     meter = request.args.get('meter', '')
-    user = User.query.filter_by(meter_number=meter).first()
-    if user:
-        return jsonify({'exists': True, 'username': user.username})
+    owner = meter_owner(meter)
+    if owner:
+        return jsonify({'exists': True, 'username': owner.username})
     else:
         return jsonify({'exists': False})
 
+@app.route('/api/meters/suggest')
+@swag_from({
+    'tags': ['Admin'],
+    'summary': 'Meter number autocomplete',
+    'description': 'Registered meter numbers starting with a prefix, in order. Requires a login; '
+                   'owners are only listed for admins. Served from an in-memory sorted index; '
+                   'an exact match comes first.',
+    'parameters': [
+        {
+            'name': 'prefix',
+            'in': 'query',
+            'type': 'string',
+            'required': True,
+            'description': 'Start of the meter number (matched as typed, then upper case)'
+        },
+        {
+            'name': 'limit',
+            'in': 'query',
+            'type': 'integer',
+            'required': False,
+            'description': 'Most suggestions to return (default 10, at most 50)'
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Matching meters',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'exists': {'type': 'boolean', 'description': 'The prefix is itself a meter number'},
+                    'meters': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'meter_number': {'type': 'string'},
+                                'username': {'type': 'string', 'description': 'Owner (admins only)'}
+                            }
+                        }
+                    }
+                }
+            }
+        },
+        401: {
+            'description': 'Not logged in'
+        }
+    }
+})
+def api_meters_suggest():
+    # Session only, no SQL: the point of the index is to keep this off the database
+    if 'user_id' not in session:
+        return jsonify({'error': 'Please log in first.'}), 401
+    show_owner = session.get('role') == 'admin'
+    prefix = request.args.get('prefix', '').strip()
+    limit = request.args.get('limit', app.config['METER_SUGGEST_LIMIT'], type=int)
+    limit = max(1, min(limit, app.config['METER_SUGGEST_MAX_LIMIT']))
+    found = meter_index.suggest(prefix, limit)
+    if not found and prefix.upper() != prefix:
+        found = meter_index.suggest(prefix.upper(), limit)
+    meters = []
+    for meter_number, owner in found:
+        meter = {'meter_number': meter_number}
+        if show_owner:
+            meter['username'] = owner.username
+        meters.append(meter)
+    return jsonify({
+        'exists': bool(found) and found[0][0] in (prefix, prefix.upper()),
+        'meters': meters
+    })
+
 @app.route('/admin/users')
 @swag_from({
     'tags': ['Admin'],
@@ -1013,20 +1813,32 @@ def admin_messages(user_id=None):
             )
             db.session.add(admin)
             db.session.commit()
+            touch_membership(admin.id)
+
+    # Unread message counts per sender, in one grouped query
+    unread_counts = {}
+    if admin and admin.id:
+        unread_counts = dict(
+            db.session.query(Message.sender_id, db.func.count(Message.id))
+            .filter(Message.receiver_id == admin.id, Message.is_read == False)  # noqa: E712
+            .group_by(Message.sender_id)
+            .all()
+        )
+
+    # Mark messages from the selected user as read before loading anything
+    # else, so the commit doesn't expire (and reload) the objects rendered below
+    if user_id and admin and admin.id and unread_counts.get(user_id):
+        Message.query.filter_by(
+            sender_id=user_id,
+            receiver_id=admin.id,
+            is_read=False
+        ).update({'is_read': True}, synchronize_session=False)
+        db.session.commit()
 
     users = User.query.filter_by(role='user').all()
     selected_user = None
     chat_messages = []
 
-    # Get unread message counts for each user
-    unread_counts = {}
-    for user in users:
-        # Only check for unread messages if admin has an id
-        if admin and admin.id:
-            count = Message.query.filter_by(sender_id=user.id, receiver_id=admin.id, is_read=False).count()
-            if count > 0:
-                unread_counts[user.id] = count
-
     if user_id:
         selected_user = User.query.get(user_id)
         if selected_user and admin and admin.id:
@@ -1036,18 +1848,6 @@ def admin_messages(user_id=None):
                 ((Message.receiver_id == admin.id) & (Message.sender_id == user_id))
             ).order_by(Message.timestamp).all()
 
-            # Mark messages from this user as read
-            unread_messages = Message.query.filter_by(
-                sender_id=user_id, 
-                receiver_id=admin.id,
-                is_read=False
-            ).all()
-
-            for message in unread_messages:
-                message.is_read = True
-
-            db.session.commit()
-
     return render_template(
         'admin_messages.html',
         users=users,
@@ -1076,6 +1876,7 @@ def admin_send_message(user_id):
             )
             db.session.add(admin)
             db.session.commit()
+            touch_membership(admin.id)
 
     user = User.query.get(user_id)
 
@@ -1130,38 +1931,17 @@ def admin_send_message(user_id):
     }
 })
 def api_report(meter_number): 
-    user = User.query.filter_by(meter_number=meter_number).first()
-    if not user:
+    report = reports.build(meter_number)
+    if report is None:
         return jsonify({'error': 'Meter not found'}), 404
 
-    latest_transaction = (Transaction.query
-                          .filter_by(meter_number=meter_number)
-                          .order_by(Transaction.date_purchased.desc())
-                          .first())
-
-    latest_reading = (SensorReading.query
-                      .filter_by(meter_number=meter_number)
-                      .order_by(SensorReading.reading_time.desc())
-                      .first())
-
-    if latest_transaction and latest_transaction.purchase_power is not None:
-        purchased_power = latest_transaction.purchase_power
-        purchased_date = latest_transaction.date_purchased.strftime("%Y-%m-%d %H:%M:%S")
-    else:
-        purchased_power = 0.0
-        purchased_date = "N/A"
-
-    current_power = user.current_power or 0.0
-    consumed_power = purchased_power - current_power
-    latest_date   = latest_reading.reading_time.strftime("%Y-%m-%d %H:%M:%S") if latest_reading else "N/A"
-
     return jsonify({
         'meter_number'          : meter_number,
-        'latest_purchased_power': round(purchased_power, 2),
-        'current_power'         : round(current_power, 2),
-        'consumed_power'        : round(consumed_power, 2),
-        'purchased_date'        : purchased_date,
-        'latest_date'           : latest_date
+        'latest_purchased_power': round(report['purchased_power'], 2),
+        'current_power'         : round(report['current_power'], 2),
+        'consumed_power'        : round(report['consumed_power'], 2),
+        'purchased_date'        : report['purchased_date'],
+        'latest_date'           : report['latest_date']
     })
 
 
@@ -1171,37 +1951,16 @@ def report(meter_number):
     """
     Render the same data inside templates/report.html
     """
-    user = User.query.filter_by(meter_number=meter_number).first()
-    if not user:
+    built = reports.build(meter_number)
+    if built is None:
         return render_template("report.html", meter=meter_number, error="Meter not found")
 
-    latest_transaction = (Transaction.query
-                          .filter_by(meter_number=meter_number)
-                          .order_by(Transaction.date_purchased.desc())
-                          .first())
-
-    latest_reading = (SensorReading.query
-                      .filter_by(meter_number=meter_number)
-                      .order_by(SensorReading.reading_time.desc())
-                      .first())
-
-    if latest_transaction and latest_transaction.purchase_power is not None:
-        purchased_power = latest_transaction.purchase_power
-        purchased_at    = latest_transaction.date_purchased.strftime("%Y-%m-%d %H:%M:%S")
-    else:
-        purchased_power = 0.0
-        purchased_at    = "N/A"
-
-    current_power = user.current_power or 0.0
-    consumed_power = purchased_power - current_power
-    updated_at     = latest_reading.reading_time.strftime("%Y-%m-%d %H:%M:%S") if latest_reading else "N/A"
-
     report = {
-        "purchased_power": round(purchased_power, 2),
-        "current_power"  : round(current_power, 2),
-        "consumed_power" : round(consumed_power, 2),
-        "updated_at"     : updated_at,
-        "purchased_at"   : purchased_at
+        "purchased_power": round(built['purchased_power'], 2),
+        "current_power"  : round(built['current_power'], 2),
+        "consumed_power" : round(built['consumed_power'], 2),
+        "updated_at"     : built['latest_date'],
+        "purchased_at"   : built['purchased_date']
     }
 
     return render_template("report.html", meter=meter_number, report=report)
@@ -1279,7 +2038,7 @@ def collect_data():
 
     # Here you would typically store this data in a database
     # For now, we'll just log it
-    print(f"Collected data: meter_number={meter_number}, screen_name={screen_name}")
+    log.info("Collected data: meter_number=%s, screen_name=%s", meter_number, screen_name)
 
     return jsonify({
         "success": True,
@@ -1327,7 +2086,7 @@ def collect_data():
     }
 })
 def api_latest_reading(meter_number):
-    reading = SensorReading.query.filter_by(meter_number=meter_number).order_by(SensorReading.id.desc()).first()
+    reading = latest_reading(meter_number)
     if reading:
         return jsonify({
             'voltage': reading.voltage,
@@ -1338,6 +2097,136 @@ def api_latest_reading(meter_number):
     else:
         return jsonify({'error': 'No reading found'}), 404
 
+@app.route('/api/readings/bulk', methods=['POST'])
+@swag_from({
+    'tags': ['Meter Readings'],
+    'summary': 'Upload many readings at once (gateways)',
+    'description': ('Body is JSON lines: one reading object per line with meter_number, voltage, '
+                    'current, power_consumed and optional ts (epoch seconds or ISO 8601 UTC). '
+                    'A line may also hold several readings, as {"meter_number": ..., "readings": [...]}; '
+                    'such a line is accepted or rejected as a whole. '
+                    'Send with Content-Encoding: gzip to upload compressed. Lines are limited to '
+                    'MAX_BULK_LINE_BYTES and the decompressed body to MAX_BULK_BODY_BYTES. '
+                    'Accepted rows are written in a single transaction before the response is sent.'),
+    'consumes': ['application/x-ndjson'],
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'description': 'Newline-delimited JSON readings',
+            'schema': {'type': 'string'}
+        }
+    ],
+    'responses': {
+        200: {
+            'description': ("Status of each non-blank line by its 1-based line number ('ok', "
+                            "'unknown_meter' or 'invalid: <reason>'), the number of readings "
+                            "accepted and the number of lines rejected"),
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'accepted': {'type': 'integer'},
+                    'rejected': {'type': 'integer'},
+                    'status': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'line': {'type': 'integer'},
+                                'status': {'type': 'string'}
+                            }
+                        }
+                    }
+                }
+            }
+        },
+        400: {
+            'description': 'Unreadable body'
+        },
+        413: {
+            'description': 'Too many readings, or body too large'
+        }
+    }
+})
+def api_readings_bulk():
+    stream = request.stream
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip' or request.mimetype == 'application/gzip':
+        stream = gzip.GzipFile(fileobj=stream, mode='rb')
+    limit = app.config['MAX_BULK_READINGS']
+    line_limit = app.config['MAX_BULK_LINE_BYTES']
+    body_limit = app.config['MAX_BULK_BODY_BYTES']
+    too_large = f"Upload larger than {body_limit} bytes (decompressed)"
+    received_at = datetime.utcnow()
+
+    statuses = []
+    accepted = []
+    rejected = 0
+    body_read = 0
+    line_number = 0
+    try:
+        while True:
+            # Bounded reads: neither one long line nor a gzip bomb is held in memory
+            line = stream.readline(line_limit + 1)
+            if not line:
+                break
+            body_read += len(line)
+            line_number += 1
+            if len(line) > line_limit and not line.endswith(b'\n'):
+                while line and not line.endswith(b'\n'):
+                    line = stream.readline(line_limit)
+                    body_read += len(line)
+                    if body_read > body_limit:
+                        return jsonify({'error': too_large}), 413
+                statuses.append({'line': line_number, 'status': f"invalid: line longer than {line_limit} bytes"})
+                rejected += 1
+                continue
+            if body_read > body_limit:
+                return jsonify({'error': too_large}), 413
+            if not line.strip():
+                continue
+            if len(statuses) >= limit:
+                return jsonify({'error': f"At most {limit} readings per upload"}), 413
+            try:
+                item = json.loads(line.decode('utf-8'))
+                if not isinstance(item, dict):
+                    raise PayloadError("line must be a reading object")
+                rows = parse_readings(item, received_at, app.config['MAX_READINGS_PER_PAYLOAD'])
+                if not rows:
+                    raise PayloadError("no readings")
+            except ValueError as e:  # includes JSON, UTF-8 and payload errors
+                statuses.append({'line': line_number, 'status': f"invalid: {e}"})
+                rejected += 1
+                continue
+            if not all(ledger.has(meter_number) for meter_number in {row['meter_number'] for row in rows}):
+                statuses.append({'line': line_number, 'status': 'unknown_meter'})
+                rejected += 1
+                continue
+            if len(accepted) + len(rows) > limit:
+                return jsonify({'error': f"At most {limit} readings per upload"}), 413
+            statuses.append({'line': line_number, 'status': 'ok'})
+            accepted.extend(rows)
+    except (OSError, EOFError) as e:
+        return jsonify({'error': f"Could not read body: {e}"}), 400
+
+    if accepted:
+        try:
+            ingest_writer.write(accepted)
+        except Exception as e:
+            log.exception("Bulk upload of %d readings failed", len(accepted))
+            return jsonify({'error': 'Could not store readings'}), 500
+        apply_readings(accepted, submit=False)
+        ingest_readings.inc(len(accepted), source='bulk')
+    if rejected:
+        ingest_errors.inc(rejected, source='bulk')
+    log.info("Bulk upload: %d readings accepted, %d lines rejected", len(accepted), rejected,
+             extra={'accepted': len(accepted), 'rejected': rejected})
+    return jsonify({
+        'accepted': len(accepted),
+        'rejected': rejected,
+        'status': statuses
+    })
+
 @app.route('/api/update_consumption', methods=['POST'])
 @swag_from({
     'tags': ['Meter Readings'],
@@ -1347,7 +2236,9 @@ def api_latest_reading(meter_number):
             'name': 'body',
             'in': 'body',
             'required': True,
-            'description': 'Consumption data to update',
+            'description': ('Consumption data to update. Either one reading, a list of readings, '
+                            'or {"meter_number": ..., "readings": [...]}; each reading may carry '
+                            '`ts` (epoch seconds or ISO 8601 UTC).'),
             'schema': {
                 'type': 'object',
                 'required': ['meter_number', 'voltage', 'current', 'power_consumed'],
@@ -1355,14 +2246,17 @@ def api_latest_reading(meter_number):
                     'meter_number': {'type': 'string'},
                     'voltage': {'type': 'number'},
                     'current': {'type': 'number'},
-                    'power_consumed': {'type': 'number'}
+                    'power_consumed': {'type': 'number'},
+                    'ts': {'type': 'number'},
+                    'readings': {'type': 'array', 'items': {'type': 'object'}}
                 }
             }
         }
     ],
     'responses': {
         200: {
-            'description': 'Consumption updated successfully',
+            'description': ('Consumption updated successfully. Batched payloads return accepted, '
+                            'remaining_power per meter and unknown_meters.'),
             'schema': {
                 'type': 'object',
                 'properties': {
@@ -1383,35 +2277,34 @@ def api_latest_reading(meter_number):
     }
 })
 def api_update_consumption():
-    print("Received update_consumption request")
-    data = request.json
-    meter_number = data.get('meter_number')
-    print("Meter number from request:", meter_number)
-    voltage = data.get('voltage')
-    current = data.get('current')
-    power_consumed = data.get('power_consumed', 0.0)
-    user = User.query.filter_by(meter_number=meter_number).first()
-    if user:
-        if user.current_power > 0:
-            user.current_power -= power_consumed
-            if user.current_power < 0:
-                user.current_power = 0
-        sr = SensorReading(
-            meter_number=meter_number,
-            voltage=voltage,
-            current=current,
-            power=power_consumed
-        )
-        db.session.add(sr)
-        db.session.commit()
-        print(f"API Update - Updated user {meter_number}: remaining power = {user.current_power}")
-        return jsonify({'status': 'OK', 'remaining_power': "{:.2f}".format(user.current_power)})
-    else:
-        print(f"Meter not found: {meter_number}")
-        return jsonify({'error': 'Meter not found'}), 404
+    data = request.get_json(silent=True)
+    try:
+        rows = parse_readings(data, max_readings=app.config['MAX_READINGS_PER_PAYLOAD'])
+    except PayloadError as e:
+        ingest_errors.inc(source='http')
+        return jsonify({'error': str(e)}), 400
+    results = apply_readings(rows, store_unknown=False)
+    ingest_readings.inc(sum(1 for r in rows if results.get(r['meter_number']) is not None), source='http')
+
+    if not isinstance(data, list) and 'readings' not in data:
+        # Single reading: original response shape
+        meter_number = rows[0]['meter_number']
+        remaining_power = results.get(meter_number)
+        if remaining_power is None:
+            ingest_log.info("Meter not found: %s", meter_number, extra={'meter_number': meter_number})
+            return jsonify({'error': 'Meter not found'}), 404
+        ingest_log.debug("API Update - Updated user %s: remaining power = %s", meter_number, remaining_power,
+                         extra={'meter_number': meter_number, 'remaining_power': remaining_power})
+        return jsonify({'status': 'OK', 'remaining_power': "{:.2f}".format(remaining_power)})
+
+    ingest_log.debug("API Update - %d readings for %d meters", len(rows), len(results))
+    return jsonify({
+        'status': 'OK',
+        'accepted': sum(1 for r in rows if results.get(r['meter_number']) is not None),
+        'remaining_power': {m: "{:.2f}".format(p) for m, p in results.items() if p is not None},
+        'unknown_meters': [m for m, p in results.items() if p is None]
+    })
 
-####################################
-####################################
 @app.route('/api/relay_control', methods=['POST'])
 def relay_control():
     """
@@ -1431,6 +2324,12 @@ def relay_control():
                 'queued': False
             }), 200
 
+        if not meter_owner(meter_number):
+            return jsonify({
+                'message': f"Relay command ignored: unknown meter {meter_number}.",
+                'queued': False
+            }), 200
+
         payload = json.dumps({"meter_number": meter_number, "command": state})
 
         # publish with the CONNECTED publisher client
@@ -1445,7 +2344,7 @@ def relay_control():
 
     except Exception as e:
         # even on exception, keep API green to avoid UI failures
-        print("relay_control error:", e)
+        log.exception("relay_control error")
         return jsonify({
             'message': 'Relay command received (publish will be retried by client).',
             'queued': False
@@ -1456,50 +2355,62 @@ def relay_control():
 ####################################
 
 def mqtt_on_connect(client, userdata, flags, rc):
+    mqtt_connections.inc(result='ok' if rc == 0 else 'refused')
     if rc == 0:
-        print("Connected to MQTT broker.")
+        log.info("Connected to MQTT broker.")
         client.subscribe("power/monitor")
+        client.subscribe("power/monitor/bin")
         client.subscribe("relay/control")
     else:
-        print(f"Failed to connect, return code {rc}. Retrying in 5 seconds...")
+        log.warning("Failed to connect, return code %s. Retrying in 5 seconds...", rc)
         threading.Timer(5, lambda: client.reconnect()).start()  # Attempt reconnect
 
+def process_meter_readings(job):
+    """Debit/store one meter's readings and answer on power/update (runs on an ingest shard)."""
+    client, rows = job
+    for meter_number, remaining_power in apply_readings(rows).items():
+        if remaining_power is not None:
+            updated_power_payload = json.dumps({
+                "meter_number": meter_number,
+                "remaining_power": remaining_power
+            })
+            client.publish("power/update", updated_power_payload)
+            ingest_log.debug("Updated user %s: remaining power = %s", meter_number, remaining_power,
+                             extra={'meter_number': meter_number, 'remaining_power': remaining_power})
+        else:
+            ingest_log.info("No matching user found for meter %s.", meter_number,
+                            extra={'meter_number': meter_number})
+
+ingest_pool = (ShardedWorkerPool(process_meter_readings,
+                                 shards=app.config['INGEST_SHARDS'],
+                                 max_queue=app.config['INGEST_SHARD_QUEUE_SIZE'])
+               if app.config['INGEST_SHARDS'] > 0 else None)
+
 def mqtt_on_message(client, userdata, msg):
+    ingest_messages.inc(topic=msg.topic)
     try:
-        payload_str = msg.payload.decode()
-        print("MQTT Message received:", payload_str)
-        data = json.loads(payload_str)
-        meter_number = data.get('meter_number')
-        voltage = data.get('voltage')
-        current = data.get('current')
-        power_consumed = data.get('power_consumed', 0.0)
-
-        with app.app_context():
-            user = User.query.filter_by(meter_number=meter_number).first()
-            if user:
-                if user.current_power > 0:
-                    user.current_power -= power_consumed
-                    if user.current_power < 0:
-                        user.current_power = 0
-                updated_power_payload = json.dumps({
-                    "meter_number": meter_number,
-                    "remaining_power": user.current_power
-                })
-                client.publish("power/update", updated_power_payload)
-                print(f"Updated user {meter_number}: remaining power = {user.current_power}")
-            else:
-                print(f"No matching user found for meter {meter_number}.")
-
-            sr = SensorReading(
-                meter_number=meter_number,
-                voltage=voltage,
-                current=current,
-                power=power_consumed
-            )
-            db.session.add(sr)
-            db.session.commit()
+        if msg.topic == "power/monitor/bin":
+            rows = decode_binary_readings(msg.payload)
+            ingest_log.debug("MQTT binary message received: %d readings, %d bytes", len(rows), len(msg.payload))
+        else:
+            payload_str = msg.payload.decode()
+            ingest_log.debug("MQTT Message received: %s", payload_str)
+            data = json.loads(payload_str)
+            rows = parse_readings(data, max_readings=app.config['MAX_READINGS_PER_PAYLOAD'])
+        ingest_readings.inc(len(rows), source='mqtt')
+
+        if ingest_pool is None:
+            process_meter_readings((client, rows))
+            return
+        # Same meter -> same shard, so each meter's readings stay in order.
+        per_meter = {}
+        for row in rows:
+            per_meter.setdefault(row['meter_number'], []).append(row)
+        for meter_number, meter_rows in per_meter.items():
+            ingest_pool.submit(meter_number, (client, meter_rows))
     except Exception as e:
-        print("Error processing MQTT message:", e)
+        ingest_errors.inc(source='mqtt')
+        log.warning("Error processing MQTT message: %s", e, extra={'topic': msg.topic})
 
 # Now assign the function as a callback
 mqtt_client = mqtt.Client()
@@ -1509,14 +2420,16 @@ mqtt_client.on_message = mqtt_on_message
 def start_mqtt_subscriber():
     mqtt_client = mqtt.Client()
     mqtt_client.on_connect = mqtt_on_connect
+    mqtt_client.on_disconnect = lambda client, userdata, rc: mqtt_disconnects.inc()
     mqtt_client.on_message = mqtt_on_message
 
     try:
         mqtt_client.connect(mqtt_server, mqtt_port, 60)
-        print("Starting MQTT subscriber loop...")
+        log.info("Starting MQTT subscriber loop...")
         mqtt_client.loop_forever()
     except Exception as e:
-        print(f"MQTT connection error: {e}. Retrying in 10 seconds...")
+        mqtt_connections.inc(result='error')
+        log.warning("MQTT connection error: %s. Retrying in 10 seconds...", e)
         threading.Timer(10, start_mqtt_subscriber).start()  # Reconnect loop
 
 @app.route('/api/current_power/<meter_number>')
@@ -1554,28 +2467,222 @@ def start_mqtt_subscriber():
     }
 })
 def api_current_power(meter_number):
-    print("Querying current power for meter:", meter_number)
-    user = User.query.filter_by(meter_number=meter_number).first()
-    if user:
-        current_power = round(user.current_power, 2)
-        print(f"Found user {meter_number}: current power = {current_power}")
+    balance = ledger.get(meter_number)
+    if balance is not None:
+        current_power = round(balance, 2)
         return jsonify({'current_power': "{:.2f}".format(current_power)})
     else:
-        print("Meter not found for:", meter_number)
         return jsonify({'error': 'Meter not found'}), 404
 
+# Default time span returned by /api/consumption for each bucket size
+CONSUMPTION_DEFAULT_SPAN = {
+    'minute': timedelta(hours=6),
+    'hour': timedelta(days=7),
+    'day': timedelta(days=90),
+}
+
+@app.route('/api/consumption/<meter_number>')
+@swag_from({
+    'tags': ['Meter Readings'],
+    'summary': 'Historic consumption for a meter, from pre-aggregated rollups',
+    'parameters': [
+        {
+            'name': 'meter_number',
+            'in': 'path',
+            'type': 'string',
+            'required': True,
+            'description': 'Meter number'
+        },
+        {
+            'name': 'bucket',
+            'in': 'query',
+            'type': 'string',
+            'enum': ['minute', 'hour', 'day'],
+            'required': False,
+            'description': 'Bucket size (default hour)'
+        },
+        {
+            'name': 'from',
+            'in': 'query',
+            'type': 'string',
+            'format': 'date-time',
+            'required': False,
+            'description': 'Start of the range, ISO 8601 UTC (default depends on bucket)'
+        },
+        {
+            'name': 'to',
+            'in': 'query',
+            'type': 'string',
+            'format': 'date-time',
+            'required': False,
+            'description': 'End of the range, ISO 8601 UTC (default now)'
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'One entry per bucket with count, consumption and averages'
+        },
+        400: {
+            'description': 'Invalid bucket or date'
+        }
+    }
+})
+def api_consumption(meter_number):
+    bucket = request.args.get('bucket', 'hour')
+    if bucket not in BUCKETS:
+        return jsonify({'error': f"bucket must be one of {', '.join(BUCKETS)}"}), 400
+    try:
+        end = datetime.fromisoformat(request.args['to']) if request.args.get('to') else datetime.utcnow()
+        start = (datetime.fromisoformat(request.args['from']) if request.args.get('from')
+                 else end - CONSUMPTION_DEFAULT_SPAN[bucket])
+    except ValueError:
+        return jsonify({'error': 'from/to must be ISO 8601 dates'}), 400
+
+    rows = (SensorRollup.query
+            .filter(SensorRollup.meter_number == meter_number,
+                    SensorRollup.bucket == bucket,
+                    SensorRollup.bucket_start >= start,
+                    SensorRollup.bucket_start < end)
+            .order_by(SensorRollup.bucket_start)
+            .all())
+    buckets = [{
+        'bucket_start': r.bucket_start.strftime('%Y-%m-%d %H:%M:%S'),
+        'count': r.count,
+        'consumed': round(r.power_sum, 4),
+        'power_min': r.power_min,
+        'power_max': r.power_max,
+        'avg_power': round(r.power_sum / r.count, 4) if r.count else 0.0,
+        'avg_voltage': round(r.voltage_sum / r.count, 4) if r.count else 0.0,
+        'avg_current': round(r.current_sum / r.count, 4) if r.count else 0.0
+    } for r in rows]
+    return jsonify({
+        'meter_number': meter_number,
+        'bucket': bucket,
+        'from': start.strftime('%Y-%m-%d %H:%M:%S'),
+        'to': end.strftime('%Y-%m-%d %H:%M:%S'),
+        'total_consumed': round(sum(r.power_sum for r in rows), 4),
+        'buckets': buckets
+    })
+
+@app.route('/api/ingest/status')
+@swag_from({
+    'tags': ['Meter Readings'],
+    'summary': 'Ingest pipeline queue depths',
+    'responses': {
+        200: {
+            'description': ('Per-shard queue depth, high-water mark, processed/error/dropped '
+                            'counts, plus the batch writer queue')
+        }
+    }
+})
+def api_ingest_status():
+    return jsonify({
+        'shards': ingest_pool.stats() if ingest_pool is not None else [],
+        'writer': {
+            'depth': ingest_writer.qsize(),
+            'dropped': ingest_writer.dropped,
+            'failed': ingest_writer.failed
+        }
+    })
+
+def sse_response(stream):
+    return Response(stream, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # keep nginx from buffering the stream
+    })
+
+@app.route('/api/stream/meter/<meter_number>')
+@swag_from({
+    'tags': ['Meter Readings'],
+    'summary': 'Live power updates for a meter (Server-Sent Events)',
+    'description': 'Sends the current power immediately, then one event per new reading or purchase',
+    'produces': ['text/event-stream'],
+    'parameters': [
+        {
+            'name': 'meter_number',
+            'in': 'path',
+            'type': 'string',
+            'required': True,
+            'description': 'Meter number to follow'
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Event stream; each event carries meter_number, current_power and reading_time'
+        },
+        404: {
+            'description': 'Meter not found'
+        }
+    }
+})
+def stream_meter(meter_number):
+    balance = ledger.get(meter_number)
+    if balance is None:
+        return jsonify({'error': 'Meter not found'}), 404
+    initial = {"meter_number": meter_number, "current_power": "{:.2f}".format(balance)}
+    return sse_response(event_broker.stream('meter:' + meter_number, initial))
+
+@app.route('/api/stream/admin/users')
+@swag_from({
+    'tags': ['Admin'],
+    'summary': 'Live changes to the user table (Server-Sent Events)',
+    'description': "Emits 'balance' (meter_number, current_power), 'user' (full row) and 'delete' (id) events",
+    'produces': ['text/event-stream'],
+    'responses': {
+        200: {
+            'description': 'Event stream of user table changes'
+        }
+    }
+})
+def stream_admin_users():
+    return sse_response(event_broker.stream('admin:users'))
+
 ####################################
-# Main Execution: Start Flask and MQTT Subscriber
+# Startup
 ####################################
-if __name__ == "__main__":
+def start_services():
+    """
+    Start the background parts of the served app: the logging pipeline, the
+    balance ledger, the ingest writer and workers, and the MQTT subscriber.  Called once by the
+    serving process (`python zion.py`, or gunicorn through gunicorn.conf.py).
+    Raises LedgerLocked if another process already serves the app.
+    """
+    # Installed here rather than at import, so CLI commands and migrations
+    # keep the default logging; call again after changing the LOG_* settings.
+    configure_logging()
+    # Load balances (taking the single-process journal lock) and start the
+    # ledger flusher and the batched ingest writer before any messages arrive
+    ledger.start()
+    ingest_writer.start()
+    if ingest_pool is not None:
+        ingest_pool.start()
+    # Fill the meter autocomplete index now rather than on the first keystroke
+    with app.app_context():
+        meter_index.reload()
+
     # Start MQTT subscriber in a separate thread
     mqtt_thread = threading.Thread(target=start_mqtt_subscriber)
     mqtt_thread.daemon = True
     mqtt_thread.start()
 
+####################################
+# Main Execution: Start Flask and MQTT Subscriber
+####################################
+if __name__ == "__main__":
+    debug = True
+
+    # With debug=True this block also runs in the reloader's watcher process;
+    # only the serving child may own the ledger (one process, see ledger.py)
+    # and the MQTT subscription.
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        try:
+            start_services()
+        except LedgerLocked as e:
+            sys.exit(f"Not starting: {e}")
+
     # Run Flask app (accessible on local network)
     print("Starting Flask app...")
     print("Swagger UI available at: http://192.168.1.69:5000/swagger/")
 
     # Change host to 0.0.0.0 to allow LAN access
-    app.run(host='0.0.0.0', port=5000, debug=True, threaded=True)
+    app.run(host='0.0.0.0', port=5000, debug=debug, threaded=True)